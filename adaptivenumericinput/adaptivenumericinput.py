@@ -4,87 +4,301 @@
     in Settings.  Each range can have targeted, dynamic feedback and an
     associated score.
 """
-from math import floor
+from xml.sax.saxutils import quoteattr
 
+import copy
+import functools
+import json
 import os
-import pkg_resources
+import random
 
+from django.utils.translation import get_language
 from django.utils.translation import ungettext
 
 from xblock.core import XBlock
+from xblock.exceptions import JsonHandlerError
 from xblock.fields import Scope
 from xblock.fields import Boolean, Dict, Float, Integer, List, String
 from xblock.fragment import Fragment
+from xblock.mixins import ScopedStorageMixin
 from xblock.validation import ValidationMessage
 
 from xblockutils.studio_editable import StudioEditableXBlockMixin
 
+from .attempts import get_attempt_counter
+from .cache import LRUCache
+from .grading import FEEDBACK_DEFAULT
+from .grading import _get_float
+from .grading import credit_score_and_error
+from .grading import get_cache_stats
+from .grading import get_feedback_template
+from .grading import get_graded_answer
+from .grading import get_grading_table
+from .grading import normalize_credit_dict
+from .grading import quantize_score
+from .metrics import StageTimer
+from .metrics import get_handler_metrics
+from .metrics import get_metrics_exporter
+from .profiling import SamplingProfiler
+from .profiling import get_profile_sink
+from .ratelimit import get_rate_limiter
+from .resources import get_package_string
+from .resources import get_resource_string
+from .resources import get_template
+from .resources import get_template_stats
+from .storage import PackedFieldData
+from .tracing import NULL_SPAN
+from .tracing import get_span_sink
+from .tracing import get_tracer
 from .utils import _
 
 
-# List of available %%-encoded keywords that instructors can use in feedback
-# They will be replaced with numeric values or '--' if they do not exist
-FEEDBACK_LIST = [
-    '%%ANSWER%%',
-    '%%ERROR_ABSOLUTE%%',
-    '%%ERROR_PERCENT%%',
-    '%%STUDENT_ANSWER%%',
-    '%%STUDENT_ERROR%%',
-]
+# Rendered student_view fragments, shared by blocks whose rendered settings
+# and user state match.  Disabled unless RENDER_CACHE_SIZE is set.
+_RENDER_CACHE = LRUCache(maxsize=0)
 
 
-def _answer_error(actual_answer, answer):
-    # Returns percent and absolute error of 'answer' from 'actual_answer'
-    # If 'actual_answer' is zero then percent_error will be None
-    # since it cannot be determined for that case.
-    absolute_error = None
-    percent_error = None
-    if actual_answer is not None and answer is not None:
-        absolute_error = abs(actual_answer - answer)
-        if actual_answer:
-            percent_error = 100 * (absolute_error / abs(actual_answer))
-    return absolute_error, percent_error
+def _copy_fragment(fragment):
+    # Cached fragments are shared, so callers get their own copy
+    fragment_copy = Fragment(fragment.content)
+    fragment_copy.add_frag_resources(fragment)
+    if fragment.js_init_fn:
+        fragment_copy.initialize_js(
+            fragment.js_init_fn,
+            fragment.json_init_args,
+        )
+    return fragment_copy
+
+
+def timed_handler(handler):
+    """
+    Wraps a handler to time its stages if HANDLER_METRICS is enabled
+    The handler marks its own stages with mark_stage, the response and
+    the field writes are timed here.
+    """
+    @functools.wraps(handler)
+    def wrapper(self, request, suffix=''):
+        """
+        Times the handler call
+        """
+        # pylint: disable=protected-access
+        if not self.get_xblock_setting('HANDLER_METRICS', False):
+            return handler(self, request, suffix)
+        timer = StageTimer(handler.__name__)
+        self._stage_timer = timer
+        try:
+            response = handler(self, request, suffix)
+            timer.mark('respond')
+            # The runtime saves the block after the handler, saving it
+            # here times the field writes and leaves nothing for it to do
+            self.save()
+            timer.mark('save')
+        finally:
+            self._stage_timer = None
+        get_handler_metrics().record_timer(timer)
+        get_metrics_exporter(
+            self.get_xblock_setting('METRICS_EXPORTER'),
+        ).export(timer.handler, timer.get_stages())
+        return response
+    return wrapper
+
+
+def profiled_handler(handler):
+    """
+    Wraps a handler to run it under the sampling profiler if the call
+    is sampled, see AdaptiveNumericInput.is_profiled
+    """
+    @functools.wraps(handler)
+    def wrapper(self, request, suffix=''):
+        """
+        Profiles the handler call
+        """
+        if not self.is_profiled(request):
+            return handler(self, request, suffix)
+        profiler = SamplingProfiler()
+        try:
+            with profiler:
+                return handler(self, request, suffix)
+        finally:
+            get_profile_sink(
+                self.get_xblock_setting('PROFILE_SINK'),
+            ).record(unicode(self.scope_ids.usage_id), profiler.stacks)
+    return wrapper
 
 
-def _get_float(value):
-    try:
-        return float(value)
-    except ValueError:
-        return None
-    except TypeError:
-        return None
+# Request header course staff set to profile a handler call
+PROFILE_HEADER = 'X-AdaptiveNumericInput-Profile'
+
+# Most answers graded by one submit_all request
+SUBMIT_ALL_MAX_ANSWERS = 100
+
+# Longest submission token view.js may send with a submission
+SUBMISSION_TOKEN_MAX_LENGTH = 64
+
+
+# Preset scenario files ordered based on complexity
+SCENARIO_FILES = (
+    'absoltue_error.html',
+    'default_common_mistake.html',
+    'default_multi_full_credit.html',
+    'range_blocking.html',
+    'variables_example.html',
+    'bakers_dozen.html',
+    'temp_conversion.html',
+)
+
+# Size of the synthetic load test scenario in the workbench
+LOAD_TEST_BLOCKS = int(
+    os.environ.get('ADAPTIVENUMERICINPUT_LOAD_TEST_BLOCKS', 20)
+)
+LOAD_TEST_CREDIT_LIST_SIZE = int(
+    os.environ.get('ADAPTIVENUMERICINPUT_LOAD_TEST_CREDIT_LIST_SIZE', 100)
+)
+
+# Largest power of ten of the synthetic common mistakes
+_SYNTHETIC_MAX_EXPONENT = 6
+
+_SCENARIOS = {}
 
 
 def _read_scenario_files():
     # Loads preset scenario files and returns them as a quote enclosed string
-    # Files are ordered based on complexity
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    scenario_files = [
-        'absoltue_error.html',
-        'default_common_mistake.html',
-        'default_multi_full_credit.html',
-        'range_blocking.html',
-        'variables_example.html',
-        'bakers_dozen.html',
-        'temp_conversion.html',
-    ]
-    scenarios = '<adaptivenumericinput />'
-    for scenario_file in scenario_files:
-        scenario = open(dir_path + '/scenarios/' + scenario_file, 'r')
-        scenarios += scenario.read()
-    scenarios_string = '''<sequence_demo>{scenarios}</sequence_demo>'''.format(
-        scenarios=scenarios,
-    )
+    # The string is built once per process
+    scenarios_string = _SCENARIOS.get('presets')
+    if scenarios_string is None:
+        scenarios = '<adaptivenumericinput />' + ''.join(
+            get_package_string('scenarios/' + scenario_file)
+            for scenario_file in SCENARIO_FILES
+        )
+        scenarios_string = (
+            '''<sequence_demo>{scenarios}</sequence_demo>'''.format(
+                scenarios=scenarios,
+            )
+        )
+        _SCENARIOS['presets'] = scenarios_string
     return scenarios_string
 
 
+def _synthetic_credit_list(instructor_answer, size, tolerance='percent'):
+    # Error ranges around the answer, 'percent' or 'absolute', followed
+    # by common mistakes, answers off by a power of ten and answers with
+    # the wrong sign, 'size' credit dicts in total.  Mistakes repeat
+    # beyond _SYNTHETIC_MAX_EXPONENT powers of ten so answers stay finite.
+    error_key = 'error_' + tolerance
+    ranges = (size + 1) // 2
+    credit_list = []
+    for index in range(ranges):
+        error = index * 100.0 / ranges
+        if tolerance == 'absolute':
+            error = error * abs(instructor_answer) / 100
+        credit_list.append({
+            error_key: str(error),
+            'score': str(round(1 - float(index) / ranges, 1)),
+        })
+    for index in range(size - ranges):
+        exponent = index // 2 % _SYNTHETIC_MAX_EXPONENT + 1
+        if index % 2 == 0:
+            answer = instructor_answer * 10 ** exponent
+            feedback = 'is off by a power of ten.'
+        elif exponent == 1:
+            answer = -instructor_answer
+            feedback = 'has the wrong sign.'
+        else:
+            answer = -instructor_answer * 10 ** (exponent - 1)
+            feedback = 'has the wrong sign and is off by a power of ten.'
+        credit_list.append({
+            'answer': str(answer),
+            error_key: '1',
+            'feedback': 'Common mistake %%STUDENT_ANSWER%% ' + feedback,
+            'score': '0',
+        })
+    return credit_list
+
+
+def synthetic_scenario(block_count, credit_list_size):
+    """
+    Returns a vertical_demo scenario of 'block_count' blocks, each with a
+    'credit_list_size' entry credit list, to load test the workbench
+    """
+    scenario_key = ('synthetic', block_count, credit_list_size)
+    if scenario_key in _SCENARIOS:
+        return _SCENARIOS[scenario_key]
+    blocks = []
+    for index in range(block_count):
+        instructor_answer = index + 1
+        blocks.append(
+            '<adaptivenumericinput credit_list={credit_list} '
+            'display_name={display_name} instructor_answer="{answer}" '
+            'prompt={prompt} />'.format(
+                answer=instructor_answer,
+                credit_list=quoteattr(json.dumps(_synthetic_credit_list(
+                    instructor_answer,
+                    credit_list_size,
+                ))),
+                display_name=quoteattr(
+                    'Synthetic problem {number}'.format(number=index + 1)
+                ),
+                prompt=quoteattr(
+                    'What is {answer}?'.format(answer=instructor_answer)
+                ),
+            )
+        )
+    scenario = '<vertical_demo>{blocks}</vertical_demo>'.format(
+        blocks=''.join(blocks),
+    )
+    _SCENARIOS[scenario_key] = scenario
+    return scenario
+
+
+@XBlock.wants('settings')
+@XBlock.wants('user')
 class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
     # pylint: disable=too-many-ancestors, too-many-instance-attributes
-    # pylint: disable=too-many-public-methods
+    # pylint: disable=too-many-public-methods, too-many-lines
     """
     This xblock provides a way for instrutors to give targeted feedback
     to students on numeric reponse problems.
+
+    Operators can tune the block through the XBlock settings service,
+    e.g. XBLOCK_SETTINGS['adaptivenumericinput'] in the LMS:
+        RENDER_CACHE_SIZE, number of student_view fragments cached per
+            process, 0 disables the render cache
+        RENDER_CACHE_TTL, seconds a cached student_view fragment is used
+        COMPACT_USER_STATE, keep learner state in packed_state so each
+            submission is saved in one write
+        PERSIST_HINT_COUNTER, False to not save which hint a learner saw
+            last, hints then restart from the first one on every view
+        AUTOSAVE_INTERVAL, seconds between draft answers view.js saves as
+            the learner types, 0 disables autosave
+        SUBMIT_ALL, True to submit the answers to every block on a page
+            together, in one submit_all request
+        ATTEMPT_COUNTER, dotted path of the class attempts are claimed
+            from, see attempts.py, defaults to a per process counter
+        SUBMIT_RATE, submissions a second each learner may make to a
+            block over time, 0 disables rate limiting
+        SUBMIT_BURST, submissions a learner may make at once, default 5
+        RATE_LIMITER, dotted path of the class submissions are rate
+            limited by, see ratelimit.py, defaults to a per process limiter
+        HANDLER_METRICS, True to count the duration of each handler
+            stage into per process histograms, see metrics.py
+        METRICS_EXPORTER, dotted path of the class each timed handler
+            call is also exported to, e.g. metrics.LogExporter or
+            metrics.StatsdExporter, defaults to an in memory exporter
+        TRACING, True to record spans around the stages of submissions,
+            see tracing.py
+        SPAN_SINK, dotted path of the class spans are recorded by, e.g.
+            tracing.JsonFileSink, defaults to an in memory ring buffer
+        PROFILE_SAMPLE_RATE, fraction of handler calls run under the
+            sampling profiler, see profiling.py, 0 disables sampling.
+            Course staff can profile a call with the
+            X-AdaptiveNumericInput-Profile: 1 request header.
+        PROFILE_USAGE_IDS, usage ids of the only blocks sampled, all
+            blocks are sampled if it is not set
+        PROFILE_SINK, dotted path of the class profiles are written by,
+            e.g. profiling.CollapsedStackFileSink, defaults to in memory
     """
+    block_settings_key = 'adaptivenumericinput'
+
     display_correctness = Boolean(
         display_name=_('Display Correctness?'),
         help=_(
@@ -131,7 +345,7 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
             'This is the default feedback used for credit dictionaries '
             'if feedback is left out.'
         ),
-        default='Answer is within %%ERROR_PERCENT%% percent.',
+        default=FEEDBACK_DEFAULT,
         scope=Scope.settings,
     )
     hints = List(
@@ -216,11 +430,14 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         default=0,
         scope=Scope.user_state,
     )
-    credit_dict = Dict(
-        default={},
+    # The credit dict matched by the last graded submission is stored as
+    # its index in credit_list, with the grading table fingerprint of the
+    # credit_list it indexes, see credit_dict.
+    credit_index = Integer(
+        default=None,
         scope=Scope.user_state,
     )
-    feedback_message = String(
+    credit_version = String(
         default='',
         scope=Scope.user_state,
     )
@@ -240,6 +457,27 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         default=None,
         scope=Scope.user_state,
     )
+    student_error = Float(
+        default=None,
+        scope=Scope.user_state,
+    )
+    # Last score published in a grade event, so unchanged scores are not
+    # published again
+    published_score = Float(
+        default=None,
+        scope=Scope.user_state,
+    )
+    # Token view.js sent with the last graded submission, so retries of
+    # it with the same answer, student_answer_float, are not graded again
+    submission_token = String(
+        default='',
+        scope=Scope.user_state,
+    )
+    # Learner state when COMPACT_USER_STATE is enabled, see storage.py
+    packed_state = Dict(
+        default={},
+        scope=Scope.user_state,
+    )
 
     editable_fields = (
         'display_name',
@@ -255,6 +493,35 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         'saved_message',
     )
 
+    @property
+    def _field_data(self):
+        """
+        Returns the FieldData for this block, which packs learner state
+        into packed_state if COMPACT_USER_STATE is enabled
+        """
+        # pylint: disable=attribute-defined-outside-init
+        # pylint: disable=no-member, protected-access
+        field_data = ScopedStorageMixin._field_data.fget(self)
+        compact = getattr(self, '_compact_user_state', None)
+        if compact is None:
+            compact = bool(self.get_xblock_setting('COMPACT_USER_STATE'))
+            self._compact_user_state = compact
+        if not compact:
+            return field_data
+        packed_field_data = getattr(self, '_packed_field_data', None)
+        if (
+                packed_field_data is None or
+                packed_field_data.field_data is not field_data
+        ):
+            packed_field_data = PackedFieldData(field_data)
+            self._packed_field_data = packed_field_data
+        return packed_field_data
+
+    @_field_data.setter
+    def _field_data(self, field_data):
+        # pylint: disable=no-member, protected-access
+        ScopedStorageMixin._field_data.fset(self, field_data)
+
     def build_fragment(
             self,
             fragment_js=None,
@@ -263,6 +530,7 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
             paths_js=[],
             urls_css=[],
             urls_js=[],
+            json_init_args=None,
     ):
         #  pylint: disable=dangerous-default-value, too-many-arguments
         """
@@ -270,7 +538,7 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         """
         fragment = Fragment(html_source)
         if fragment_js:
-            fragment.initialize_js(fragment_js)
+            fragment.initialize_js(fragment_js, json_init_args)
         for path in paths_css:
             url = self.get_resource_url(path)
             fragment.add_css_url(url)
@@ -360,9 +628,9 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
     def get_feedback_message(self):
         """
         Builds feedback_message from a credit_dict
-        Replaces all %%-encoded words using FEEDBACK_LIST
-        Iterates through all keywords that may be substituted and replaces
-        them with the string formated field attributes in self.
+        Replaces all %%-encoded words using FEEDBACK_LIST with the string
+        formated values in the credit dict, using a feedback template
+        compiled once per distinct feedback text.
         Return the modified feedback text
         """
         feedback_message = ''
@@ -371,18 +639,9 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
             if self.credit_dict.get('feedback') is not None:
                 feedback_message = self.credit_dict['feedback']
         if feedback_message:
-            for key in FEEDBACK_LIST:
-                # First 2 chars and last two chars are '%',
-                # so they are removed.  The remaining string lowered
-                # could be a value in the credit dict.
-                credit_key = str(key.lower()[2:-2])
-                value = self.credit_dict.get(credit_key)
-                if value is None:
-                    value = '--'
-                feedback_message = feedback_message.replace(
-                    key,
-                    str(value)
-                )
+            feedback_message = get_feedback_template(
+                feedback_message
+            ).render(self.credit_dict)
         return feedback_message
 
     def get_feedback_message_label(self):
@@ -406,16 +665,43 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         hints_total = len(self.hints)
         if hints_total > 0:
             hint_mod = self.hint_counter % hints_total
-            result = _(
+            result = self.get_hint_messages()[hint_mod]
+            self.hint_counter += 1
+        return result
+
+    def get_hint_messages(self):
+        """
+        Returns the message displayed for each hint, in order
+        These are sent with student_view so hints are cycled in the
+        browser without a request per hint.
+        """
+        hints_total = len(self.hints)
+        return [
+            _(
                 "Hint ({hint_number} of {hints_total}): "
                 "{hint}",
             ).format(
-                hint_number=hint_mod + 1,
+                hint_number=hint_number,
                 hints_total=hints_total,
-                hint=self.hints[hint_mod],
+                hint=hint,
             )
-            self.hint_counter += 1
-        return result
+            for hint_number, hint in enumerate(self.hints, 1)
+        ]
+
+    def get_autosave_interval(self):
+        """
+        Returns the milliseconds between view.js autosaves, 0 if disabled
+        """
+        return int(self.get_xblock_setting('AUTOSAVE_INTERVAL', 0) * 1000)
+
+    def get_hint_counter(self):
+        """
+        Returns the number of hints the learner has been shown
+        Always 0 if PERSIST_HINT_COUNTER is disabled.
+        """
+        if not self.get_xblock_setting('PERSIST_HINT_COUNTER', True):
+            return 0
+        return self.hint_counter
 
     def get_progress_message(self):
         """
@@ -467,10 +753,69 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
     def get_resource_string(cls, path):
         """
         Retrieve string contents for the file path
+        Contents are read once per process.
         """
-        path = os.path.join('public', path)
-        resource_string = pkg_resources.resource_string(__name__, path)
-        return resource_string.decode('utf8')
+        return get_resource_string(path)
+
+    def get_render_cache(self):
+        """
+        Returns the process wide student_view render cache
+        Returns None if it is not enabled in XBlock settings
+        """
+        maxsize = self.get_xblock_setting('RENDER_CACHE_SIZE', 0)
+        if not maxsize:
+            return None
+        _RENDER_CACHE.maxsize = maxsize
+        _RENDER_CACHE.ttl = self.get_xblock_setting('RENDER_CACHE_TTL', 60)
+        return _RENDER_CACHE
+
+    def get_render_cache_key(self):
+        """
+        Returns the values that student_view output depends on
+        """
+        return (
+            get_language(),
+            self.get_resource_url('view.less.min.css'),
+            self.get_resource_url('view.js.min.js'),
+            self.display_correctness,
+            self.display_name,
+            json.dumps(self.get_view_init_args(), sort_keys=True),
+            self.max_attempts,
+            self.prompt,
+            self.weight,
+            self.count_attempts,
+            self.score,
+            self.student_answer,
+        )
+
+    def get_sibling_block(self, usage_id):
+        """
+        Returns the AdaptiveNumericInput with usage_id among this block's
+        parent's children, for the same learner
+        Returns None if there is no such block on the page.
+        """
+        if usage_id == unicode(self.scope_ids.usage_id):
+            return self
+        parent = self.get_parent()
+        if parent is None:
+            return None
+        child_id = next(
+            (
+                child_id for child_id in parent.children
+                if unicode(child_id) == usage_id
+            ),
+            None,
+        )
+        if child_id is None:
+            return None
+        try:
+            block = self.runtime.get_block(child_id)
+        except Exception:  # pylint: disable=broad-except
+            # Runtimes raise their own errors for unknown usages
+            return None
+        if not isinstance(block, AdaptiveNumericInput):
+            return None
+        return block
 
     def get_resource_url(self, path):
         """
@@ -480,18 +825,108 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         resource_url = self.runtime.local_resource_url(self, path)
         return resource_url
 
+    def get_view_init_args(self):
+        """
+        Returns the arguments view.js is initialized with
+        """
+        init_args = {
+            'autosave_interval': self.get_autosave_interval(),
+            'hint_counter': self.get_hint_counter(),
+            'hint_messages': self.get_hint_messages(),
+            'submit_all': False,
+        }
+        if self.get_xblock_setting('SUBMIT_ALL', False):
+            init_args['submit_all'] = True
+            init_args['usage_id'] = unicode(self.scope_ids.usage_id)
+        return init_args
+
+    def get_xblock_setting(self, name, default=None):
+        """
+        Returns an operator setting for this block type from the XBlock
+        settings service, or default if it is not set or not available
+        """
+        settings_service = self.runtime.service(self, 'settings')
+        if settings_service:
+            xblock_settings = settings_service.get_settings_bucket(
+                self,
+                default={},
+            )
+            return xblock_settings.get(name, default)
+        return default
+
+    def set_user_state(self, **values):
+        """
+        Sets the user state fields whose values changed
+        Unchanged fields are not marked dirty, so saving the block does
+        not write them again.
+        """
+        for name, value in values.items():
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+
+    def mark_stage(self, stage):
+        """
+        Ends a timed stage of the current handler call, if it is timed
+        """
+        timer = getattr(self, '_stage_timer', None)
+        if timer is not None:
+            timer.mark(stage)
+
+    def trace_span(self, name, root=False, **attributes):
+        """
+        Returns a span to enter around a stage of the current request
+        A root span starts a trace if TRACING is enabled, other spans are
+        only recorded inside a trace.
+        """
+        tracer = get_tracer()
+        if root:
+            if not self.get_xblock_setting('TRACING', False):
+                return NULL_SPAN
+            return tracer.start_span(
+                name,
+                sink=get_span_sink(self.get_xblock_setting('SPAN_SINK')),
+                **attributes
+            )
+        if tracer.get_active_span() is None:
+            return NULL_SPAN
+        return tracer.start_span(name, **attributes)
+
+    def set_hint_counter(self, data):
+        """
+        Saves the hint counter sent by view.js with a submit or save
+        Hints are cycled in the browser, so the counter is only saved
+        along with the learner's next answer, if PERSIST_HINT_COUNTER
+        is enabled.
+        """
+        if not self.get_xblock_setting('PERSIST_HINT_COUNTER', True):
+            return
+        try:
+            hint_counter = int(data['hint_counter'])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.set_user_state(hint_counter=hint_counter)
+
     def set_score(self):
         """
         Determines score and publishes the user's score for the XBlock
         based on their answer.
         """
         score = 0.0
-        if self.credit_dict and self.credit_dict.get('score') is not None:
-            final_score = self.credit_dict.get('score')
+        if self.credit_dict:
             # Only accepts score between 0 and 1 and limits them to one decimal
-            if final_score >= 0 and final_score <= 1:
-                score = floor(10 * final_score) / 10
-        self.score = score
+            score = quantize_score(self.credit_dict.get('score'))
+        self.set_user_state(score=score)
+        self.publish_grade()
+
+    def publish_grade(self):
+        """
+        Publishes the user's score if it changed since it was last published
+        Every change is published as it happens, so the gradebook never
+        waits for a later request from the learner.
+        """
+        if self.score == self.published_score:
+            return
+        self.mark_stage('score')
         self.runtime.publish(
             self,
             'grade',
@@ -500,28 +935,40 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
                 'max_value': 1,
             }
         )
+        self.mark_stage('publish')
+        self.set_user_state(published_score=self.score)
 
+    @profiled_handler
+    @timed_handler
     @XBlock.json_handler
     def hint_reponse(self, data, suffix=''):
         # pylint: disable=unused-argument
         """
         Processes the user's hint request
         Does not impact any other UI elements
+        view.js cycles the hints sent with student_view instead, this
+        handler is kept for pages loaded before that.
         """
+        self.mark_stage('parse')
         result = {
             'status': 'success',
             'hint_message': self.get_hint_message(),
         }
         return result
 
+    @profiled_handler
+    @timed_handler
     @XBlock.json_handler
     def save_response(self, data, suffix=''):
         # pylint: disable=unused-argument
         """
         Processes the user's save
         """
+        self.mark_stage('parse')
+        self.set_hint_counter(data)
+        # An unchanged draft is not saved again
         if self.max_attempts == 0 or self.count_attempts < self.max_attempts:
-            self.student_answer = data['student_answer']
+            self.set_user_state(student_answer=data['student_answer'])
         result = {
             'status': 'success',
             'hide_submit_class': self.get_css_hide_submit(),
@@ -531,15 +978,51 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         }
         return result
 
+    @profiled_handler
+    @timed_handler
+    @XBlock.json_handler
+    def autosave_response(self, data, suffix=''):
+        # pylint: disable=unused-argument
+        """
+        Processes a draft saved by view.js as the learner types
+        Unlike save_response it only reports whether the draft was saved,
+        which it is not once all attempts are used.
+        """
+        self.mark_stage('parse')
+        saved = (
+            self.max_attempts == 0 or
+            self.count_attempts < self.max_attempts
+        )
+        if saved:
+            self.set_hint_counter(data)
+            self.set_user_state(student_answer=data['student_answer'])
+        return {
+            'status': 'success',
+            'saved': saved,
+        }
+
     def student_view(self, context=None):
         # pylint: disable=unused-argument
         """
         The primary view of the AdaptiveNumericInput,
         shown to students when viewing courses.
+        Served from the render cache when it is enabled.
+        """
+        render_cache = self.get_render_cache()
+        if render_cache is None:
+            return self.render_student_view()
+        key = self.get_render_cache_key()
+        fragment = render_cache.get(key)
+        if fragment is None:
+            fragment = self.render_student_view()
+            render_cache.set(key, fragment)
+        return _copy_fragment(fragment)
+
+    def render_student_view(self):
+        """
+        Renders the student_view fragment
         """
-        view_html = AdaptiveNumericInput.get_resource_string('view.html')
-        view_html = view_html.format(
-            self=self,
+        view_html = get_template('view.html').render(
             attempts_message=self.get_attempts_message(),
             display_name=self.display_name,
             feedback_label='',
@@ -564,37 +1047,205 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
                 'view.js.min.js',
             ],
             fragment_js='AdaptiveNumericInputView',
+            json_init_args=self.get_view_init_args(),
         )
         return fragment
 
     # Handlers to perform actions
+    @profiled_handler
+    @timed_handler
     @XBlock.json_handler
     def submit(self, data, suffix=''):
         # pylint: disable=unused-argument
         """
         Processes the user's submission
-        If submitted student_answer is not numeric
-        then function returns as if no submission occured.
+        """
+        self.mark_stage('parse')
+        usage_id = unicode(self.scope_ids.usage_id)
+        with self.trace_span('submit', root=True, usage_id=usage_id) as span:
+            result = self.grade_submission(data)
+            span.set_attribute('status', result['status'])
+        return result
+
+    @profiled_handler
+    @timed_handler
+    @XBlock.json_handler
+    def submit_all(self, data, suffix=''):
+        # pylint: disable=unused-argument
+        """
+        Processes the user's submissions to every AdaptiveNumericInput
+        on a page in one request, if SUBMIT_ALL is enabled
+        Results are keyed by usage id, with an error status for blocks
+        that could not be found.
+        """
+        self.mark_stage('parse')
+        if not self.get_xblock_setting('SUBMIT_ALL', False):
+            return {'status': 'error'}
+        results = {}
+        answers = data['answers'][:SUBMIT_ALL_MAX_ANSWERS]
+        with self.trace_span('submit_all', root=True, answers=len(answers)):
+            for answer in answers:
+                usage_id = answer.get('usage_id')
+                span = self.trace_span('grade_submission', usage_id=usage_id)
+                with span:
+                    block = self.get_sibling_block(usage_id)
+                    if block is None:
+                        results[usage_id] = {'status': 'error'}
+                        span.set_attribute('status', 'error')
+                        continue
+                    results[usage_id] = block.grade_submission(answer)
+                    span.set_attribute('status', results[usage_id]['status'])
+                    # The runtime only saves the block whose handler was
+                    # called
+                    if block is not self:
+                        block.save()
+        return {
+            'status': 'success',
+            'results': results,
+        }
+
+    @XBlock.json_handler
+    def diagnostics(self, data, suffix=''):
+        # pylint: disable=unused-argument
+        """
+        Returns what operators need to diagnose a slow problem, to course
+        staff only: handler latencies and cache stats of this process,
+        and the complexity of this block's credit_list
+        Handler latencies are only counted if HANDLER_METRICS is enabled.
+        """
+        if not self.is_staff():
+            raise JsonHandlerError(
+                403,
+                _('Only course staff can view diagnostics.'),
+            )
+        render_cache = self.get_render_cache()
+        caches = get_cache_stats()
+        caches['render'] = render_cache.get_stats() if render_cache else None
+        caches['templates'] = get_template_stats()
+        return {
+            'status': 'success',
+            'handler_metrics': bool(
+                self.get_xblock_setting('HANDLER_METRICS', False)
+            ),
+            'handlers': get_handler_metrics().get_summary(),
+            'caches': caches,
+            'credit_list': self.get_grading_table().get_complexity(),
+        }
+
+    def is_profiled(self, request):
+        """
+        Returns True if a handler call should be profiled: if course
+        staff sent PROFILE_HEADER, or if it is sampled at the
+        PROFILE_SAMPLE_RATE
+        """
+        if request.headers.get(PROFILE_HEADER) == '1' and self.is_staff():
+            return True
+        sample_rate = self.get_xblock_setting('PROFILE_SAMPLE_RATE', 0)
+        if not sample_rate:
+            return False
+        usage_ids = self.get_xblock_setting('PROFILE_USAGE_IDS')
+        if usage_ids and unicode(self.scope_ids.usage_id) not in usage_ids:
+            return False
+        return random.random() < sample_rate
+
+    def is_staff(self):
+        """
+        Returns True if the current user is course staff
+        The LMS runtime knows this itself, other runtimes may provide it
+        through the user service.
+        """
+        if getattr(self.runtime, 'user_is_staff', False):
+            return True
+        user_service = self.runtime.service(self, 'user')
+        if user_service:
+            user = user_service.get_current_user()
+            return bool(user.opt_attrs.get('edx-platform.user_is_staff'))
+        return False
+
+    def grade_submission(self, data):
+        """
+        Grades a submission and returns the result for view.js
+        If submitted student_answer is not numeric, or no attempts are
+        left, then function returns as if no submission occured and
+        the answer is not saved.
         Non numeric submissions are consider malicious.
         Blank submissions are self evident user errors.
+        Submissions over the learner's rate limit are refused before they
+        are read.
+        A submission with the same submission_token and answer as the
+        last graded one, e.g. a double click or a retry, is not graded
+        again and gets the result of the saved state.
         """
+        if not self.allow_submission():
+            return {
+                'status': 'rate_limited',
+                'message': _(
+                    'You are submitting too quickly. '
+                    'Please wait a moment and try again.'
+                ),
+            }
+        submission_token = unicode(data.get('submission_token') or '')[
+            :SUBMISSION_TOKEN_MAX_LENGTH
+        ]
+        if (
+                submission_token and
+                submission_token == self.submission_token and
+                _get_float(data.get('student_answer')) ==
+                self.student_answer_float
+        ):
+            return self.get_submit_result()
         # Return immediatly without negative impact
         # for non numeric student_answer
         # Allowing for answers equal to zero
-        self.student_answer = data['student_answer']
-        self.student_answer_float = _get_float(self.student_answer)
-        if self.student_answer_float is None:
+        self.set_hint_counter(data)
+        student_answer = data['student_answer']
+        with self.trace_span('parse') as span:
+            student_answer_float = _get_float(student_answer)
+            span.set_attribute('numeric', student_answer_float is not None)
+        self.mark_stage('answer')
+        if student_answer_float is None:
             return {'status': 'success'}
-        # Clear previous feedback_message
-        self.feedback_message = ''
         # If max was not set or max already reached then do not count score
-        if self.max_attempts == 0 or self.count_attempts < self.max_attempts:
-            self.count_attempts += 1
+        with self.trace_span('claim_attempt') as span:
+            claimed = self.claim_attempt()
+            span.set_attribute('claimed', claimed)
+        if claimed:
+            # Only graded answers are saved, student_answer_float is the
+            # answer of the last graded submission
+            self.set_user_state(
+                student_answer=student_answer,
+                student_answer_float=student_answer_float,
+            )
             # self.credit_dict, if found, is used for the feedback message
             # and in set score.
-            self.credit_dict = self.get_best_match_credit_dict()
-            self.feedback_message = self.get_feedback_message()
-            self.set_score()
+            span = self.trace_span(
+                'get_best_match_credit_dict',
+                credit_list_length=len(self.credit_list),
+            )
+            with span:
+                self.set_credit_dict(self.get_best_match_credit_dict())
+                span.set_attribute('matched', bool(self.credit_dict))
+                span.set_attribute(
+                    'credit_index',
+                    self.credit_dict.get('credit_index'),
+                )
+            self.mark_stage('grade')
+            with self.trace_span('get_feedback_message'):
+                self.feedback_message = self.get_feedback_message()
+            self.mark_stage('feedback')
+            with self.trace_span('set_score') as span:
+                self.set_score()
+                span.set_attribute('score', self.score)
+            if submission_token:
+                self.set_user_state(submission_token=submission_token)
+        with self.trace_span('get_submit_result'):
+            result = self.get_submit_result()
+        return result
+
+    def get_submit_result(self):
+        """
+        Returns the result of the last submission for view.js
+        """
         result = {
             'status': 'success',
             # Used attempts 'out of' message in settings
@@ -621,6 +1272,19 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         }
         return result
 
+    def grade_many(self, answers):
+        """
+        Grades many student answers against this block's settings at once
+        without touching user state or publishing grades.
+        'answers' may be a NumPy array, any float buffer or a sequence.
+
+        Returns parallel (scores, indexes, student_errors) arrays, where
+        scores are the values set_score would publish, indexes point into
+        self.credit_list (-1 if nothing matched) and student_errors are
+        the matched percent or absolute error (NaN if nothing matched).
+        """
+        return self.get_grading_table().grade_many(answers)
+
     def validate_field_data(self, validation, data):
         """
         Validates settings entered by the instructor.
@@ -637,6 +1301,129 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
             validation.add(msg)
 
     # Credit Dict
+    @property
+    def credit_dict(self):
+        """
+        The credit dict matched by the last graded submission
+        Rebuilt from credit_index, credit_version and student_error
+        unless it was set during this request.  Empty if credit_list
+        changed since the submission was graded.
+        """
+        credit_dict = getattr(self, '_credit_dict', None)
+        if credit_dict is None:
+            credit_dict = self.get_credit_dict()
+        return credit_dict
+
+    @credit_dict.setter
+    def credit_dict(self, credit_dict):
+        # pylint: disable=attribute-defined-outside-init
+        self._credit_dict = credit_dict
+
+    @property
+    def feedback_message(self):
+        """
+        The feedback message of the last graded submission
+        Rendered from credit_dict unless it was set during this request,
+        so it is not stored in user state.
+        """
+        feedback_message = getattr(self, '_feedback_message', None)
+        if feedback_message is None:
+            feedback_message = self.get_feedback_message()
+        return feedback_message
+
+    @feedback_message.setter
+    def feedback_message(self, feedback_message):
+        # pylint: disable=attribute-defined-outside-init
+        self._feedback_message = feedback_message
+
+    def get_credit_dict(self):
+        """
+        Rebuilds the matched credit dict from the compiled grading table
+        """
+        if self.credit_index is None:
+            return {}
+        table = self.get_grading_table()
+        if self.credit_version != table.fingerprint:
+            return {}
+        exact_answer = self.student_answer_float == self.instructor_answer
+        if self.credit_index < 0:
+            if exact_answer:
+                return {'score': 1.0}
+            return {}
+        credit_dict = table.credit_dicts[self.credit_index]
+        student_answer = get_graded_answer({
+            'student_answer': self.student_answer,
+            'student_answer_float': self.student_answer_float,
+        })[0]
+        credit_dict = dict(
+            credit_dict,
+            credit_index=self.credit_index,
+            credit_score=credit_dict['score'],
+            student_answer=student_answer,
+            student_error=self.student_error,
+        )
+        if exact_answer:
+            credit_dict['score'] = 1.0
+        return credit_dict
+
+    def set_credit_dict(self, credit_dict):
+        """
+        Sets the matched credit dict, storing only its index, the grading
+        table fingerprint and the student error in user state
+        """
+        credit_dict = credit_dict or {}
+        self.credit_dict = credit_dict
+        self.set_user_state(
+            credit_index=credit_dict.get('credit_index', -1),
+            credit_version=self.get_grading_table().fingerprint,
+            student_error=credit_dict.get('student_error'),
+        )
+
+    def allow_submission(self):
+        """
+        Returns False if the learner is over their submission rate limit
+        """
+        rate = self.get_xblock_setting('SUBMIT_RATE', 0)
+        if not rate:
+            return True
+        rate_limiter = get_rate_limiter(
+            self.get_xblock_setting('RATE_LIMITER')
+        )
+        return rate_limiter.allow(
+            (unicode(self.scope_ids.usage_id), self.scope_ids.user_id),
+            rate,
+            self.get_xblock_setting('SUBMIT_BURST', 5),
+        )
+
+    def claim_attempt(self):
+        """
+        Counts a new attempt and returns True if any attempts remain
+        Attempts are claimed with compare and set from the attempt
+        counter, with the count as its version.  A claim conflicting with
+        a concurrent submission by the same learner is retried with the
+        count that submission set, so both cannot use the last attempt.
+        Counters only keep counts while such submissions can be in flight,
+        user state is the lasting count.
+        """
+        counter = get_attempt_counter(
+            self.get_xblock_setting('ATTEMPT_COUNTER')
+        )
+        key = (unicode(self.scope_ids.usage_id), self.scope_ids.user_id)
+        expected = self.count_attempts
+        while True:
+            # The counter may be behind user state saved by another process
+            count_attempts = max(expected, self.count_attempts)
+            if 0 < self.max_attempts <= count_attempts:
+                return False
+            claimed, expected = counter.compare_and_set(
+                key,
+                expected,
+                count_attempts + 1,
+            )
+            if claimed:
+                self.count_attempts = count_attempts + 1
+                return True
+
     def copy_credit_dict(self, credit_dict):
         """
         Build a copy of credit_dict with needed defaults
@@ -647,29 +1434,15 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
                 error_percent is set to require an exact answer, i.e. 0
             'score', defaults to 0 and limited to [0, 1]
         """
-        answer = _get_float(credit_dict.get('answer'))
-        if answer is None:
-            answer = self.instructor_answer
-        error_percent = _get_float(credit_dict.get('error_percent'))
-        error_absolute = _get_float(credit_dict.get('error_absolute'))
-        if error_percent is None and error_absolute is None:
-            error_percent = 0
-        score = _get_float(credit_dict.get('score', 1.0))
-        score = max(min(1.0, score), 0.0)
-        cp_credit_dict = {
-            'answer': answer,
-            # 'credit_score' is the evaluated score which only exists if
-            # 'score' is within defined error.
-            'credit_score': None,
-            'error_percent': error_percent,
-            'error_absolute': error_absolute,
-            'feedback': credit_dict.get('feedback'),
-            # 'score' is the instructor defined score needed for
-            # feedback.
-            'score':  score,
-            'student_answer': self.student_answer,
-            'student_error': None,
-        }
+        cp_credit_dict = normalize_credit_dict(
+            credit_dict,
+            self.instructor_answer,
+        )
+        # 'credit_score' is the evaluated score which only exists if
+        # 'score' is within defined error.
+        cp_credit_dict['credit_score'] = None
+        cp_credit_dict['student_answer'] = self.student_answer
+        cp_credit_dict['student_error'] = None
         return cp_credit_dict
 
     def get_best_match_credit_dict(self):
@@ -677,14 +1450,20 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
         Find highest scored credit dict for feedback and score
         """
         best_credit_dict = None
-        high_score_list = self.get_credit_dicts_score_list()
-        if high_score_list:
-            high_score_list.sort(key=lambda x: x['error_absolute'])
-            high_score_list.sort(key=lambda x: x['error_percent'])
+        table = self.get_grading_table()
+        match = table.best_match(self.student_answer_float)
+        if match is not None:
+            index, credit_score, student_error = match
+            best_credit_dict = dict(
+                table.credit_dicts[index],
+                credit_index=index,
+                credit_score=credit_score,
+                student_answer=self.student_answer,
+                student_error=student_error,
+            )
             # Check for exact answer and force full credit but keep feedback
             if self.student_answer_float == self.instructor_answer:
-                high_score_list[0]['score'] = 1.0
-            best_credit_dict = high_score_list[0]
+                best_credit_dict['score'] = 1.0
         # No credit dicts found but has exact answer
         elif self.student_answer_float == self.instructor_answer:
             # Minimum credit dict for scoring
@@ -714,56 +1493,65 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
              found.
 
         """
-        credit_score = None
-        student_error = None
-        # Find error, percent has precedence over absolute
-        (actual_absolute_error,
-         actual_percent_error) = _answer_error(
-             answer,
-             self.student_answer_float,
-         )
-        # Percentage error arbitraily has priority over absolute error
-        if (actual_percent_error is not None and error_percent is not None and
-                round(error_percent, 6) >= round(actual_percent_error, 6)):
-            credit_score = score
-            student_error = actual_percent_error
-        elif (actual_absolute_error is not None and
-              error_absolute is not None and
-              round(error_absolute, 6) >= round(actual_absolute_error, 6)):
-            credit_score = score
-            student_error = actual_absolute_error
-        return credit_score, student_error
+        return credit_score_and_error(
+            answer,
+            error_percent,
+            error_absolute,
+            score,
+            self.student_answer_float,
+        )
 
     def get_credit_dicts_score_list(self):
         """
-        Return a list of scored credit_dicts
+        Return a list of every credit_dict matching with the highest score
+        Scores each credit dict in turn, get_best_match_credit_dict uses
+        the grading table's index instead.
         """
         score_list = []
         high_score = 0
-        for credit_dict in self.credit_list:
-            # self.credit_list items cannot be modifed so a temp dict is made
-            # and set with defaults.
-            # Copied credit dicts hold adaptive feedback variables.  They
-            # are used to later build feedback message and to set the score.
-            tmp_credit_dict = self.copy_credit_dict(
-                credit_dict
-            )
+        # Credit dicts are normalized once per credit_list and shared by
+        # every submission, so matches are copied before being returned.
+        # Copied credit dicts hold adaptive feedback variables.  They
+        # are used to later build feedback message and to set the score.
+        for credit_dict in self.get_grading_table().credit_dicts:
             credit_score, student_error = self.get_credit_dict_score_and_error(
-                tmp_credit_dict['answer'],
-                tmp_credit_dict['error_percent'],
-                tmp_credit_dict['error_absolute'],
-                tmp_credit_dict['score'],
+                credit_dict['answer'],
+                credit_dict['error_percent'],
+                credit_dict['error_absolute'],
+                credit_dict['score'],
+            )
+            if credit_score is None or credit_score < high_score:
+                continue
+            tmp_credit_dict = dict(
+                credit_dict,
+                credit_score=credit_score,
+                student_answer=self.student_answer,
+                student_error=student_error,
             )
-            tmp_credit_dict['credit_score'] = credit_score
-            tmp_credit_dict['student_error'] = student_error
             # Only return a list of the highest scored credit dict copies
             if credit_score == high_score:
                 score_list.append(tmp_credit_dict)
-            elif credit_score > high_score:
+            else:
                 score_list = [tmp_credit_dict]
                 high_score = credit_score
         return score_list
 
+    def get_grading_table(self):
+        """
+        Returns the process wide compiled GradingTable for this block's
+        credit_list, instructor_answer and feedback_default
+        """
+        # pylint: disable=attribute-defined-outside-init
+        # Fingerprinting is linear in the credit_list and much slower than
+        # comparing it, so the table is kept while the settings compare
+        # equal to a copy of those it was built from
+        key = (self.credit_list, self.instructor_answer, self.feedback_default)
+        grading_table = getattr(self, '_grading_table', None)
+        if grading_table is None or grading_table[0] != key:
+            grading_table = (copy.deepcopy(key), get_grading_table(*key))
+            self._grading_table = grading_table
+        return grading_table[1]
+
     # Scenarios you'd like to see in the
     # workbench while developing your XBlock.
     @staticmethod
@@ -782,5 +1570,12 @@ class AdaptiveNumericInput(StudioEditableXBlockMixin, XBlock):
                 <adaptivenumericinput/>
                 </vertical_demo>
              """),
+            (
+                'AdaptiveNumericInput load test',
+                synthetic_scenario(
+                    LOAD_TEST_BLOCKS,
+                    LOAD_TEST_CREDIT_LIST_SIZE,
+                ),
+            ),
         ]
         return scenarios_block
@@ -0,0 +1,66 @@
+"""
+    Attempt counters shared by concurrent submissions.
+    Attempts are claimed with compare and set, so two submissions by the
+    same learner cannot both use their last attempt.
+"""
+from threading import Lock
+
+from .cache import LRUCache
+from .utils import get_backend
+
+
+# Learners whose attempt counts are kept by LocalAttemptCounter
+LOCAL_ATTEMPT_COUNTER_SIZE = 10000
+
+# Seconds LocalAttemptCounter keeps a count, long enough to outlast the
+# submissions in flight when it was claimed
+LOCAL_ATTEMPT_COUNTER_TTL = 10
+
+_ATTEMPT_COUNTERS = {}
+
+
+class LocalAttemptCounter(object):
+    """
+    Attempt counts shared by the threads of one process
+
+    Counts only arbitrate submissions in flight at the same time.  They
+    expire after 'ttl' seconds and the least recently used are evicted,
+    a learner without a count starts from the count in their user state.
+    So a count left ahead of user state, by a reset or a submission that
+    failed before saving, is not trusted for long.
+    """
+    def __init__(
+            self,
+            maxsize=LOCAL_ATTEMPT_COUNTER_SIZE,
+            ttl=LOCAL_ATTEMPT_COUNTER_TTL,
+    ):
+        self._counts = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._lock = Lock()
+
+    def clear(self):
+        """
+        Removes every count
+        """
+        self._counts.clear()
+
+    def compare_and_set(self, key, expected, value):
+        """
+        Sets the count for key to value if it is expected
+        Returns (True, value) if it was set and (False, count) otherwise.
+        A missing count is taken to be expected.
+        """
+        with self._lock:
+            count = self._counts.get(key, expected)
+            if count != expected:
+                return False, count
+            self._counts.set(key, value)
+            return True, value
+
+
+def get_attempt_counter(path=None):
+    """
+    Returns the process wide attempt counter for a dotted class path
+    Returns a LocalAttemptCounter if path is not set.  Counters shared
+    between processes, e.g. in a cache, need the same compare_and_set.
+    """
+    return get_backend(_ATTEMPT_COUNTERS, path, LocalAttemptCounter)
@@ -0,0 +1,288 @@
+"""
+    Benchmarks of the grading hot path across credit list sizes.
+    Blocks run against an in-memory runtime, answered with values drawn
+    around the credit ranges of the bundled scenarios.
+"""
+from random import Random
+
+import json
+import platform
+import re
+import time
+import warnings
+
+from xblock.exceptions import FieldDataDeprecationWarning
+from xblock.field_data import DictFieldData
+from xblock.fields import ScopeIds
+
+from .adaptivenumericinput import AdaptiveNumericInput
+from .adaptivenumericinput import _read_scenario_files
+from .adaptivenumericinput import _synthetic_credit_list
+
+
+# Credit list sizes, tolerances and operations benchmarked by default
+CREDIT_LIST_SIZES = (1, 10, 100, 1000, 10000)
+TOLERANCES = ('percent', 'absolute')
+OPERATIONS = (
+    'submit',
+    'get_best_match_credit_dict',
+    'get_feedback_message',
+    'student_view',
+)
+
+# A result is a regression if its median is this much above the baseline's
+REGRESSION_THRESHOLD = 0.25
+
+# Instructor answer of benchmarked blocks
+_INSTRUCTOR_ANSWER = 10.0
+
+# Scenario files quote credit lists loosely, so values are matched
+# instead of parsing the files
+_SCENARIO_INSTRUCTOR_ANSWER = re.compile(r'instructor_answer="([^"]*)"')
+_SCENARIO_CREDIT_DICT = re.compile(r'\{[^{}]*\}')
+_SCENARIO_CREDIT_VALUE = re.compile(
+    r'[\'"](answer|error_percent|error_absolute)[\'"]\s*:\s*'
+    r'[\'"]?(-?[0-9.]+)'
+)
+
+
+class _Request(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Request with a JSON body for calling json_handlers directly
+    """
+    method = 'POST'
+    headers = {}
+
+    def __init__(self, data):
+        self.body = json.dumps(data)
+
+
+class _Runtime(object):
+    """
+    In-memory runtime providing what the block uses
+    """
+    def handler_url(self, block, handler_name, *args, **kwargs):
+        # pylint: disable=no-self-use, unused-argument
+        """
+        Returns a fake handler URL
+        """
+        return '/handler/' + handler_name
+
+    def local_resource_url(self, block, path):
+        # pylint: disable=no-self-use, unused-argument
+        """
+        Returns a fake resource URL
+        """
+        return '/resource/' + path
+
+    def publish(self, block, event_type, event_data):
+        # pylint: disable=no-self-use, unused-argument
+        """
+        Grade events are not recorded
+        """
+        pass
+
+    def service(self, block, service_name):
+        # pylint: disable=no-self-use, unused-argument
+        """
+        No services are available
+        """
+        return None
+
+
+def scenario_answer_ratios():
+    """
+    Returns answers relative to the instructor answer for the bundled
+    scenarios: the exact answer, then answers inside and just outside
+    each credit dict's range
+    """
+    ratios = [1.0]
+    for block in _read_scenario_files().split('<adaptivenumericinput')[1:]:
+        match = _SCENARIO_INSTRUCTOR_ANSWER.search(block)
+        instructor_answer = float(match.group(1)) if match else 10.0
+        if not instructor_answer:
+            continue
+        for credit_dict_text in _SCENARIO_CREDIT_DICT.findall(block):
+            credit_dict = dict(
+                _SCENARIO_CREDIT_VALUE.findall(credit_dict_text)
+            )
+            answer = float(credit_dict.get('answer', instructor_answer))
+            errors = []
+            if credit_dict.get('error_percent') is not None:
+                errors.append(
+                    abs(answer) * float(credit_dict['error_percent']) / 100
+                )
+            if credit_dict.get('error_absolute') is not None:
+                errors.append(float(credit_dict['error_absolute']))
+            for error in errors or [0.0]:
+                for offset in (0, 0.5, -0.5, 1.5, -1.5):
+                    ratios.append(
+                        (answer + offset * error) / instructor_answer
+                    )
+    return ratios
+
+
+def make_answers(count, seed=0, instructor_answer=_INSTRUCTOR_ANSWER):
+    """
+    Returns 'count' student answers drawn from the scenario answer ratios
+    """
+    random = Random(seed)
+    ratios = scenario_answer_ratios()
+    return [
+        repr(instructor_answer * random.choice(ratios))
+        for _ in range(count)
+    ]
+
+
+def make_block(credit_list):
+    """
+    Returns an AdaptiveNumericInput with credit_list on the in-memory
+    runtime
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FieldDataDeprecationWarning)
+        return AdaptiveNumericInput(
+            _Runtime(),
+            DictFieldData({
+                'credit_list': credit_list,
+                'instructor_answer': _INSTRUCTOR_ANSWER,
+            }),
+            ScopeIds('benchmark', 'adaptivenumericinput', 'def', 'usage'),
+        )
+
+
+def _operation(block, operation):
+    # Returns a function running 'operation' for a student answer,
+    # and a function preparing the block before it is timed
+    def set_answer(student_answer):
+        """
+        Sets the student answer without grading it
+        """
+        block.student_answer = student_answer
+        block.student_answer_float = float(student_answer)
+
+    def set_credit_dict(student_answer):
+        """
+        Sets the student answer and its best matching credit dict
+        """
+        set_answer(student_answer)
+        block.credit_dict = block.get_best_match_credit_dict()
+
+    if operation == 'submit':
+        return (
+            lambda student_answer: block.submit(
+                _Request({'student_answer': student_answer})
+            ),
+            None,
+        )
+    if operation == 'get_best_match_credit_dict':
+        return (
+            lambda student_answer: block.get_best_match_credit_dict(),
+            set_answer,
+        )
+    if operation == 'get_feedback_message':
+        return (
+            lambda student_answer: block.get_feedback_message(),
+            set_credit_dict,
+        )
+    if operation == 'student_view':
+        return (
+            lambda student_answer: block.student_view(),
+            set_answer,
+        )
+    raise ValueError(operation)
+
+
+def _percentile(sorted_values, percent):
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def measure(operation, size, tolerance, answers):
+    """
+    Returns latency statistics of 'operation' for each of 'answers',
+    against a credit list of 'size' entries
+    """
+    block = make_block(_synthetic_credit_list(
+        _INSTRUCTOR_ANSWER,
+        size,
+        tolerance,
+    ))
+    run, prepare = _operation(block, operation)
+    # Compiles the grading table and templates before timing
+    if prepare:
+        prepare(answers[0])
+    run(answers[0])
+    timings = []
+    for student_answer in answers:
+        if prepare:
+            prepare(student_answer)
+        start = time.time()
+        run(student_answer)
+        timings.append(time.time() - start)
+    timings.sort()
+    total = sum(timings)
+    return {
+        'operation': operation,
+        'size': size,
+        'tolerance': tolerance,
+        'iterations': len(timings),
+        'mean_us': total / len(timings) * 1e6,
+        'p50_us': _percentile(timings, 50) * 1e6,
+        'p95_us': _percentile(timings, 95) * 1e6,
+        'p99_us': _percentile(timings, 99) * 1e6,
+        'ops_per_sec': len(timings) / total if total else None,
+    }
+
+
+def run_benchmark(
+        sizes=CREDIT_LIST_SIZES,
+        tolerances=TOLERANCES,
+        operations=OPERATIONS,
+        iterations=200,
+        seed=0,
+):
+    """
+    Returns results for every operation, credit list size and tolerance
+    """
+    answers = make_answers(iterations, seed)
+    return {
+        'python': platform.python_version(),
+        'iterations': iterations,
+        'seed': seed,
+        'results': [
+            measure(operation, size, tolerance, answers)
+            for operation in operations
+            for size in sizes
+            for tolerance in tolerances
+        ],
+    }
+
+
+def _result_key(result):
+    return (result['operation'], result['size'], result['tolerance'])
+
+
+def compare_results(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Returns the results whose median latency is more than 'threshold'
+    above the matching baseline result, each with the baseline median
+    and their ratio
+    """
+    baseline_results = dict(
+        (_result_key(result), result) for result in baseline['results']
+    )
+    regressions = []
+    for result in results['results']:
+        baseline_result = baseline_results.get(_result_key(result))
+        if not baseline_result or not baseline_result['p50_us']:
+            continue
+        ratio = result['p50_us'] / baseline_result['p50_us']
+        if ratio > 1 + threshold:
+            regressions.append(dict(
+                result,
+                baseline_p50_us=baseline_result['p50_us'],
+                ratio=ratio,
+            ))
+    return regressions
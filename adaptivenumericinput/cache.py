@@ -0,0 +1,77 @@
+"""
+    Small, dependency free caches shared by every block in a process.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+import time
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping that holds at most 'maxsize' items
+    Least recently used items are evicted first and, if 'ttl' is set,
+    items expire 'ttl' seconds after they were stored.
+    Hits, misses and evictions are counted for diagnostics.
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        """
+        Removes every item from the cache
+        """
+        with self._lock:
+            self._items.clear()
+
+    def get(self, key, default=None):
+        """
+        Returns the value for key and marks it as recently used
+        """
+        with self._lock:
+            try:
+                value, expires = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.time():
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        """
+        Stores value for key, evicting the least recently used item if full
+        """
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expires)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self):
+        """
+        Returns the size of the cache and its hit, miss and eviction counts
+        """
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,322 @@
+"""
+    Distributions of the answers learners submitted to a block.
+    Stored student state is streamed through a mergeable quantile sketch
+    and a bounded count of the most frequent wrong answers, so memory use
+    does not depend on the number of learners.
+"""
+from math import ceil, isinf, isnan, log
+
+from .grading import get_graded_answer
+from .regrade import get_block_grading_table
+from .regrade import read_rows
+from .storage import unpack_state
+
+
+# Relative error of the quantiles and histogram bucket bounds
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+# Buckets kept per sign by an AnswerSketch, the buckets of the smallest
+# magnitudes are merged beyond it
+SKETCH_MAX_BUCKETS = 2048
+
+# Distinct wrong answers counted per block
+FREQUENT_ANSWERS_CAPACITY = 1000
+
+# Quantiles reported by AnswerDistribution.as_dict
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+class AnswerSketch(object):
+    # pylint: disable=too-many-instance-attributes
+    """
+    A quantile sketch of numeric answers with bounded relative error
+
+    Answers are counted in buckets whose bounds grow geometrically, so
+    any quantile is within SKETCH_RELATIVE_ACCURACY of the true answer
+    and sketches merge by adding bucket counts.  Zero is counted on its
+    own and negative answers in buckets of their magnitude.
+    """
+    def __init__(
+            self,
+            relative_accuracy=SKETCH_RELATIVE_ACCURACY,
+            max_buckets=SKETCH_MAX_BUCKETS,
+    ):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def _key(self, magnitude):
+        return int(ceil(log(magnitude) / self._log_gamma))
+
+    def _bounds(self, key):
+        return self.gamma ** (key - 1), self.gamma ** key
+
+    def _estimate(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def _collapse(self, buckets):
+        # Merges the buckets of the smallest magnitudes into one
+        if len(buckets) <= self.max_buckets:
+            return
+        keys = sorted(buckets)
+        excess = keys[:len(keys) - self.max_buckets + 1]
+        buckets[excess[-1]] = sum(buckets.pop(key) for key in excess)
+
+    def add(self, answer, count=1):
+        """
+        Counts a finite answer 'count' times
+        """
+        if answer > 0:
+            key = self._key(answer)
+            self.positive[key] = self.positive.get(key, 0) + count
+            self._collapse(self.positive)
+        elif answer < 0:
+            key = self._key(-answer)
+            self.negative[key] = self.negative.get(key, 0) + count
+            self._collapse(self.negative)
+        else:
+            self.zero += count
+        self.count += count
+        if self.min is None or answer < self.min:
+            self.min = answer
+        if self.max is None or answer > self.max:
+            self.max = answer
+
+    def merge(self, other):
+        """
+        Adds the counts of a sketch with the same relative accuracy
+        """
+        for buckets, other_buckets in (
+                (self.positive, other.positive),
+                (self.negative, other.negative),
+        ):
+            for key, count in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + count
+            self._collapse(buckets)
+        self.zero += other.zero
+        self.count += other.count
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def _ordered_buckets(self):
+        # Yields (key, count, sign) from the most negative answers up
+        for key in sorted(self.negative, reverse=True):
+            yield key, self.negative[key], -1
+        if self.zero:
+            yield None, self.zero, 0
+        for key in sorted(self.positive):
+            yield key, self.positive[key], 1
+
+    def quantile(self, quantile):
+        """
+        Returns an estimate of the answer at 'quantile', between 0 and 1,
+        or None if no answers were counted
+        """
+        if not self.count:
+            return None
+        rank = quantile * (self.count - 1)
+        seen = 0
+        for key, count, sign in self._ordered_buckets():
+            seen += count
+            if seen > rank:
+                if not sign:
+                    return 0.0
+                estimate = sign * self._estimate(key)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def get_histogram(self):
+        """
+        Returns (low, high, count) for each counted bucket in answer order
+        The zero bucket is (0.0, 0.0, count).
+        """
+        histogram = []
+        for key, count, sign in self._ordered_buckets():
+            if not sign:
+                histogram.append((0.0, 0.0, count))
+                continue
+            low, high = self._bounds(key)
+            if sign < 0:
+                low, high = -high, -low
+            histogram.append((low, high, count))
+        return histogram
+
+
+class FrequentAnswers(object):
+    """
+    Approximate counts of the most frequent answers in bounded memory
+
+    Counts distinct answers with the Misra-Gries algorithm, batched:
+    once twice 'capacity' answers are counted, the (capacity + 1)th
+    largest count is taken off every count and answers left without one
+    are dropped.  Counts are underestimated by at most the number of
+    answers over capacity + 1, so any answer given more often than that
+    is kept.
+    """
+    def __init__(self, capacity=FREQUENT_ANSWERS_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.count = 0
+
+    def _trim(self):
+        # Takes the (capacity + 1)th largest count off every count
+        threshold = sorted(self.counts.values(), reverse=True)[
+            self.capacity
+        ]
+        self.counts = dict(
+            (answer, count - threshold)
+            for answer, count in self.counts.items()
+            if count > threshold
+        )
+
+    def add(self, answer, count=1):
+        """
+        Counts an answer 'count' times
+        """
+        self.count += count
+        self.counts[answer] = self.counts.get(answer, 0) + count
+        if len(self.counts) > 2 * self.capacity:
+            self._trim()
+
+    def merge(self, other):
+        """
+        Adds the counts of another FrequentAnswers
+        """
+        self.count += other.count
+        for answer, count in other.counts.items():
+            self.counts[answer] = self.counts.get(answer, 0) + count
+        if len(self.counts) > self.capacity:
+            self._trim()
+
+    def top(self, limit):
+        """
+        Returns the 'limit' most frequent (answer, count) pairs
+        """
+        return sorted(
+            self.counts.items(),
+            key=lambda answer_count: (-answer_count[1], answer_count[0]),
+        )[:limit]
+
+
+class AnswerDistribution(object):
+    """
+    The distribution of the answers learners submitted to one block
+
+    Every numeric answer goes into an AnswerSketch.  Answers graded
+    below full credit against the block's credit_list also go into a
+    FrequentAnswers, to find common mistakes worth a credit dict.
+    'table' is the GradingTable of the block's settings.
+    """
+    def __init__(self, table):
+        self.table = table
+        self.sketch = AnswerSketch()
+        self.wrong_answers = FrequentAnswers()
+        self.learners = 0
+        self.non_numeric = 0
+
+    def add_answer(self, student_answer_float):
+        """
+        Counts one learner's answer, None if it was not numeric
+        """
+        self.learners += 1
+        answer = student_answer_float
+        if answer is None or isinf(answer) or isnan(answer):
+            self.non_numeric += 1
+            return
+        self.sketch.add(answer)
+        if self.table.grade(answer)[0] < 1.0:
+            self.wrong_answers.add(answer)
+
+    def add_state(self, state):
+        """
+        Counts the last graded answer in one learner's stored state
+        Learners who never submitted are not counted.
+        """
+        state = unpack_state(state)
+        if not state.get('count_attempts'):
+            return
+        self.add_answer(get_graded_answer(state)[1])
+
+    def merge(self, other):
+        """
+        Adds the counts of another distribution of the same block
+        """
+        self.sketch.merge(other.sketch)
+        self.wrong_answers.merge(other.wrong_answers)
+        self.learners += other.learners
+        self.non_numeric += other.non_numeric
+
+    def get_top_wrong_answers(self, limit=10):
+        """
+        Returns the most frequent wrong answers with their count and how
+        the credit_list grades them, credit_index -1 if no credit dict
+        matched
+        """
+        top_wrong_answers = []
+        for answer, count in self.wrong_answers.top(limit):
+            score, index, _ = self.table.grade(answer)
+            top_wrong_answers.append({
+                'answer': answer,
+                'count': count,
+                'score': score,
+                'credit_index': index,
+            })
+        return top_wrong_answers
+
+    def as_dict(self, top=10):
+        """
+        Returns the distribution as JSON serializable values
+        """
+        return {
+            'learners': self.learners,
+            'non_numeric': self.non_numeric,
+            'min': self.sketch.min,
+            'max': self.sketch.max,
+            'quantiles': dict(
+                (str(quantile), self.sketch.quantile(quantile))
+                for quantile in QUANTILES
+            ),
+            'histogram': self.sketch.get_histogram(),
+            'top_wrong_answers': self.get_top_wrong_answers(top),
+        }
+
+
+def aggregate_states(rows, blocks):
+    """
+    Returns an AnswerDistribution by usage id for (usage_id, state) rows
+    Rows can come from any field data iterator, e.g. StudentModule rows
+    of a course read with .iterator(), and are consumed one at a time.
+    Rows of blocks missing from 'blocks', as returned by
+    regrade.read_blocks, are skipped.
+    """
+    distributions = {}
+    for usage_id, state in rows:
+        distribution = distributions.get(usage_id)
+        if distribution is None:
+            block = blocks.get(usage_id)
+            if block is None:
+                continue
+            distribution = AnswerDistribution(get_block_grading_table(block))
+            distributions[usage_id] = distribution
+        distribution.add_state(state)
+    return distributions
+
+
+def read_states(lines, course_id=None):
+    """
+    Yields (usage_id, state) for StudentModule rows exported as JSON
+    lines, see regrade.read_rows
+    """
+    for row, state in read_rows(lines, course_id):
+        yield row['module_state_key'], state
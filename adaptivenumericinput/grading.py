@@ -0,0 +1,612 @@
+"""
+    Grading math for the Adaptive Numeric Input XBlock.
+    Instructor credit lists are compiled once into a GradingTable and
+    shared by every submission made against the same settings.
+"""
+from array import array
+from bisect import bisect_left
+from heapq import heappop, heappush
+from math import floor
+
+import hashlib
+import json
+import re
+
+from .cache import LRUCache
+
+
+# List of available %%-encoded keywords that instructors can use in feedback
+# They will be replaced with numeric values or '--' if they do not exist
+FEEDBACK_LIST = [
+    '%%ANSWER%%',
+    '%%ERROR_ABSOLUTE%%',
+    '%%ERROR_PERCENT%%',
+    '%%STUDENT_ANSWER%%',
+    '%%STUDENT_ERROR%%',
+]
+
+FEEDBACK_DEFAULT = 'Answer is within %%ERROR_PERCENT%% percent.'
+
+# Number of compiled grading tables kept per process
+GRADING_TABLE_CACHE_SIZE = 512
+
+# Number of compiled feedback templates kept per process
+FEEDBACK_TEMPLATE_CACHE_SIZE = 4096
+
+_GRADING_TABLES = LRUCache(maxsize=GRADING_TABLE_CACHE_SIZE)
+
+_FEEDBACK_TEMPLATES = LRUCache(maxsize=FEEDBACK_TEMPLATE_CACHE_SIZE)
+
+_FEEDBACK_KEYWORDS = re.compile(
+    '(' + '|'.join(re.escape(key) for key in FEEDBACK_LIST) + ')'
+)
+
+# Credit matching compares errors rounded to 6 decimals, so acceptance
+# intervals are widened by this much before an exact check of the match.
+_INTERVAL_SLACK = 2e-6
+
+
+def _import_numpy():
+    # NumPy is optional and only needed for vectorized grading
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    return numpy
+
+
+def _answer_error(actual_answer, answer):
+    # Returns percent and absolute error of 'answer' from 'actual_answer'
+    # If 'actual_answer' is zero then percent_error will be None
+    # since it cannot be determined for that case.
+    absolute_error = None
+    percent_error = None
+    if actual_answer is not None and answer is not None:
+        absolute_error = abs(actual_answer - answer)
+        if actual_answer:
+            percent_error = 100 * (absolute_error / abs(actual_answer))
+    return absolute_error, percent_error
+
+
+def _get_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+    except TypeError:
+        return None
+
+
+def get_graded_answer(state):
+    """
+    Returns (student_answer, student_answer_float) of the last graded
+    submission in one learner's unpacked state
+    student_answer also holds saved drafts, student_answer_float is only
+    set when a submission claims an attempt and is graded.  Answers are
+    only parsed from student_answer in state saved before that.
+    """
+    student_answer = state.get('student_answer')
+    if 'student_answer_float' not in state:
+        return student_answer, _get_float(student_answer)
+    student_answer_float = state['student_answer_float']
+    if _get_float(student_answer) != student_answer_float:
+        student_answer = str(student_answer_float)
+    return student_answer, student_answer_float
+
+
+def credit_score_and_error(
+        answer,
+        error_percent,
+        error_absolute,
+        score,
+        student_answer_float,
+):
+    """
+    Returns a score(as credit_score) and a calculated error(student_error)
+    for student_answer_float against a single credit dict's values
+
+    Returns
+        (None, None) if the answer is not within the supplied error
+        credit_score will be passed through if an error match if found.
+        student_error will be the calculated error(% or abs) if match
+         found.
+    """
+    credit_score = None
+    student_error = None
+    (actual_absolute_error,
+     actual_percent_error) = _answer_error(
+         answer,
+         student_answer_float,
+     )
+    # Percentage error arbitraily has priority over absolute error
+    if (actual_percent_error is not None and error_percent is not None and
+            round(error_percent, 6) >= round(actual_percent_error, 6)):
+        credit_score = score
+        student_error = actual_percent_error
+    elif (actual_absolute_error is not None and
+          error_absolute is not None and
+          round(error_absolute, 6) >= round(actual_absolute_error, 6)):
+        credit_score = score
+        student_error = actual_absolute_error
+    return credit_score, student_error
+
+
+def _acceptance_interval(credit_dict):
+    # Returns the (low, high) range of student answers that may be
+    # within the credit dict's error, widened to absorb rounding.
+    # Returns None if no answer can match.
+    answer = credit_dict['answer']
+    if answer is None:
+        return None
+    radius = None
+    if credit_dict['error_percent'] is not None and answer:
+        radius = abs(answer) * (
+            max(credit_dict['error_percent'], 0) + _INTERVAL_SLACK
+        ) / 100
+    if credit_dict['error_absolute'] is not None:
+        radius_absolute = (
+            max(credit_dict['error_absolute'], 0) + _INTERVAL_SLACK
+        )
+        if radius is None or radius_absolute > radius:
+            radius = radius_absolute
+    if radius is None:
+        return None
+    radius *= 1 + _INTERVAL_SLACK
+    low, high = answer - radius, answer + radius
+    # Non finite settings cannot be placed on the line, so they are
+    # considered candidates for every answer and checked exactly.
+    if low != low or high != high:
+        low, high = float('-inf'), float('inf')
+    return low, high
+
+
+def _tie_break_key(indexed_credit_dict):
+    # Highest score wins, then the smallest error_percent and then the
+    # smallest error_absolute, with missing errors sorting first.
+    # Remaining ties keep credit_list order.
+    index, credit_dict = indexed_credit_dict
+    error_percent = credit_dict['error_percent']
+    error_absolute = credit_dict['error_absolute']
+    return (
+        -credit_dict['score'],
+        error_percent is not None,
+        error_percent,
+        error_absolute is not None,
+        error_absolute,
+        index,
+    )
+
+
+def quantize_score(score):
+    """
+    Limits a credit score to [0, 1] in steps of one decimal
+    Scores outside of [0, 1] are worth nothing.
+    """
+    result = 0.0
+    if score is not None and score >= 0 and score <= 1:
+        result = floor(10 * score) / 10
+    return result
+
+
+def normalize_credit_dict(credit_dict, instructor_answer):
+    """
+    Build a normalized copy of an instructor defined credit_dict
+
+    Required keys in credit_dict to set defaults
+        'answer', defaults to instructor_answer
+        'error_percent' or 'error_absolute' must be present or
+            error_percent is set to require an exact answer, i.e. 0
+        'score', defaults to 1 and limited to [0, 1]
+    """
+    answer = _get_float(credit_dict.get('answer'))
+    if answer is None:
+        answer = instructor_answer
+    error_percent = _get_float(credit_dict.get('error_percent'))
+    error_absolute = _get_float(credit_dict.get('error_absolute'))
+    if error_percent is None and error_absolute is None:
+        error_percent = 0
+    score = _get_float(credit_dict.get('score', 1.0))
+    if score is None:
+        score = 0.0
+    score = max(min(1.0, score), 0.0)
+    feedback = credit_dict.get('feedback')
+    if feedback is not None and not isinstance(feedback, basestring):
+        # Feedback is compiled for every credit dict, so text is expected
+        feedback = unicode(feedback)
+    normalized_credit_dict = {
+        'answer': answer,
+        'error_percent': error_percent,
+        'error_absolute': error_absolute,
+        'feedback': feedback,
+        # 'score' is the instructor defined score needed for
+        # feedback.
+        'score': score,
+    }
+    return normalized_credit_dict
+
+
+class FeedbackTemplate(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Feedback text split once into literal text and %%-encoded keywords
+    """
+    def __init__(self, feedback):
+        parts = _FEEDBACK_KEYWORDS.split(feedback)
+        self.literals = tuple(parts[0::2])
+        # First 2 chars and last two chars are '%',
+        # so they are removed.  The remaining string lowered
+        # could be a value in the credit dict.
+        self.keys = tuple(str(key.lower()[2:-2]) for key in parts[1::2])
+
+    def render(self, credit_dict):
+        """
+        Returns the feedback with keywords replaced by the string
+        formatted values in credit_dict, or '--' if they do not exist
+        """
+        parts = [self.literals[0]]
+        for key, literal in zip(self.keys, self.literals[1:]):
+            value = credit_dict.get(key)
+            if value is None:
+                value = '--'
+            parts.append(str(value))
+            parts.append(literal)
+        return ''.join(parts)
+
+
+def get_feedback_template(feedback):
+    """
+    Returns the compiled FeedbackTemplate for feedback text
+    Templates are cached per process by feedback text.
+    """
+    template = _FEEDBACK_TEMPLATES.get(feedback)
+    if template is None:
+        template = FeedbackTemplate(feedback)
+        _FEEDBACK_TEMPLATES.set(feedback, template)
+    return template
+
+
+def grading_table_fingerprint(
+        credit_list,
+        instructor_answer,
+        feedback_default=FEEDBACK_DEFAULT,
+):
+    """
+    Returns a content hash identifying a credit_list, instructor_answer
+    and feedback_default combination
+    """
+    # Keys are sorted here rather than with sort_keys, which makes json
+    # fall back to its pure Python encoder
+    content = json.dumps(
+        [
+            [
+                sorted(credit_dict.items())
+                if isinstance(credit_dict, dict) else credit_dict
+                for credit_dict in credit_list or []
+            ],
+            instructor_answer,
+            feedback_default,
+        ],
+        separators=(',', ':'),
+    )
+    return hashlib.sha1(content.encode('utf8')).hexdigest()
+
+
+class GradingTable(object):
+    # pylint: disable=too-many-instance-attributes
+    """
+    Normalized credit dicts for one credit_list/instructor_answer pair
+    Tables are shared between requests and must be treated as read only.
+
+    Each credit dict is turned into an acceptance interval around its
+    answer.  The interval end points split the number line into regions
+    and the best credit dict covering each region is resolved up front,
+    so a match is a binary search followed by one exact error check.
+    """
+    def __init__(
+            self,
+            credit_list,
+            instructor_answer,
+            feedback_default=FEEDBACK_DEFAULT,
+            fingerprint=None,
+    ):
+        if fingerprint is None:
+            fingerprint = grading_table_fingerprint(
+                credit_list,
+                instructor_answer,
+                feedback_default,
+            )
+        self.fingerprint = fingerprint
+        self.instructor_answer = instructor_answer
+        self.credit_dicts = tuple(
+            normalize_credit_dict(credit_dict, instructor_answer)
+            for credit_dict in credit_list
+        )
+        self.feedback_default = get_feedback_template(feedback_default)
+        # Feedback of each credit dict, falling back to feedback_default
+        self.feedback_templates = tuple(
+            self.feedback_default if credit_dict['feedback'] is None
+            else get_feedback_template(credit_dict['feedback'])
+            for credit_dict in self.credit_dicts
+        )
+        # Position of each credit dict in best match order
+        self.ranks = [0] * len(self.credit_dicts)
+        for rank, (index, _) in enumerate(
+                sorted(enumerate(self.credit_dicts), key=_tie_break_key)
+        ):
+            self.ranks[index] = rank
+        self._build_index()
+        self._columns = None
+
+    def _build_index(self):
+        intervals = []
+        for index, credit_dict in enumerate(self.credit_dicts):
+            interval = _acceptance_interval(credit_dict)
+            if interval is not None:
+                intervals.append((interval, index))
+        self.boundaries = sorted(
+            set(bound for interval, _ in intervals for bound in interval)
+        )
+        # Region 2 * i + 1 is boundaries[i] itself and region 2 * i
+        # is the open range just below it.
+        starts = {}
+        for (low, high), index in intervals:
+            start = 2 * bisect_left(self.boundaries, low) + 1
+            end = 2 * bisect_left(self.boundaries, high) + 1
+            starts.setdefault(start, []).append((self.ranks[index], end))
+        by_rank = sorted(
+            range(len(self.credit_dicts)),
+            key=self.ranks.__getitem__,
+        )
+        active = []
+        self.region_winners = []
+        for region in range(2 * len(self.boundaries) + 1):
+            for rank_end in starts.get(region, ()):
+                heappush(active, rank_end)
+            while active and active[0][1] < region:
+                heappop(active)
+            winner = None
+            if active:
+                winner = by_rank[active[0][0]]
+            self.region_winners.append(winner)
+
+    def get_complexity(self):
+        """
+        Returns the sizes that grading with this table depends on
+        """
+        return {
+            'credit_dicts': len(self.credit_dicts),
+            'common_mistakes': sum(
+                1 for credit_dict in self.credit_dicts
+                if credit_dict['answer'] != self.instructor_answer
+            ),
+            'boundaries': len(self.boundaries),
+            'regions': len(self.region_winners),
+            'feedback_templates': len(set(
+                id(template) for template in self.feedback_templates
+            )),
+        }
+
+    def _region(self, student_answer_float):
+        position = bisect_left(self.boundaries, student_answer_float)
+        if (position < len(self.boundaries) and
+                self.boundaries[position] == student_answer_float):
+            return 2 * position + 1
+        return 2 * position
+
+    def score_and_error(self, index, student_answer_float):
+        """
+        Returns (credit_score, student_error) of one credit dict
+        """
+        credit_dict = self.credit_dicts[index]
+        return credit_score_and_error(
+            credit_dict['answer'],
+            credit_dict['error_percent'],
+            credit_dict['error_absolute'],
+            credit_dict['score'],
+            student_answer_float,
+        )
+
+    def best_match(self, student_answer_float):
+        """
+        Returns (index, credit_score, student_error) of the highest scored
+        credit dict within error of student_answer_float, ties going to
+        the smallest error_percent then error_absolute.
+        Returns None if no credit dict matches.
+        """
+        if not self.boundaries or student_answer_float is None:
+            return None
+        index = self.region_winners[self._region(student_answer_float)]
+        if index is None:
+            return None
+        credit_score, student_error = self.score_and_error(
+            index,
+            student_answer_float,
+        )
+        if credit_score is not None:
+            return index, credit_score, student_error
+        # Answer is only inside the widened rounding margin of the region's
+        # winner, so fall back to checking every credit dict exactly.
+        best = None
+        best_rank = None
+        for index in range(len(self.credit_dicts)):
+            credit_score, student_error = self.score_and_error(
+                index,
+                student_answer_float,
+            )
+            if credit_score is not None and (
+                    best_rank is None or self.ranks[index] < best_rank
+            ):
+                best = (index, credit_score, student_error)
+                best_rank = self.ranks[index]
+        return best
+
+    def get_feedback_message(self, index, student_answer, student_error):
+        """
+        Returns the feedback for a student answer matched by credit dict
+        'index', or for an exact answer without a match when index is -1
+        """
+        if index < 0:
+            return self.feedback_default.render({})
+        credit_dict = dict(
+            self.credit_dicts[index],
+            student_answer=student_answer,
+            student_error=student_error,
+        )
+        return self.feedback_templates[index].render(credit_dict)
+
+    def grade(self, student_answer_float):
+        """
+        Returns (score, index, student_error) for one student answer
+        score is quantized and exact answers are given full credit.
+        index and student_error are -1 and NaN if no credit dict matched.
+        """
+        score = None
+        index = -1
+        student_error = float('nan')
+        match = self.best_match(student_answer_float)
+        if match is not None:
+            index, score, student_error = match
+            if student_error is None:
+                student_error = float('nan')
+        if student_answer_float == self.instructor_answer:
+            score = 1.0
+        return quantize_score(score), index, student_error
+
+    def grade_many(self, answers):
+        """
+        Grades a sequence or float buffer of student answers at once
+        Returns parallel (scores, indexes, student_errors) arrays with the
+        same values grade() returns for each answer.  NumPy arrays are
+        returned when NumPy is installed, array.array objects otherwise.
+        """
+        numpy = _import_numpy()
+        if numpy is None:
+            scores = array('d')
+            indexes = array('l')
+            student_errors = array('d')
+            for answer in answers:
+                score, index, student_error = self.grade(float(answer))
+                scores.append(score)
+                indexes.append(index)
+                student_errors.append(student_error)
+            return scores, indexes, student_errors
+        return self._grade_many_numpy(numpy, answers)
+
+    def _numpy_columns(self, numpy):
+        # Credit dict values as arrays, missing values are NaN.
+        # Built once per table on first use.
+        columns = self._columns
+        if columns is None:
+            def column(key):
+                # pylint: disable=missing-docstring
+                return numpy.array(
+                    [
+                        numpy.nan if credit_dict[key] is None
+                        else credit_dict[key]
+                        for credit_dict in self.credit_dicts
+                    ] + [numpy.nan],
+                    dtype=float,
+                )
+            columns = {
+                'answer': column('answer'),
+                'error_percent': column('error_percent'),
+                'error_absolute': column('error_absolute'),
+                'score': column('score'),
+                'boundaries': numpy.array(self.boundaries, dtype=float),
+                'winners': numpy.array(
+                    [-1 if index is None else index
+                     for index in self.region_winners],
+                    dtype=int,
+                ),
+            }
+            self._columns = columns
+        return columns
+
+    def _grade_many_numpy(self, numpy, answers):
+        # pylint: disable=too-many-locals
+        answers = numpy.asarray(answers, dtype=float).ravel()
+        columns = self._numpy_columns(numpy)
+        boundaries = columns['boundaries']
+        if boundaries.size:
+            positions = numpy.searchsorted(boundaries, answers)
+            on_boundary = (
+                boundaries[numpy.minimum(positions, len(boundaries) - 1)] ==
+                answers
+            )
+            regions = 2 * positions + on_boundary
+            indexes = columns['winners'][regions]
+        else:
+            indexes = numpy.full(len(answers), -1, dtype=int)
+        candidates = indexes >= 0
+        # Index -1 picks the trailing NaN of every column
+        answer = columns['answer'][indexes]
+        error_percent = columns['error_percent'][indexes]
+        error_absolute = columns['error_absolute'][indexes]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            absolute_error = numpy.abs(answer - answers)
+            percent_error = 100 * (absolute_error / numpy.abs(answer))
+        percent_error[answer == 0] = numpy.nan
+        # Only decide answers clear of the 6 decimal rounding margin here,
+        # everything else is graded exactly one at a time.
+        margin = 10 * _INTERVAL_SLACK
+        with numpy.errstate(invalid='ignore'):
+            percent_within = percent_error <= error_percent - margin
+            percent_outside = ~(percent_error <= error_percent + margin)
+            absolute_within = absolute_error <= error_absolute - margin
+        by_percent = candidates & percent_within
+        by_absolute = candidates & percent_outside & absolute_within
+        student_errors = numpy.where(
+            by_percent,
+            percent_error,
+            numpy.where(by_absolute, absolute_error, numpy.nan),
+        )
+        scores = numpy.where(
+            by_percent | by_absolute,
+            numpy.floor(10 * columns['score'][indexes]) / 10,
+            0.0,
+        )
+        scores[answers == self.instructor_answer] = 1.0
+        indexes = numpy.where(by_percent | by_absolute, indexes, -1)
+        for position in numpy.flatnonzero(
+                candidates & ~by_percent & ~by_absolute
+        ):
+            (scores[position],
+             indexes[position],
+             student_errors[position]) = self.grade(answers[position])
+        return scores, indexes, student_errors
+
+
+def get_cache_stats():
+    """
+    Returns the stats of the grading table and feedback template caches
+    """
+    return {
+        'grading_tables': _GRADING_TABLES.get_stats(),
+        'feedback_templates': _FEEDBACK_TEMPLATES.get_stats(),
+    }
+
+
+def get_grading_table(
+        credit_list,
+        instructor_answer,
+        feedback_default=FEEDBACK_DEFAULT,
+):
+    """
+    Returns the compiled GradingTable for the supplied settings
+    Tables are cached per process by content fingerprint.
+    """
+    fingerprint = grading_table_fingerprint(
+        credit_list,
+        instructor_answer,
+        feedback_default,
+    )
+    table = _GRADING_TABLES.get(fingerprint)
+    if table is None:
+        table = GradingTable(
+            credit_list,
+            instructor_answer,
+            feedback_default,
+            fingerprint,
+        )
+        _GRADING_TABLES.set(fingerprint, table)
+    return table
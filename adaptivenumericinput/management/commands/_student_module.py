@@ -0,0 +1,63 @@
+"""
+Shared by the commands reading exported StudentModule rows
+"""
+from abc import ABCMeta, abstractmethod
+
+import sys
+
+from django.core.management.base import BaseCommand
+
+from adaptivenumericinput.regrade import read_blocks
+
+
+class StudentModuleCommand(BaseCommand):
+    """
+    Base for commands streaming a course's StudentModule rows, exported
+    as JSON lines, against block settings exported as JSON lines
+    Commands implement handle_states.
+    """
+    __metaclass__ = ABCMeta
+    requires_system_checks = False
+    output_help = 'File for the results as JSON lines, "-" for stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id')
+        parser.add_argument(
+            '--states',
+            required=True,
+            help='StudentModule rows as JSON lines, "-" for stdin',
+        )
+        parser.add_argument(
+            '--blocks',
+            required=True,
+            help='Block usage_id, credit_list and instructor_answer '
+                 'as JSON lines',
+        )
+        parser.add_argument(
+            '--output',
+            default='-',
+            help=self.output_help,
+        )
+
+    def handle(self, *args, **options):
+        with open(options['blocks']) as blocks_file:
+            blocks = read_blocks(blocks_file)
+        states_file = sys.stdin
+        if options['states'] != '-':
+            states_file = open(options['states'])
+        output_file = self.stdout
+        if options['output'] != '-':
+            output_file = open(options['output'], 'w')
+        try:
+            self.handle_states(states_file, blocks, output_file, options)
+        finally:
+            if states_file is not sys.stdin:
+                states_file.close()
+            if output_file is not self.stdout:
+                output_file.close()
+
+    @abstractmethod
+    def handle_states(self, states_file, blocks, output_file, options):
+        """
+        Reads the rows in states_file and writes the results
+        """
@@ -0,0 +1,48 @@
+"""
+Report the distribution of stored adaptivenumericinput answers in a course
+
+    python manage.py answer_distribution_adaptivenumericinput \
+        course-v1:foo+bar+baz --states studentmodule.jsonl \
+        --blocks blocks.jsonl --output distributions.jsonl
+"""
+import json
+
+from adaptivenumericinput.distribution import aggregate_states
+from adaptivenumericinput.distribution import read_states
+
+from ._student_module import StudentModuleCommand
+
+
+class Command(StudentModuleCommand):
+    """
+    Streams exported StudentModule rows into the answer distribution of
+    each block and writes one JSON line per block, with quantiles, a
+    histogram and the most frequent wrong answers.
+    LMS callers can pass (usage_id, state) rows read from field data to
+    adaptivenumericinput.distribution.aggregate_states instead.
+    """
+    help = 'Reports the answers learners gave to adaptivenumericinput blocks'
+    output_help = 'File for distributions as JSON lines, "-" for stdout'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help='Number of most frequent wrong answers reported per block',
+        )
+
+    def handle_states(self, states_file, blocks, output_file, options):
+        distributions = aggregate_states(
+            read_states(states_file, course_id=options['course_id']),
+            blocks,
+        )
+        for usage_id in sorted(distributions):
+            output_file.write(json.dumps(
+                dict(
+                    distributions[usage_id].as_dict(options['top']),
+                    usage_id=usage_id,
+                ),
+                sort_keys=True,
+            ) + '\n')
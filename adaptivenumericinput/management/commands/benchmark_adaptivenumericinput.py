@@ -0,0 +1,114 @@
+"""
+Benchmark the adaptivenumericinput grading hot path
+
+    python manage.py benchmark_adaptivenumericinput \
+        --output benchmark.json --baseline baseline.json
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from adaptivenumericinput.benchmark import CREDIT_LIST_SIZES
+from adaptivenumericinput.benchmark import OPERATIONS
+from adaptivenumericinput.benchmark import REGRESSION_THRESHOLD
+from adaptivenumericinput.benchmark import TOLERANCES
+from adaptivenumericinput.benchmark import compare_results
+from adaptivenumericinput.benchmark import run_benchmark
+
+
+def _list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    """
+    Measures submit, get_best_match_credit_dict, get_feedback_message
+    and student_view latency for each credit list size and tolerance,
+    writes the results as JSON and fails if any result regressed from
+    a baseline written by an earlier run.
+    """
+    help = 'Benchmarks adaptivenumericinput grading'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=lambda value: [int(size) for size in _list(value)],
+            default=list(CREDIT_LIST_SIZES),
+            help='Comma separated credit list sizes',
+        )
+        parser.add_argument(
+            '--tolerances',
+            type=_list,
+            default=list(TOLERANCES),
+            help='Comma separated tolerances, percent and/or absolute',
+        )
+        parser.add_argument(
+            '--operations',
+            type=_list,
+            default=list(OPERATIONS),
+            help='Comma separated operations to benchmark',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Answers timed per operation, size and tolerance',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed for the student answers',
+        )
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='File for the results as JSON, "-" for stdout',
+        )
+        parser.add_argument(
+            '--baseline',
+            default=None,
+            help='Results of an earlier run to compare against',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=REGRESSION_THRESHOLD,
+            help='Fraction a median latency may rise above the baseline',
+        )
+
+    def handle(self, *args, **options):
+        results = run_benchmark(
+            sizes=options['sizes'],
+            tolerances=options['tolerances'],
+            operations=options['operations'],
+            iterations=options['iterations'],
+            seed=options['seed'],
+        )
+        results_json = json.dumps(results, indent=4, sort_keys=True)
+        if options['output'] == '-':
+            self.stdout.write(results_json)
+        else:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(results_json + '\n')
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = compare_results(
+                results,
+                baseline,
+                options['threshold'],
+            )
+            for regression in regressions:
+                self.stderr.write(
+                    '{operation} size={size} tolerance={tolerance}: '
+                    '{p50_us:.1f}us, baseline {baseline_p50_us:.1f}us '
+                    '({ratio:.2f}x)'.format(**regression)
+                )
+            if regressions:
+                raise CommandError(
+                    '{count} benchmark results regressed'.format(
+                        count=len(regressions),
+                    )
+                )
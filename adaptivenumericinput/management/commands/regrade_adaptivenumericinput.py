@@ -0,0 +1,68 @@
+"""
+Regrade every stored adaptivenumericinput answer in a course
+
+    python manage.py regrade_adaptivenumericinput course-v1:foo+bar+baz \
+        --states studentmodule.jsonl --blocks blocks.jsonl \
+        --output regraded.jsonl
+"""
+import json
+
+from adaptivenumericinput.regrade import regrade
+
+from ._student_module import StudentModuleCommand
+
+
+class Command(StudentModuleCommand):
+    """
+    Streams exported StudentModule rows through the current credit_list
+    of each block and writes one JSON line per regraded learner.
+    LMS callers can iterate adaptivenumericinput.regrade.regrade instead
+    and publish each new score through the block runtime.
+    """
+    help = 'Regrades stored adaptivenumericinput answers for a course'
+    output_help = 'File for regraded scores as JSON lines, "-" for stdout'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Number of worker processes, defaults to the CPU count',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows sent to a worker at a time',
+        )
+        parser.add_argument(
+            '--changed-only',
+            action='store_true',
+            help='Only write learners whose score changed',
+        )
+
+    def handle_states(self, states_file, blocks, output_file, options):
+        count_regraded = 0
+        count_changed = 0
+        for result in regrade(
+                states_file,
+                blocks,
+                course_id=options['course_id'],
+                processes=options['processes'],
+                batch_size=options['batch_size'],
+        ):
+            count_regraded += 1
+            changed = result['score'] != result['old_score']
+            count_changed += changed
+            if changed or not options['changed_only']:
+                output_file.write(
+                    json.dumps(result, sort_keys=True) + '\n'
+                )
+        self.stderr.write(
+            'Regraded {count_regraded} answers, '
+            '{count_changed} changed'.format(
+                count_regraded=count_regraded,
+                count_changed=count_changed,
+            )
+        )
@@ -0,0 +1,332 @@
+"""
+    Timing histograms for the handler hot path.
+    Handler calls are timed in stages, e.g. parse, grade and feedback,
+    and each stage's duration is counted into a histogram bucket.
+"""
+from bisect import bisect_left
+from collections import deque
+
+import logging
+import socket
+import threading
+import time
+
+from .utils import get_backend
+
+
+# Upper bounds in seconds of the histogram buckets, durations above the
+# last bound are counted in one more bucket
+HISTOGRAM_BUCKETS = (
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0,
+)
+
+# Timed handler calls kept by MemoryExporter
+MEMORY_EXPORTER_SIZE = 1000
+
+# Stage recording a handler call's whole duration
+TOTAL_STAGE = 'total'
+
+_METRICS_EXPORTERS = {}
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Histogram(object):
+    """
+    Counts of durations in HISTOGRAM_BUCKETS, along with their sum and
+    the longest one
+    """
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """
+        Counts one duration
+        """
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """
+        Adds the counts of another histogram with the same buckets
+        """
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound of the bucket holding the percentile,
+        no more than the longest duration, or None if nothing was counted
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts[:-1]):
+            seen += count
+            if count and seen >= rank:
+                return min(self.buckets[index], self.max)
+        return self.max
+
+    def get_summary(self):
+        """
+        Returns the count, mean, 50th, 95th and 99th percentiles and the
+        longest duration, in seconds
+        """
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def as_dict(self):
+        """
+        Returns the histogram as JSON serializable values
+        """
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+        }
+
+
+class StageTimer(object):
+    """
+    Times the stages of one handler call
+    Each mark records the time since the previous mark, or since the
+    call started, as the named stage.
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.stages = []
+        self.start = self.last = time.time()
+
+    def mark(self, stage):
+        """
+        Ends the current stage
+        """
+        now = time.time()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def get_stages(self):
+        """
+        Returns (stage, seconds) for each marked stage, then the total
+        """
+        return self.stages + [(TOTAL_STAGE, self.last - self.start)]
+
+
+class HandlerMetrics(object):
+    """
+    Histograms of handler stage durations, per handler and stage
+
+    Each thread records into its own histograms, so recording takes no
+    lock.  Snapshots merge the histograms of every thread.  Histograms
+    of finished threads are folded together whenever a thread records
+    for the first time or a snapshot is taken, so they are kept without
+    holding on to every thread.
+    """
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._threads = []
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def _get_histograms(self):
+        histograms = getattr(self._local, 'histograms', None)
+        if histograms is None:
+            histograms = {}
+            self._local.histograms = histograms
+            with self._lock:
+                self._prune_threads()
+                self._threads.append(
+                    (threading.current_thread(), histograms)
+                )
+        return histograms
+
+    def _prune_threads(self):
+        # Folds the histograms of finished threads into self._finished,
+        # called with self._lock held
+        threads = []
+        for thread, histograms in self._threads:
+            if thread.is_alive():
+                threads.append((thread, histograms))
+                continue
+            for key, histogram in list(histograms.items()):
+                self._finished.setdefault(
+                    key,
+                    Histogram(self.buckets),
+                ).merge(histogram)
+        self._threads = threads
+
+    def record(self, handler, stage, seconds):
+        """
+        Counts a stage duration of a handler call
+        """
+        histograms = self._get_histograms()
+        histogram = histograms.get((handler, stage))
+        if histogram is None:
+            histogram = Histogram(self.buckets)
+            histograms[(handler, stage)] = histogram
+        histogram.record(seconds)
+
+    def record_timer(self, timer):
+        """
+        Counts every stage of a timed handler call
+        """
+        for stage, seconds in timer.get_stages():
+            self.record(timer.handler, stage, seconds)
+
+    def snapshot(self):
+        """
+        Returns a merged Histogram for each (handler, stage)
+        """
+        snapshot = {}
+        with self._lock:
+            self._prune_threads()
+            threads = list(self._threads)
+            for key, histogram in self._finished.items():
+                snapshot.setdefault(key, Histogram(self.buckets)).merge(
+                    histogram
+                )
+        for _, histograms in threads:
+            for key, histogram in list(histograms.items()):
+                snapshot.setdefault(key, Histogram(self.buckets)).merge(
+                    histogram
+                )
+        return snapshot
+
+    def get_summary(self):
+        """
+        Returns Histogram.get_summary for each stage of each handler
+        """
+        summary = {}
+        for (handler, stage), histogram in self.snapshot().items():
+            summary.setdefault(handler, {})[stage] = histogram.get_summary()
+        return summary
+
+    def clear(self):
+        """
+        Removes every count
+        """
+        with self._lock:
+            self._finished.clear()
+            for _, histograms in self._threads:
+                histograms.clear()
+
+
+class MemoryExporter(object):
+    """
+    Keeps the most recent timed handler calls in memory
+    """
+    def __init__(self, maxlen=MEMORY_EXPORTER_SIZE):
+        self._calls = deque(maxlen=maxlen)
+
+    def clear(self):
+        """
+        Removes every call
+        """
+        self._calls.clear()
+
+    def export(self, handler, stages):
+        """
+        Keeps the (stage, seconds) durations of a handler call
+        """
+        self._calls.append((handler, stages))
+
+    def dump(self):
+        """
+        Returns (handler, stages) for the kept calls, oldest first
+        """
+        return list(self._calls)
+
+
+class LogExporter(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Logs a line with the stage durations of each handler call
+    """
+    def export(self, handler, stages):
+        # pylint: disable=no-self-use
+        """
+        Logs the (stage, seconds) durations of a handler call
+        """
+        log.info(
+            'handler=%s %s',
+            handler,
+            ' '.join(
+                '{stage}={seconds:.6f}'.format(stage=stage, seconds=seconds)
+                for stage, seconds in stages
+            ),
+        )
+
+
+class StatsdExporter(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Sends stage durations as statsd timers over UDP
+    Packets are sent without waiting, lost packets are not noticed.
+    """
+    host = '127.0.0.1'
+    port = 8125
+    prefix = 'adaptivenumericinput'
+
+    def __init__(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, handler, stages):
+        """
+        Sends the (stage, seconds) durations of a handler call
+        """
+        payload = '\n'.join(
+            '{prefix}.{handler}.{stage}:{milliseconds:.3f}|ms'.format(
+                prefix=self.prefix,
+                handler=handler,
+                stage=stage,
+                milliseconds=seconds * 1000,
+            )
+            for stage, seconds in stages
+        )
+        try:
+            self._socket.sendto(payload.encode('utf8'), (self.host, self.port))
+        except socket.error:
+            pass
+
+
+_HANDLER_METRICS = HandlerMetrics()
+
+
+def get_handler_metrics():
+    """
+    Returns the process wide handler histograms
+    """
+    return _HANDLER_METRICS
+
+
+def get_metrics_exporter(path=None):
+    """
+    Returns the process wide metrics exporter for a dotted class path
+    Returns a MemoryExporter if path is not set, LogExporter and
+    StatsdExporter can be set instead.
+    """
+    return get_backend(_METRICS_EXPORTERS, path, MemoryExporter)
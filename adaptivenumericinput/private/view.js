@@ -1,8 +1,34 @@
-function AdaptiveNumericInputView(runtime, element) {
+function AdaptiveNumericInputView(runtime, element, data) {
     'use strict';
     
     var $ = window.jQuery;
     var $element = $(element);
+
+    // Hints are sent with the view and cycled here, the counter is saved
+    // with the next submit or save
+    data = data || {};
+    var hintMessages = data.hint_messages;
+    var hintCounter = data.hint_counter || 0;
+    var hintCounterSaved = hintCounter;
+
+    // Drafts are saved at most once per autosaveInterval milliseconds
+    // while the learner types, if the interval is set
+    var autosaveInterval = data.autosave_interval || 0;
+    var autosaveTimer = null;
+    var autosaveRequest = null;
+
+    // Views of every block on the page, by usage id, are submitted
+    // together in submit all mode
+    var submitAll = data.submit_all || false;
+    var usageId = data.usage_id;
+    var submitAllViews = AdaptiveNumericInputView.submitAllViews =
+        AdaptiveNumericInputView.submitAllViews || {};
+
+    // Submissions carry a token, kept until the answer changes, so the
+    // server answers double clicks and retries without grading again
+    var submissionToken = null;
+    var submitting = false;
+    var submitRetries = 2;
     
     var buttonHint = $element.find('.hint');
     var buttonSave = $element.find('.save');
@@ -20,10 +46,14 @@ function AdaptiveNumericInputView(runtime, element) {
   
     var studentAnswer = $element.find('.student_answer');
     var capaInputType = $element.find('.capa_inputtype');
+    var studentAnswerSaved = studentAnswer.val();
+    var studentAnswerSubmitted = studentAnswer.val();
 
     var urlHint = runtime.handlerUrl(element, 'hint_reponse');
     var urlSave = runtime.handlerUrl(element, 'save_response');
+    var urlAutosave = runtime.handlerUrl(element, 'autosave_response');
     var urlSubmit = runtime.handlerUrl(element, 'submit');
+    var urlSubmitAll = runtime.handlerUrl(element, 'submit_all');
 
 
     // POLYFILL notify if it does not exist. Like in the xblock workbench.
@@ -38,42 +68,197 @@ function AdaptiveNumericInputView(runtime, element) {
         capaInputType.addClass(new_class); 
     }
 
+    function getAnswerData() {
+        var answerData = {
+            'student_answer': $element.find('.student_answer').val()
+        };
+        if (hintCounter !== hintCounterSaved) {
+            answerData.hint_counter = hintCounter;
+        }
+        if (submitAll) {
+            answerData.usage_id = usageId;
+        }
+        return answerData;
+    }
+
+    function getSubmitData() {
+        var answerData = getAnswerData();
+        if (submissionToken === null) {
+            submissionToken = new Date().getTime().toString(36) +
+                Math.random().toString(36).slice(2);
+        }
+        answerData.submission_token = submissionToken;
+        return answerData;
+    }
+
+    function postSubmit(url, requestData, onSuccess, retries) {
+        $.ajax(url, {
+            type: 'POST',
+            data: JSON.stringify(requestData),
+            success: function postSubmitOnSuccess(response) {
+                submitting = false;
+                onSuccess(response);
+            },
+            error: function postSubmitOnError(request) {
+                // Network and server errors are retried with the same token
+                if (retries > 0 && (request.status === 0 ||
+                                    request.status >= 500)) {
+                    postSubmit(url, requestData, onSuccess, retries - 1);
+                    return;
+                }
+                submitting = false;
+                buttonSubmit.text('Submit');
+                runtime.notify('error', {});
+            }
+        });
+    }
+
+    function setHintCounterSaved(answerData) {
+        if (answerData.hint_counter !== undefined) {
+            hintCounterSaved = answerData.hint_counter;
+        }
+    }
+
+    function setAnswerSaved(answerData) {
+        studentAnswerSaved = answerData.student_answer;
+        setHintCounterSaved(answerData);
+    }
+
+    function autosave() {
+        autosaveTimer = null;
+        if (autosaveRequest) {
+            // Wait for the last draft to be saved before sending another
+            scheduleAutosave();
+            return;
+        }
+        var answerData = getAnswerData();
+        if (answerData.student_answer === studentAnswerSaved) {
+            return;
+        }
+        autosaveRequest = $.ajax(urlAutosave, {
+            type: 'POST',
+            data: JSON.stringify(answerData),
+            success: function autosaveOnSuccess(response) {
+                if (response.saved) {
+                    setAnswerSaved(answerData);
+                } else {
+                    autosaveInterval = 0;
+                }
+            },
+            complete: function autosaveOnComplete() {
+                autosaveRequest = null;
+            }
+        });
+    }
+
+    function scheduleAutosave() {
+        if (autosaveInterval > 0 && autosaveTimer === null) {
+            autosaveTimer = window.setTimeout(autosave, autosaveInterval);
+        }
+    }
+
+    function showSubmitResponse(answerData, response) {
+        if (response.status === 'rate_limited') {
+            buttonSubmit.text('Submit');
+            submissionReceivedMessage.text(response.message);
+            return;
+        }
+        setAnswerSaved(answerData);
+        studentAnswerSubmitted = answerData.student_answer;
+
+        buttonSave.addClass(response.hide_submit_class);
+        buttonSubmit.addClass(response.hide_submit_class);
+        buttonSubmit.text('Submit');
+        
+        attemptsMessage.text(response.attempts_message);
+        feedbackLabel.text(response.feedback_label);
+        feedbackText.text(response.feedback_message);
+        hintText.text('');
+        progressMessage.text(response.progress_message);
+        savedMessage.text('');
+        submissionReceivedMessage.text(response.submitted_message);
+        
+        setClassForStudentAnswerParent(response.indicator_class); 
+    }
+
+    function isAnswerChanged() {
+        var answer = studentAnswer.val();
+        return answer !== '' && answer !== studentAnswerSubmitted;
+    }
+
+    function hasAttemptsLeft() {
+        // The submit button is hidden once no attempts are left
+        return !buttonSubmit.hasClass('nodisplay');
+    }
+
+    function getSubmitAllAnswers(answerData) {
+        // This block's answer and every other changed answer on the page
+        // that can still be submitted
+        var answers = [answerData];
+        $.each(submitAllViews, function (viewUsageId, view) {
+            if (!document.body.contains(view.element)) {
+                delete submitAllViews[viewUsageId];
+            } else if (
+                viewUsageId !== usageId &&
+                view.hasAttemptsLeft() &&
+                view.isAnswerChanged()
+            ) {
+                answers.push(view.getAnswerData());
+            }
+        });
+        return answers;
+    }
+
+    function showSubmitAllResponse(answers, response) {
+        $.each(answers, function (index, answer) {
+            var result = (response.results || {})[answer.usage_id];
+            var view = submitAllViews[answer.usage_id];
+            if (view && result && result.status !== 'error') {
+                view.showSubmitResponse(answer, result);
+            }
+        });
+        buttonSubmit.text('Submit');
+    }
+
+    if (submitAll) {
+        submitAllViews[usageId] = {
+            element: element,
+            getAnswerData: getSubmitData,
+            hasAttemptsLeft: hasAttemptsLeft,
+            isAnswerChanged: isAnswerChanged,
+            showSubmitResponse: showSubmitResponse
+        };
+    }
+
     buttonSubmit.on('click', function () {
+        if (submitting) {
+            return false;
+        }
+        submitting = true;
         buttonSubmit.text('Checking...');
         runtime.notify('submit', {
             message: 'Submitting...',
             state: 'start'
         });
-        $.ajax(urlSubmit, {
-            type: 'POST',
-            data: JSON.stringify({
-                'student_answer': $element.find('.student_answer').val()
-            }),
-            success: function buttonSubmitOnSuccess(response) {
-                buttonSubmit.text('Checkingvjjasldfk;as');
-                
-                buttonSave.addClass(response.hide_submit_class);
-                buttonSubmit.addClass(response.hide_submit_class);
-                buttonSubmit.text('Submit');
-                
-                attemptsMessage.text(response.attempts_message);
-                feedbackLabel.text(response.feedback_label);
-                feedbackText.text(response.feedback_message);
-                hintText.text('');
-                progressMessage.text(response.progress_message);
-                savedMessage.text('');
-                submissionReceivedMessage.text(response.submitted_message);
-                
-                setClassForStudentAnswerParent(response.indicator_class); 
-
-                runtime.notify('submit', {
-                    state: 'end'
-                });
-            },
-            error: function buttonSubmitOnError() {
-                runtime.notify('error', {});
+        var answerData = getSubmitData();
+        var url = urlSubmit;
+        var requestData = answerData;
+        if (submitAll) {
+            url = urlSubmitAll;
+            requestData = {
+                'answers': getSubmitAllAnswers(answerData)
+            };
+        }
+        postSubmit(url, requestData, function buttonSubmitOnSuccess(response) {
+            if (submitAll) {
+                showSubmitAllResponse(requestData.answers, response);
+            } else {
+                showSubmitResponse(answerData, response);
             }
-        });
+            runtime.notify('submit', {
+                state: 'end'
+            });
+        }, submitRetries);
         return false;
     });
 
@@ -83,12 +268,12 @@ function AdaptiveNumericInputView(runtime, element) {
             message: 'Saving...',
             state: 'start'
         });
+        var answerData = getAnswerData();
         $.ajax(urlSave, {
             type: 'POST',
-            data: JSON.stringify({
-                'student_answer': $element.find('.student_answer').val()
-            }),
+            data: JSON.stringify(answerData),
             success: function buttonSaveOnSuccess(response) {
+                setAnswerSaved(answerData);
                 buttonSave.addClass(response.hide_submit_class);
                 buttonSave.text('Save');
                 buttonSubmit.addClass(response.hide_submit_class);
@@ -105,6 +290,11 @@ function AdaptiveNumericInputView(runtime, element) {
     });
 
     buttonHint.on('click', function () {
+        if (hintMessages && hintMessages.length) {
+            hintText.text(hintMessages[hintCounter % hintMessages.length]);
+            hintCounter += 1;
+            return false;
+        }
         runtime.notify('hint', {
             message: 'Hint',
             state: 'start'
@@ -125,7 +315,9 @@ function AdaptiveNumericInputView(runtime, element) {
         return false;
     });
 
-    studentAnswer.on('keydown', function() {
+    studentAnswer.on('input', function() {
+        // Any change, typed, pasted or autofilled, is a new submission
+        submissionToken = null;
         // Reset Messages
         feedbackLabel.text('');
         feedbackText.text('');
@@ -133,5 +325,7 @@ function AdaptiveNumericInputView(runtime, element) {
         submissionReceivedMessage.text('');
         setClassForStudentAnswerParent('unanswered');
     });
+
+    studentAnswer.on('input', scheduleAutosave);
 }
 
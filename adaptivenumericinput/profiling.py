@@ -0,0 +1,183 @@
+"""
+    Sampling profiler for handler calls.
+    A background thread samples the handler thread's stack at a fixed
+    interval, and the samples are written as collapsed stacks, one
+    'frame;frame;frame count' line per stack, keyed by block usage id.
+"""
+import os
+import re
+import sys
+import threading
+import time
+
+from .utils import get_backend
+
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Blocks whose profiles are kept by MemoryProfileSink
+MEMORY_PROFILE_SINK_SIZE = 1000
+
+_PROFILE_SINKS = {}
+
+_UNSAFE_FILENAME = re.compile(r'[^A-Za-z0-9_.+@-]')
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{function} ({filename}:{line})'.format(
+        function=code.co_name,
+        filename=os.path.basename(code.co_filename),
+        line=code.co_firstlineno,
+    )
+
+
+def format_collapsed(stacks):
+    """
+    Returns collapsed stack lines for a {stack: count} dict, in the
+    format flame graph tools read
+    """
+    return ''.join(
+        '{stack} {count}\n'.format(stack=stack, count=count)
+        for stack, count in sorted(stacks.items())
+    )
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of the thread it is entered in until it is left
+
+    Sampling runs in its own thread, so the profiled code is not traced
+    and only pays for the sampler taking the interpreter lock.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self._thread_id = None
+        self._sampler = None
+        self._running = False
+
+    def __enter__(self):
+        self._thread_id = threading.current_thread().ident
+        self._running = True
+        self._sampler = threading.Thread(target=self._sample_loop)
+        self._sampler.daemon = True
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._running = False
+        self._sampler.join()
+        return False
+
+    def _sample_loop(self):
+        while self._running:
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        """
+        Counts the profiled thread's current stack
+        """
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(self._thread_id)
+        frames = []
+        while frame is not None:
+            frames.append(_frame_name(frame))
+            frame = frame.f_back
+        if frames:
+            stack = ';'.join(reversed(frames))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+
+class MemoryProfileSink(object):
+    """
+    Keeps the merged profile of each block in memory
+    Once MEMORY_PROFILE_SINK_SIZE blocks are kept, profiles of other
+    blocks are dropped.
+    """
+    def __init__(self, maxsize=MEMORY_PROFILE_SINK_SIZE):
+        self.maxsize = maxsize
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """
+        Removes every profile
+        """
+        with self._lock:
+            self._profiles.clear()
+
+    def record(self, usage_id, stacks):
+        """
+        Merges the {stack: count} samples of one profiled handler call
+        """
+        with self._lock:
+            profile = self._profiles.get(usage_id)
+            if profile is None:
+                if len(self._profiles) >= self.maxsize:
+                    return
+                profile = {'requests': 0, 'stacks': {}}
+                self._profiles[usage_id] = profile
+            profile['requests'] += 1
+            for stack, count in stacks.items():
+                profile['stacks'][stack] = (
+                    profile['stacks'].get(stack, 0) + count
+                )
+
+    def dump(self):
+        """
+        Returns the profiled requests and collapsed stacks of each block
+        """
+        with self._lock:
+            return dict(
+                (usage_id, {
+                    'requests': profile['requests'],
+                    'collapsed': format_collapsed(profile['stacks']),
+                })
+                for usage_id, profile in self._profiles.items()
+            )
+
+
+class CollapsedStackFileSink(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Appends collapsed stacks to one file per block in 'directory'
+    Lines for the same stack are summed by flame graph tools.
+    """
+    directory = 'adaptivenumericinput_profiles'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def get_path(self, usage_id):
+        """
+        Returns the file the profiles of usage_id are written to
+        """
+        return os.path.join(
+            self.directory,
+            _UNSAFE_FILENAME.sub('_', usage_id) + '.collapsed',
+        )
+
+    def record(self, usage_id, stacks):
+        """
+        Writes the {stack: count} samples of one profiled handler call
+        """
+        collapsed = format_collapsed(stacks)
+        if not collapsed:
+            return
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(self.get_path(usage_id), 'a') as profile_file:
+                profile_file.write(collapsed)
+
+
+def get_profile_sink(path=None):
+    """
+    Returns the process wide profile sink for a dotted class path
+    Returns a MemoryProfileSink if path is not set.  Profiles are written
+    to files by CollapsedStackFileSink.
+    """
+    return get_backend(_PROFILE_SINKS, path, MemoryProfileSink)
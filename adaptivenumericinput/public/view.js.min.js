@@ -1,2 +1,2 @@
-function AdaptiveNumericInputView(a,b){"use strict";function c(a){q.removeClass("correct"),q.removeClass("incorrect"),q.removeClass("unanswered"),q.addClass(a)}var d=window.jQuery,e=d(b),f=e.find(".hint"),g=e.find(".save"),h=e.find(".check.Submit"),i=e.find(".action .attempts-message"),j=e.find(".progress-message"),k=e.find(".submission-received"),l=e.find(".saved-message"),m=(e.find(".feedback"),e.find(".feedback-label")),n=e.find(".feedback-text"),o=e.find(".hint-text"),p=e.find(".student_answer"),q=e.find(".capa_inputtype"),r=a.handlerUrl(b,"hint_reponse"),s=a.handlerUrl(b,"save_response"),t=a.handlerUrl(b,"submit");a.notify=a.notify||function(){console.log("POLYFILL runtime.notify",arguments)},h.on("click",function(){return h.text("Checking..."),a.notify("submit",{message:"Submitting...",state:"start"}),d.ajax(t,{type:"POST",data:JSON.stringify({student_answer:e.find(".student_answer").val()}),success:function(b){g.addClass(b.hide_submit_class),h.addClass(b.hide_submit_class),h.text("Submit"),i.text(b.attempts_message),m.text(b.feedback_label),n.text(b.feedback_message),o.text(""),j.text(b.progress_message),l.text(""),k.text(b.submitted_message),c(b.indicator_class),a.notify("submit",{state:"end"})},error:function(){a.notify("error",{})}}),!1}),g.on("click",function(){return g.text("Checking..."),a.notify("save",{message:"Saving...",state:"start"}),d.ajax(s,{type:"POST",data:JSON.stringify({student_answer:e.find(".student_answer").val()}),success:function(b){g.addClass(b.hide_submit_class),g.text("Save"),h.addClass(b.hide_submit_class),l.text(b.saved_message),a.notify("save",{state:"end"})},error:function(){a.notify("error",{})}}),!1}),f.on("click",function(){return a.notify("hint",{message:"Hint",state:"start"}),d.ajax(r,{type:"POST",data:JSON.stringify({}),success:function(b){o.text(b.hint_message),a.notify("hint",{state:"end"})},error:function(){a.notify("error",{})}}),!1}),p.on("keydown",function(){m.text(""),n.text(""),l.text(""),k.text(""),c("unanswered")})}
+function AdaptiveNumericInputView(a,b,c){'use strict';var d=window.jQuery;var e=d(b);c=c||{};var f=c.hint_messages;var g=c.hint_counter||0;var h=g;var i=c.autosave_interval||0;var j=null;var k=null;var l=c.submit_all||false;var m=c.usage_id;var n=AdaptiveNumericInputView.submitAllViews=AdaptiveNumericInputView.submitAllViews||{};var o=null;var p=false;var q=2;var r=e.find('.hint');var s=e.find('.save');var t=e.find('.check.Submit');var u=e.find('.action .attempts-message');var v=e.find('.progress-message');var w=e.find('.submission-received');var x=e.find('.saved-message');var y=e.find('.feedback');var z=e.find('.feedback-label');var A=e.find('.feedback-text');var B=e.find('.hint-text');var C=e.find('.student_answer');var D=e.find('.capa_inputtype');var E=C.val();var F=C.val();var G=a.handlerUrl(b,'hint_reponse');var H=a.handlerUrl(b,'save_response');var I=a.handlerUrl(b,'autosave_response');var J=a.handlerUrl(b,'submit');var K=a.handlerUrl(b,'submit_all');a.notify=a.notify||function(){console.log('POLYFILL runtime.notify',arguments)};function L(a){D.removeClass('correct');D.removeClass('incorrect');D.removeClass('unanswered');D.addClass(a)}function M(){var a={'student_answer':e.find('.student_answer').val()};if(g!==h){a.hint_counter=g}if(l){a.usage_id=m}return a}function N(){var a=M();if(o===null){o=new Date().getTime().toString(36)+Math.random().toString(36).slice(2)}a.submission_token=o;return a}function O(b,c,e,f){d.ajax(b,{type:'POST',data:JSON.stringify(c),success:function a(b){p=false;e(b)},error:function d(g){if(f>0&&(g.status===0||g.status>=500)){O(b,c,e,f-1);return}p=false;t.text('Submit');a.notify('error',{})}})}function P(a){if(a.hint_counter!==undefined){h=a.hint_counter}}function Q(a){E=a.student_answer;P(a)}function R(){j=null;if(k){S();return}var a=M();if(a.student_answer===E){return}k=d.ajax(I,{type:'POST',data:JSON.stringify(a),success:function b(c){if(c.saved){Q(a)}else{i=0}},complete:function a(){k=null}})}function S(){if(i>0&&j===null){j=window.setTimeout(R,i)}}function T(a,b){if(b.status==='rate_limited'){t.text('Submit');w.text(b.message);return}Q(a);F=a.student_answer;s.addClass(b.hide_submit_class);t.addClass(b.hide_submit_class);t.text('Submit');u.text(b.attempts_message);z.text(b.feedback_label);A.text(b.feedback_message);B.text('');v.text(b.progress_message);x.text('');w.text(b.submitted_message);L(b.indicator_class)}function U(){var a=C.val();return a!==''&&a!==F}function V(){return!t.hasClass('nodisplay')}function W(a){var b=[a];d.each(n,function(a,c){if(!document.body.contains(c.element)){delete n[a]}else if(a!==m&&c.hasAttemptsLeft()&&c.isAnswerChanged()){b.push(c.getAnswerData())}});return b}function X(a,b){d.each(a,function(a,c){var d=(b.results||{})[c.usage_id];var e=n[c.usage_id];if(e&&d&&d.status!=='error'){e.showSubmitResponse(c,d)}});t.text('Submit')}if(l){n[m]={element:b,getAnswerData:N,hasAttemptsLeft:V,isAnswerChanged:U,showSubmitResponse:T}}t.on('click',function(){if(p){return false}p=true;t.text('Checking...');a.notify('submit',{message:'Submitting...',state:'start'});var b=N();var c=J;var d=b;if(l){c=K;d={'answers':W(b)}}O(c,d,function c(e){if(l){X(d.answers,e)}else{T(b,e)}a.notify('submit',{state:'end'})},q);return false});s.on('click',function(){s.text('Checking...');a.notify('save',{message:'Saving...',state:'start'});var b=M();d.ajax(H,{type:'POST',data:JSON.stringify(b),success:function c(d){Q(b);s.addClass(d.hide_submit_class);s.text('Save');t.addClass(d.hide_submit_class);x.text(d.saved_message);a.notify('save',{state:'end'})},error:function b(){a.notify('error',{})}});return false});r.on('click',function(){if(f&&f.length){B.text(f[g%f.length]);g+=1;return false}a.notify('hint',{message:'Hint',state:'start'});d.ajax(G,{type:'POST',data:JSON.stringify({}),success:function b(c){B.text(c.hint_message);a.notify('hint',{state:'end'})},error:function b(){a.notify('error',{})}});return false});C.on('input',function(){o=null;z.text('');A.text('');x.text('');w.text('');L('unanswered')});C.on('input',S)}
 //# sourceMappingURL=view.js.min.js.map
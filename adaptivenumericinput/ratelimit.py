@@ -0,0 +1,58 @@
+"""
+    Token bucket rate limits for learner submissions.
+    Each learner and block has a bucket of 'burst' tokens refilled at
+    'rate' tokens a second, and every submission takes one.
+"""
+from threading import Lock
+
+import time
+
+from .cache import LRUCache
+from .utils import get_backend
+
+
+# Learners whose buckets are kept by LocalRateLimiter
+LOCAL_RATE_LIMITER_SIZE = 10000
+
+_RATE_LIMITERS = {}
+
+
+class LocalRateLimiter(object):
+    """
+    Token buckets shared by the threads of one process
+
+    The least recently used buckets are evicted and start full again.
+    """
+    def __init__(self, maxsize=LOCAL_RATE_LIMITER_SIZE):
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._lock = Lock()
+
+    def clear(self):
+        """
+        Removes every bucket
+        """
+        self._buckets.clear()
+
+    def allow(self, key, rate, burst):
+        """
+        Takes a token from the bucket for key
+        Returns False, without taking a token, if the bucket is empty.
+        """
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets.set(key, (tokens, now))
+            return allowed
+
+
+def get_rate_limiter(path=None):
+    """
+    Returns the process wide rate limiter for a dotted class path
+    Returns a LocalRateLimiter if path is not set.  A limiter shared
+    between processes needs an allow(key, rate, burst) method.
+    """
+    return get_backend(_RATE_LIMITERS, path, LocalRateLimiter)
@@ -0,0 +1,177 @@
+"""
+    Regrades stored student answers against current block settings.
+    Student state is streamed in batches of raw JSON lines and graded by a
+    pool of worker processes, each keeping its own grading table cache.
+"""
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+
+import json
+
+from .grading import FEEDBACK_DEFAULT
+from .grading import get_graded_answer
+from .grading import get_grading_table
+from .storage import unpack_state
+
+
+# Block settings by usage id and the course being regraded,
+# set once in every worker process
+_WORKER_CONTEXT = {
+    'blocks': {},
+    'course_id': None,
+}
+
+
+def read_blocks(lines):
+    """
+    Returns block settings keyed by usage id from JSON lines
+    Each line holds 'usage_id', 'credit_list', 'instructor_answer' and
+    optionally 'feedback_default'.
+    """
+    blocks = {}
+    for line in lines:
+        line = line.strip()
+        if line:
+            block = json.loads(line)
+            blocks[block['usage_id']] = {
+                'credit_list': block['credit_list'],
+                'instructor_answer': block['instructor_answer'],
+                'feedback_default': block.get(
+                    'feedback_default',
+                    FEEDBACK_DEFAULT,
+                ),
+            }
+    return blocks
+
+
+def get_block_grading_table(block):
+    """
+    Returns the GradingTable for block settings from read_blocks
+    """
+    return get_grading_table(
+        block['credit_list'],
+        block['instructor_answer'],
+        block.get('feedback_default', FEEDBACK_DEFAULT),
+    )
+
+
+def read_rows(lines, course_id=None):
+    """
+    Yields (row, state) for StudentModule rows exported as JSON lines
+    Rows need 'module_state_key', 'student_id' and 'state', which may be
+    the JSON encoded string StudentModule stores.  Rows for other courses
+    are skipped if course_id is set.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if course_id is not None and row.get('course_id') != course_id:
+            continue
+        state = row.get('state') or {}
+        if not isinstance(state, dict):
+            state = json.loads(state)
+        yield row, state
+
+
+def _init_worker(blocks, course_id=None):
+    _WORKER_CONTEXT['blocks'] = blocks
+    _WORKER_CONTEXT['course_id'] = course_id
+
+
+def regrade_state(module_state_key, state):
+    """
+    Returns the regrade result for one learner's stored block state
+    Returns None if the block is unknown or the learner never submitted
+    a numeric answer.  State packed with COMPACT_USER_STATE is unpacked.
+    """
+    state = unpack_state(state)
+    block = _WORKER_CONTEXT['blocks'].get(module_state_key)
+    if block is None or not state.get('count_attempts'):
+        return None
+    student_answer, student_answer_float = get_graded_answer(state)
+    if student_answer_float is None:
+        return None
+    table = get_block_grading_table(block)
+    score, index, student_error = table.grade(student_answer_float)
+    if student_error != student_error:
+        student_error = None
+    feedback_message = ''
+    if index >= 0 or student_answer_float == table.instructor_answer:
+        feedback_message = table.get_feedback_message(
+            index,
+            student_answer,
+            student_error,
+        )
+    return {
+        'credit_index': index,
+        'feedback_message': feedback_message,
+        'old_score': state.get('score', 0.0),
+        'score': score,
+        'student_error': student_error,
+    }
+
+
+def regrade_lines(lines):
+    """
+    Regrades a batch of StudentModule rows exported as JSON lines
+    Rows for other courses, when regrading a single course, are skipped.
+    See read_rows.
+    """
+    results = []
+    for row, state in read_rows(lines, _WORKER_CONTEXT['course_id']):
+        result = regrade_state(row['module_state_key'], state)
+        if result is not None:
+            result['module_state_key'] = row['module_state_key']
+            result['student_id'] = row['student_id']
+            results.append(result)
+    return results
+
+
+def _batches(lines, batch_size):
+    lines = (line for line in lines if line.strip())
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def regrade(
+        lines,
+        blocks,
+        course_id=None,
+        processes=None,
+        batch_size=1000,
+):
+    """
+    Yields regrade results for StudentModule JSON lines in input order
+
+    Lines are read lazily and at most two batches per worker are in
+    flight, so memory use does not depend on the number of learners.
+    processes=1 grades in the calling process.
+    """
+    if processes == 1:
+        _init_worker(blocks, course_id)
+        for batch in _batches(lines, batch_size):
+            for result in regrade_lines(batch):
+                yield result
+        return
+    processes = processes or cpu_count()
+    pool = Pool(processes, _init_worker, (blocks, course_id))
+    max_pending = 2 * processes
+    pending = deque()
+    try:
+        for batch in _batches(lines, batch_size):
+            pending.append(pool.apply_async(regrade_lines, (batch,)))
+            while len(pending) >= max_pending:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,116 @@
+"""
+    Packaged resources, loaded once per process.
+    HTML templates are split into literal text and replacement fields
+    when first loaded so rendering is a single join.
+"""
+from string import Formatter
+
+import os
+import pkg_resources
+
+
+# Templates rendered by the XBlock, loaded by warm_resources()
+TEMPLATE_PATHS = (
+    'view.html',
+)
+
+_RESOURCE_STRINGS = {}
+
+_TEMPLATES = {}
+
+
+def get_package_string(path):
+    """
+    Retrieve string contents for a file path within the package
+    """
+    resource_string = _RESOURCE_STRINGS.get(path)
+    if resource_string is None:
+        resource_string = pkg_resources.resource_string(
+            __name__,
+            path,
+        ).decode('utf8')
+        _RESOURCE_STRINGS[path] = resource_string
+    return resource_string
+
+
+def get_resource_string(path):
+    """
+    Retrieve string contents for the public file path
+    """
+    return get_package_string(os.path.join('public', path))
+
+
+class FormatTemplate(object):
+    # pylint: disable=too-few-public-methods
+    """
+    A str.format template parsed once into literal text and fields
+    render(**kwargs) returns the same text as template.format(**kwargs).
+    """
+    def __init__(self, template):
+        self.template = template
+        self.literals = []
+        self.fields = []
+        literal_parts = []
+        for literal, field_name, format_spec, conversion in Formatter().parse(
+                template
+        ):
+            literal_parts.append(literal)
+            if field_name is not None:
+                self.literals.append(template[:0].join(literal_parts))
+                self.fields.append((field_name, format_spec, conversion))
+                literal_parts = []
+        self.literals.append(template[:0].join(literal_parts))
+        # Nested fields in format specs are left to str.format
+        self.nested = any('{' in field[1] for field in self.fields)
+
+    def render(self, **kwargs):
+        """
+        Returns the template with fields replaced by kwargs values
+        """
+        if self.nested:
+            return self.template.format(**kwargs)
+        formatter = Formatter()
+        parts = [self.literals[0]]
+        for (field_name, format_spec, conversion), literal in zip(
+                self.fields,
+                self.literals[1:],
+        ):
+            if field_name in kwargs:
+                value = kwargs[field_name]
+            else:
+                value = formatter.get_field(field_name, (), kwargs)[0]
+            if conversion:
+                value = formatter.convert_field(value, conversion)
+            parts.append(format(value, format_spec))
+            parts.append(literal)
+        return self.template[:0].join(parts)
+
+
+def get_template(path):
+    """
+    Returns the FormatTemplate for the public file path
+    """
+    template = _TEMPLATES.get(path)
+    if template is None:
+        template = FormatTemplate(get_resource_string(path))
+        _TEMPLATES[path] = template
+    return template
+
+
+def get_template_stats():
+    """
+    Returns which of TEMPLATE_PATHS are loaded in this process
+    """
+    return dict(
+        (path, path in _TEMPLATES)
+        for path in TEMPLATE_PATHS
+    )
+
+
+def warm_resources():
+    """
+    Loads and parses every template up front, e.g. at worker startup,
+    so the first render in each process does not pay for it
+    """
+    for path in TEMPLATE_PATHS:
+        get_template(path)
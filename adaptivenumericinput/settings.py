@@ -13,6 +13,7 @@ TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
 
 INSTALLED_APPS = (
     'django_nose',
+    'adaptivenumericinput',
 )
 
 SECRET_KEY = 'adaptivenumericinput_SECRET_KEY'
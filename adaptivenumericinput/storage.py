@@ -0,0 +1,134 @@
+"""
+    Compact storage for learner state.
+    Learner state written by the handlers is packed into one user_state
+    field, so saving a submission is a single key value write.
+    This module imports without XBlock, so the regrade and distribution
+    tools can read packed state.
+"""
+
+# The user_state field holding the packed values
+PACKED_FIELD = 'packed_state'
+
+# User state fields stored in PACKED_FIELD
+PACKED_FIELDS = (
+    'count_attempts',
+    'credit_index',
+    'credit_version',
+    'hint_counter',
+    'published_score',
+    'score',
+    'student_answer',
+    'student_answer_float',
+    'student_error',
+    'submission_token',
+)
+
+
+def unpack_state(state):
+    """
+    Returns stored learner state with the values in PACKED_FIELD unpacked
+    Packed values replace those still stored in their own fields.
+    """
+    packed = state.get(PACKED_FIELD)
+    if not packed:
+        return state
+    state = dict(state)
+    state.update(packed)
+    return state
+
+
+class PackedFieldData(object):
+    """
+    Wraps a FieldData and keeps PACKED_FIELDS in PACKED_FIELD
+    It provides the FieldData methods without subclassing it, so this
+    module does not load XBlock.
+
+    Values still stored in their own fields, from before packing was
+    enabled, are read until the first write, which moves them all into
+    PACKED_FIELD.  The old fields are left as they were, so they are
+    stale if packing is later disabled.
+    """
+    def __init__(self, field_data):
+        self.field_data = field_data
+
+    def get_packed(self, block):
+        """
+        Returns the packed values stored for block
+        """
+        if self.field_data.has(block, PACKED_FIELD):
+            return self.field_data.get(block, PACKED_FIELD) or {}
+        return {}
+
+    def get(self, block, name):
+        """
+        Returns the value of field 'name'
+        """
+        if name in PACKED_FIELDS:
+            packed = self.get_packed(block)
+            if name in packed:
+                return packed[name]
+        return self.field_data.get(block, name)
+
+    def has(self, block, name):
+        """
+        Returns whether field 'name' is stored
+        """
+        if name in PACKED_FIELDS and name in self.get_packed(block):
+            return True
+        return self.field_data.has(block, name)
+
+    def set(self, block, name, value):
+        """
+        Stores the value of field 'name'
+        """
+        self.set_many(block, {name: value})
+
+    def set_many(self, block, update_dict):
+        """
+        Stores the values of several fields in one write
+        """
+        update_dict = dict(update_dict)
+        packed_update = dict(
+            (name, update_dict.pop(name))
+            for name in PACKED_FIELDS
+            if name in update_dict
+        )
+        if packed_update:
+            if self.field_data.has(block, PACKED_FIELD):
+                packed = self.field_data.get(block, PACKED_FIELD) or {}
+                # Values of fields no longer packed are dropped
+                packed = dict(
+                    (name, value)
+                    for name, value in packed.items()
+                    if name in PACKED_FIELDS
+                )
+            else:
+                # First write, migrate values from the unpacked fields
+                packed = dict(
+                    (name, self.field_data.get(block, name))
+                    for name in PACKED_FIELDS
+                    if self.field_data.has(block, name)
+                )
+            packed.update(packed_update)
+            update_dict[PACKED_FIELD] = packed
+        if update_dict:
+            self.field_data.set_many(block, update_dict)
+
+    def delete(self, block, name):
+        """
+        Removes the stored value of field 'name'
+        """
+        if name in PACKED_FIELDS:
+            packed = self.get_packed(block)
+            if name in packed:
+                del packed[name]
+                self.field_data.set(block, PACKED_FIELD, packed)
+            if not self.field_data.has(block, name):
+                return
+        self.field_data.delete(block, name)
+
+    def default(self, block, name):
+        """
+        Returns the default of field 'name' from the wrapped FieldData
+        """
+        return self.field_data.default(block, name)
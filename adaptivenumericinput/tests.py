@@ -2,22 +2,78 @@
 Module To Test AdaptiveNumericInput
 """
 import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from array import array
+from random import Random
+from shutil import rmtree
+from xml.etree import ElementTree
+
 import ddt
 
-from mock import MagicMock, Mock
+from mock import MagicMock, Mock, patch
 
 from opaque_keys.edx.locations import SlashSeparatedCourseKey
 
 from xblock.field_data import DictFieldData
 from xblock.validation import ValidationMessage
 
+from . import adaptivenumericinput
 from .adaptivenumericinput import AdaptiveNumericInput
-from .adaptivenumericinput import FEEDBACK_LIST
-from .adaptivenumericinput import _answer_error
-from .adaptivenumericinput import _get_float
 from .adaptivenumericinput import _read_scenario_files
+from .adaptivenumericinput import synthetic_scenario
+from .attempts import LocalAttemptCounter
+from .benchmark import OPERATIONS
+from .benchmark import TOLERANCES
+from .benchmark import compare_results
+from .benchmark import make_answers
+from .benchmark import run_benchmark
+from .attempts import get_attempt_counter
+from .cache import LRUCache
+from .distribution import AnswerDistribution
+from .distribution import AnswerSketch
+from .distribution import FrequentAnswers
+from .distribution import aggregate_states
+from .distribution import read_states
+from .grading import FEEDBACK_DEFAULT
+from .grading import FEEDBACK_LIST
+from .grading import FeedbackTemplate
+from .grading import GradingTable
+from .grading import _answer_error
+from .grading import _get_float
+from .grading import grading_table_fingerprint
+from .metrics import HandlerMetrics
+from .metrics import Histogram
+from .metrics import LogExporter
+from .metrics import MemoryExporter
+from .metrics import StatsdExporter
+from .metrics import get_handler_metrics
+from .metrics import get_metrics_exporter
+from .profiling import CollapsedStackFileSink
+from .profiling import MemoryProfileSink
+from .profiling import SamplingProfiler
+from .profiling import format_collapsed
+from .profiling import get_profile_sink
+from .ratelimit import LocalRateLimiter
+from .ratelimit import get_rate_limiter
+from .regrade import get_block_grading_table
+from .regrade import read_blocks
+from . import resources
+from .resources import FormatTemplate
+from .resources import warm_resources
+from .regrade import regrade
 
+from .tracing import JsonFileSink
+from .tracing import MemorySink
+from .tracing import Tracer
+from .tracing import get_span_sink
+from .tracing import get_tracer
 from .utils import _
 
 
@@ -37,6 +93,7 @@ class TestRequest(object):
     """
     method = None
     body = None
+    headers = {}
     success = None
 
 
@@ -53,7 +110,10 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         Helper method that creates a Adaptive Numeric Input XBlock
         """
         course_id = SlashSeparatedCourseKey('foo', 'bar', 'baz')
-        runtime = Mock(course_id=course_id)
+        runtime = Mock(
+            course_id=course_id,
+            service=Mock(return_value=None),
+        )
         scope_ids = Mock()
         field_data = DictFieldData(kw)
         xblock = AdaptiveNumericInput(runtime, field_data, scope_ids)
@@ -65,6 +125,20 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         Creates an xblock
         """
         self.xblock = AdaptiveNumericInputTestCase.make_an_xblock()
+        self.addCleanup(get_attempt_counter().clear)
+        self.addCleanup(get_rate_limiter().clear)
+        self.addCleanup(get_handler_metrics().clear)
+        self.addCleanup(get_metrics_exporter().clear)
+        self.addCleanup(get_span_sink().clear)
+        self.addCleanup(get_profile_sink().clear)
+
+    def set_xblock_settings(self, **xblock_settings):
+        """
+        Helper that serves xblock_settings from the settings service
+        """
+        settings_service = Mock()
+        settings_service.get_settings_bucket.return_value = xblock_settings
+        self.xblock.runtime.service = Mock(return_value=settings_service)
 
     @ddt.data(
         # actual_answer, answer, result(absolute_error, percent_error))
@@ -116,6 +190,73 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         test_result = _read_scenario_files()
         self.assertEqual(test_str, test_result[0:len(test_str)])
 
+    def test__read_scenario_files_cached(self):
+        # pylint: disable=protected-access
+        """
+        Test _read_scenario_files reads each scenario file once per process
+        """
+        adaptivenumericinput._SCENARIOS.clear()
+        with patch(
+            'adaptivenumericinput.adaptivenumericinput.get_package_string',
+            return_value=u'<adaptivenumericinput />',
+        ) as get_package_string:
+            test_result = _read_scenario_files()
+            self.assertEqual(test_result, _read_scenario_files())
+        adaptivenumericinput._SCENARIOS.clear()
+        self.assertEqual(
+            len(adaptivenumericinput.SCENARIO_FILES),
+            get_package_string.call_count,
+        )
+
+    def test_synthetic_scenario(self):
+        """
+        Test synthetic_scenario builds N blocks with M entry credit lists
+        """
+        scenario = synthetic_scenario(3, 25)
+        vertical = ElementTree.fromstring(scenario)
+        self.assertEqual('vertical_demo', vertical.tag)
+        self.assertEqual(3, len(vertical))
+        for index, block in enumerate(vertical):
+            self.assertEqual('adaptivenumericinput', block.tag)
+            self.assertEqual(
+                float(index + 1),
+                float(block.get('instructor_answer')),
+            )
+            credit_list = json.loads(block.get('credit_list'))
+            self.assertEqual(25, len(credit_list))
+            table = GradingTable(credit_list, index + 1.0)
+            self.assertEqual(0, table.best_match(index + 1.0)[0])
+        self.assertIs(scenario, synthetic_scenario(3, 25))
+
+    def test_synthetic_credit_list_bounded(self):
+        """
+        Test large synthetic credit lists keep finite common mistakes
+        with feedback matching the mistake
+        """
+        # pylint: disable=protected-access
+        credit_list = adaptivenumericinput._synthetic_credit_list(
+            3.0,
+            10000,
+        )
+        self.assertEqual(10000, len(credit_list))
+        mistakes = [
+            credit_dict for credit_dict in credit_list
+            if 'answer' in credit_dict
+        ]
+        for credit_dict in mistakes:
+            answer = float(credit_dict['answer'])
+            self.assertLessEqual(abs(answer), 3.0 * 10 ** 6)
+            self.assertEqual(
+                answer < 0,
+                'wrong sign' in credit_dict['feedback'],
+            )
+            self.assertEqual(
+                abs(answer) != 3.0,
+                'power of ten' in credit_dict['feedback'],
+            )
+        table = GradingTable(credit_list, 3.0)
+        self.assertIsNone(table.best_match(7.0))
+
     def test_build_fragment(self):
         """
         Checks if fragment returned from build_fragment
@@ -403,6 +544,58 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         test_result = self.xblock.get_feedback_message()
         self.assertEquals(result, test_result)
 
+    @ddt.data(
+        # feedback, result
+        ('', ''),
+        ('No keywords', 'No keywords'),
+        ('%%ANSWER%%', '10.0'),
+        ('%%STUDENT_ANSWER%% vs %%ANSWER%%!', '9 vs 10.0!'),
+        ('%%ERROR_ABSOLUTE%%%%ERROR_PERCENT%%', '--10.0'),
+        ('%%UNKNOWN%% %%ANSWER', '%%UNKNOWN%% %%ANSWER'),
+        (u'%%STUDENT_ERROR%% \xe9', u'1.0 \xe9'),
+    )
+    @ddt.unpack
+    def test_feedback_template_render(self, feedback, result):
+        """
+        Test FeedbackTemplate renders like replacing each FEEDBACK_LIST key
+        """
+        credit_dict = {
+            'answer': 10.0,
+            'error_percent': 10.0,
+            'student_error': 1.0,
+            'student_answer': '9',
+        }
+        test_result = FeedbackTemplate(feedback).render(credit_dict)
+        self.assertEqual(result, test_result)
+        for key in FEEDBACK_LIST:
+            value = credit_dict.get(str(key.lower()[2:-2]))
+            if value is None:
+                value = '--'
+            feedback = feedback.replace(key, str(value))
+        self.assertEqual(feedback, test_result)
+
+    def test_grading_table_feedback_message(self):
+        """
+        Test GradingTable renders feedback for matched credit dicts
+        """
+        table = GradingTable(
+            [
+                {'error_percent': '0', 'feedback': 'Exact %%ANSWER%%'},
+                {'error_percent': '10', 'score': '0.5'},
+            ],
+            10.0,
+            'Within %%STUDENT_ERROR%%',
+        )
+        self.assertEqual(
+            'Exact 10.0',
+            table.get_feedback_message(0, '10', 0.0),
+        )
+        self.assertEqual(
+            'Within 5.0',
+            table.get_feedback_message(1, '9.5', 5.0),
+        )
+        self.assertEqual('Within --', table.get_feedback_message(-1, '', 0))
+
     @ddt.data(
         # feedback_message, score, result
         (None, 0, ''),
@@ -450,6 +643,53 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         test_result = self.xblock.get_hint_message()
         self.assertEquals(result, test_result)
 
+    def test_student_view_hint_messages(self):
+        """
+        Checks hints are sent with the student view for view.js to cycle
+        """
+        self.xblock.hints = ['hint 1', 'hint 2']
+        self.xblock.hint_counter = 3
+        fragment = self.xblock.student_view()
+        self.assertDictEqual(
+            {
+                'autosave_interval': 0,
+                'hint_counter': 3,
+                'hint_messages': [
+                    'Hint (1 of 2): hint 1',
+                    'Hint (2 of 2): hint 2',
+                ],
+                'submit_all': False,
+            },
+            fragment.json_init_args,
+        )
+
+    @ddt.data(
+        # xblock settings, data, result hint_counter
+        ({}, {'hint_counter': 4}, 4),
+        ({}, {'hint_counter': 'ABC'}, 1),
+        ({}, {}, 1),
+        ({'PERSIST_HINT_COUNTER': False}, {'hint_counter': 4}, 1),
+    )
+    @ddt.unpack
+    def test_set_hint_counter(self, xblock_settings, data, result):
+        """
+        Checks the hint counter sent by view.js is saved if enabled
+        """
+        self.xblock.hint_counter = 1
+        self.set_xblock_settings(**xblock_settings)
+        self.xblock.set_hint_counter(data)
+        self.assertEqual(result, self.xblock.hint_counter)
+
+    def test_submit_saves_hint_counter(self):
+        """
+        Checks the hint counter is saved with a submission
+        """
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'hint_counter': 2, 'student_answer': '9'})
+        self.xblock.submit(request)
+        self.assertEqual(2, self.xblock.hint_counter)
+
     @ddt.data(
         # score, weight, result
         (0, 0, ''),
@@ -510,6 +750,56 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         )
         self.assertEquals(student_view_html, test_result)
 
+    def test_get_resource_string_cached(self):
+        # pylint: disable=protected-access
+        """
+        Checks that get_resource_string reads each file once per process
+        """
+        path = os.path.join('public', 'view.html')
+        resources._RESOURCE_STRINGS.pop(path, None)
+        with patch(
+            'adaptivenumericinput.resources.pkg_resources.resource_string',
+            return_value='<p>{prompt}</p>',
+        ) as resource_string:
+            AdaptiveNumericInput.get_resource_string('view.html')
+            test_result = AdaptiveNumericInput.get_resource_string(
+                'view.html'
+            )
+        resources._RESOURCE_STRINGS.pop(path, None)
+        self.assertEqual(1, resource_string.call_count)
+        self.assertEqual(u'<p>{prompt}</p>', test_result)
+
+    @ddt.data(
+        u'',
+        u'no fields',
+        u'{a}',
+        u'<p>{a}</p>{b}',
+        u'{{escaped}} {a} }}{{',
+        u'{a!r} {b:>5} {c.real}',
+        u'{a:{width}}',
+    )
+    def test_format_template(self, template):
+        """
+        Checks that FormatTemplate renders like str.format
+        """
+        kwargs = {'a': u'\xe9', 'b': 'x', 'c': 3, 'width': 4}
+        self.assertEqual(
+            template.format(**kwargs),
+            FormatTemplate(template).render(**kwargs),
+        )
+
+    def test_warm_resources(self):
+        # pylint: disable=protected-access
+        """
+        Checks that warm_resources parses every template
+        """
+        resources._TEMPLATES.clear()
+        warm_resources()
+        self.assertEqual(
+            set(resources.TEMPLATE_PATHS),
+            set(resources._TEMPLATES),
+        )
+
     @ddt.data('view.js.min.js', 'view.less.min.css')
     def test_get_resource_url(self, path):
         """
@@ -571,6 +861,34 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         self.xblock.set_score()
         self.assertEqual(self.xblock.score, result)
 
+    def test_set_score_unchanged_not_published(self):
+        """
+        Test set_score only publishes a grade event when the score changes
+        """
+        self.xblock.credit_dict = {'score': 0.5}
+        self.xblock.set_score()
+        self.xblock.set_score()
+        self.assertEqual(1, self.xblock.runtime.publish.call_count)
+        self.xblock.credit_dict = {'score': 1}
+        self.xblock.set_score()
+        self.assertEqual(2, self.xblock.runtime.publish.call_count)
+
+    def test_submit_last_attempt_published(self):
+        """
+        Test a score change on the last attempt, right after the previous
+        grade event, is published at once
+        """
+        self.xblock.max_attempts = 2
+        publish = self.xblock.runtime.publish
+        self.submit_answer('5')
+        self.submit_answer('10')
+        self.assertEqual(1.0, self.xblock.score)
+        self.assertEqual(
+            [0.5, 1.0],
+            [call[0][2]['value'] for call in publish.call_args_list],
+        )
+        self.assertEqual(1.0, self.xblock.published_score)
+
     def test_hint_response(self):
         """
         Test hint response json handler returns correct result
@@ -642,6 +960,161 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
             test_result_response.json_body,
         )
 
+    @ddt.data(
+        # count_attempts, max_attempts, saved, student answer
+        (0, 0, True, '9'),
+        (0, 1, True, '9'),
+        (1, 1, False, ''),
+    )
+    @ddt.unpack
+    def test_autosave_response(
+            self,
+            count_attempts,
+            max_attempts,
+            saved,
+            result_student_answer,
+    ):
+        """
+        Test autosave response handler saves drafts while attempts remain
+        """
+        self.xblock.count_attempts = count_attempts
+        self.xblock.max_attempts = max_attempts
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'student_answer': '9'})
+        test_result_response = self.xblock.autosave_response(request)
+        self.assertEqual(result_student_answer, self.xblock.student_answer)
+        # Added for test_result_response json_body
+        # pylint: disable=no-member
+        self.assertDictEqual(
+            {'status': 'success', 'saved': saved},
+            test_result_response.json_body,
+        )
+
+    def test_student_view_autosave_interval(self):
+        """
+        Checks the autosave interval is sent to view.js in milliseconds
+        """
+        self.set_xblock_settings(AUTOSAVE_INTERVAL=2.5)
+        fragment = self.xblock.student_view()
+        self.assertEqual(2500, fragment.json_init_args['autosave_interval'])
+
+    def test_submit_all_disabled(self):
+        """
+        Test submit all handler is refused unless SUBMIT_ALL is enabled
+        """
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'answers': []})
+        test_result_response = self.xblock.submit_all(request)
+        # Added for test_result_response json_body
+        # pylint: disable=no-member
+        self.assertDictEqual(
+            {'status': 'error'},
+            test_result_response.json_body,
+        )
+
+    def test_submit_all(self):
+        # pylint: disable=protected-access
+        """
+        Test submit all handler grades and saves every block on the page
+        """
+        self.set_xblock_settings(SUBMIT_ALL=True)
+        self.xblock.scope_ids.usage_id = u'block-a'
+        sibling = self.make_an_xblock()
+        sibling.scope_ids.usage_id = u'block-b'
+        sibling.runtime = self.xblock.runtime
+        outside = self.make_an_xblock()
+        blocks = {
+            u'block-b': sibling,
+            u'block-c': object(),
+            u'block-e': outside,
+        }
+        self.xblock.runtime.get_block = Mock(side_effect=blocks.__getitem__)
+        self.xblock.get_parent = Mock(return_value=Mock(
+            children=[u'block-a', u'block-b', u'block-c', u'block-d'],
+        ))
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'answers': [
+            {'usage_id': u'block-a', 'student_answer': '10'},
+            {'usage_id': u'block-b', 'student_answer': '9'},
+            {'usage_id': u'block-c', 'student_answer': '9'},
+            {'usage_id': u'block-d', 'student_answer': '9'},
+            {'usage_id': u'block-e', 'student_answer': '9'},
+        ]})
+        test_result_response = self.xblock.submit_all(request)
+        # Added for test_result_response json_body
+        # pylint: disable=no-member
+        results = test_result_response.json_body['results']
+        self.assertEqual('success', test_result_response.json_body['status'])
+        self.assertEqual(
+            u'Answer is within 0.0 percent.',
+            results['block-a']['feedback_message'],
+        )
+        self.assertEqual(
+            u'Answer is within 10.0 percent.',
+            results['block-b']['feedback_message'],
+        )
+        self.assertDictEqual({'status': 'error'}, results['block-c'])
+        self.assertDictEqual({'status': 'error'}, results['block-d'])
+        self.assertDictEqual({'status': 'error'}, results['block-e'])
+        self.assertEqual(0, outside.count_attempts)
+        self.assertEqual(1.0, self.xblock.score)
+        self.assertEqual(0.9, sibling.score)
+        sibling_data = sibling._deprecated_per_instance_field_data._data
+        self.assertEqual(1, sibling_data['count_attempts'])
+        self.assertEqual(2, self.xblock.runtime.publish.call_count)
+
+    def test_submit_all_no_attempts_left(self):
+        # pylint: disable=protected-access
+        """
+        Test submit all handler does not save answers of blocks without
+        attempts left
+        """
+        self.set_xblock_settings(SUBMIT_ALL=True)
+        self.xblock.scope_ids.usage_id = u'block-a'
+        sibling = self.make_an_xblock(
+            count_attempts=1,
+            max_attempts=1,
+            student_answer='9',
+            student_answer_float=9.0,
+            score=0.9,
+        )
+        sibling.scope_ids.usage_id = u'block-b'
+        sibling.runtime = self.xblock.runtime
+        self.xblock.runtime.get_block = Mock(return_value=sibling)
+        self.xblock.get_parent = Mock(return_value=Mock(
+            children=[u'block-a', u'block-b'],
+        ))
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'answers': [
+            {'usage_id': u'block-a', 'student_answer': '10'},
+            {'usage_id': u'block-b', 'student_answer': '10'},
+        ]})
+        test_result_response = self.xblock.submit_all(request)
+        # Added for test_result_response json_body
+        # pylint: disable=no-member
+        results = test_result_response.json_body['results']
+        self.assertEqual('success', results['block-b']['status'])
+        self.assertEqual('9', sibling.student_answer)
+        self.assertEqual(9.0, sibling.student_answer_float)
+        self.assertEqual(0.9, sibling.score)
+        sibling_data = sibling._deprecated_per_instance_field_data._data
+        self.assertEqual('9', sibling_data['student_answer'])
+        self.assertEqual(1, self.xblock.runtime.publish.call_count)
+
+    def test_student_view_submit_all(self):
+        """
+        Checks the usage id is sent to view.js in submit all mode
+        """
+        self.set_xblock_settings(SUBMIT_ALL=True)
+        self.xblock.scope_ids.usage_id = u'block-a'
+        init_args = self.xblock.student_view().json_init_args
+        self.assertTrue(init_args['submit_all'])
+        self.assertEqual(u'block-a', init_args['usage_id'])
+
     def test_student_view(self):
         # pylint: disable=protected-access
         """
@@ -665,6 +1138,46 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         self.assertIn(self.xblock.prompt, student_view_html)
         self.assertIn(self.xblock.student_answer, student_view_html)
 
+    def test_student_view_render_cache_disabled(self):
+        # pylint: disable=protected-access
+        """
+        Checks the student view is rendered every time by default
+        """
+        self.xblock.student_view()
+        self.xblock.student_view()
+        self.assertIsNone(self.xblock.get_render_cache())
+        self.assertEqual(0, len(adaptivenumericinput._RENDER_CACHE))
+
+    def test_student_view_render_cache(self):
+        # pylint: disable=protected-access
+        """
+        Checks the student view is reused for matching settings and state
+        """
+        self.set_xblock_settings(RENDER_CACHE_SIZE=10, RENDER_CACHE_TTL=30)
+        self.xblock.runtime.local_resource_url = MagicMock(
+            return_value='/resource/view'
+        )
+        self.addCleanup(adaptivenumericinput._RENDER_CACHE.clear)
+        adaptivenumericinput._RENDER_CACHE.clear()
+        render_student_view = self.xblock.render_student_view
+        self.xblock.render_student_view = MagicMock(
+            side_effect=render_student_view,
+        )
+        fragment = self.xblock.student_view()
+        cached_fragment = self.xblock.student_view()
+        self.assertEqual(1, self.xblock.render_student_view.call_count)
+        self.assertEqual(30, adaptivenumericinput._RENDER_CACHE.ttl)
+        self.assertIsNot(fragment, cached_fragment)
+        self.assertEqual(fragment.content, cached_fragment.content)
+        self.assertEqual(fragment.resources, cached_fragment.resources)
+        self.assertEqual(
+            'AdaptiveNumericInputView',
+            cached_fragment.js_init_fn,
+        )
+        self.xblock.student_answer = '12'
+        self.assertIn('12', self.xblock.student_view().content)
+        self.assertEqual(2, self.xblock.render_student_view.call_count)
+
     def test_submit_non_numeric(self):
         """
         Test submit handler returns bad result for non numeric submission
@@ -751,108 +1264,904 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
             test_result_response.json_body,
         )
 
-    @ddt.file_data('./test_data/validate_field_data.json')
-    def test_validate_field_data(self, **test_dict):
+    def submit_answer(self, student_answer):
         """
-        Checks classmethod validate_field_data
-        tests the instuctor values set in edit
+        Helper that posts student_answer to the submit handler
         """
-        test_data = TestData()
-        test_data.weight = test_dict['weight']
-        test_data.max_attempts = test_dict['max_attempts']
-        validation = set()
-        self.xblock.validate_field_data(validation, test_data)
-        validation_list = list(validation)
-        # Only one validation error should be in set
-        self.assertEquals(1, len(validation_list))
-        self.assertEquals(
-            test_dict['result'],
-            validation_list[0].text,
-        )
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'student_answer': student_answer})
+        return self.xblock.submit(request)
 
-    # Credit Dict
-    def test_copy_credit_no_answer(self):
+    def test_submit_compact_user_state(self):
+        # pylint: disable=protected-access
         """
-        Test copy_credit_dict returns answer with no answer given
+        Checks learner state is saved in one packed field when enabled
         """
-        self.xblock.instructor_answer = 10
-        credit_dict = {}
-        test_result = self.xblock.copy_credit_dict(credit_dict)
-        self.assertIsNotNone(test_result.get('answer'))
-        self.assertEqual(self.xblock.instructor_answer, test_result['answer'])
+        field_data = self.xblock._deprecated_per_instance_field_data
+        field_data.set_many = MagicMock(side_effect=field_data.set_many)
+        self.set_xblock_settings(COMPACT_USER_STATE=True)
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'student_answer': '10', 'hint_counter': 2})
+        self.xblock.submit(request)
+        self.xblock.save()
+        self.assertEqual(1, field_data.set_many.call_count)
+        self.assertEqual(['packed_state'], field_data._data.keys())
+        packed_state = field_data._data['packed_state']
+        self.assertEqual(1, packed_state['count_attempts'])
+        self.assertEqual(2, packed_state['hint_counter'])
+        self.assertEqual(1.0, packed_state['score'])
+        self.assertEqual('10', packed_state['student_answer'])
+        self.assertEqual(10.0, packed_state['student_answer_float'])
+        xblock = self.make_an_xblock(**field_data._data)
+        xblock.runtime.service = self.xblock.runtime.service
+        self.assertEqual(1, xblock.count_attempts)
+        self.assertEqual(1.0, xblock.score)
+        self.assertEqual('10', xblock.student_answer)
 
-    @ddt.data(
-        # instructor_answer, answer, answer_result
-        (5, None, 5),
-        (5, 'asdf', 5),
-        (5, 8, 8),
-    )
-    @ddt.unpack
-    def test_copy_credit_answer(
-            self,
-            instructor_answer,
-            answer,
-            answer_result,
-    ):
+    def test_compact_user_state_migration(self):
+        # pylint: disable=protected-access
         """
-        Test copy_credit_dict returns proper answer
+        Checks unpacked learner state is read and packed on the first save
         """
-        self.xblock.instructor_answer = instructor_answer
-        credit_dict = {'answer': answer}
-        test_result = self.xblock.copy_credit_dict(credit_dict)
-        self.assertIsNotNone(test_result.get('answer'))
-        self.assertEqual(answer_result, test_result['answer'])
+        self.xblock = self.make_an_xblock(
+            count_attempts=2,
+            score=0.5,
+            student_answer='5',
+        )
+        self.set_xblock_settings(COMPACT_USER_STATE=True)
+        self.assertEqual(2, self.xblock.count_attempts)
+        self.assertEqual('5', self.xblock.student_answer)
+        self.xblock.student_answer = '6'
+        self.xblock.save()
+        field_data = self.xblock._deprecated_per_instance_field_data
+        self.assertDictEqual(
+            {'count_attempts': 2, 'score': 0.5, 'student_answer': '6'},
+            field_data._data['packed_state'],
+        )
+        self.assertEqual('5', field_data._data['student_answer'])
+        self.assertEqual('6', self.make_an_xblock(
+            **field_data._data
+        ).packed_state['student_answer'])
 
-    def test_copy_credit_no_err_percent(self):
+    def test_submit_user_state_unpacked(self):
+        # pylint: disable=protected-access
         """
-        Test copy_credit_dict returns error_percent with no error_percent given
+        Checks learner state is saved in its own fields by default
         """
-        credit_dict = {}
-        test_result = self.xblock.copy_credit_dict(credit_dict)
-        self.assertIsNotNone(test_result.get('error_percent'))
-        self.assertEqual(0, test_result['error_percent'])
+        self.submit_answer('10')
+        self.xblock.save()
+        field_data = self.xblock._deprecated_per_instance_field_data
+        self.assertNotIn('packed_state', field_data._data)
+        self.assertEqual(1, field_data._data['count_attempts'])
+        self.assertEqual('10', field_data._data['student_answer'])
 
-    @ddt.data(
-        # error_percent, error_percent_result,
-        (10, 10),
-        (None, 0),
-    )
-    @ddt.unpack
-    def test_copy_credit_err_percent(
-            self,
-            error_percent,
-            error_percent_result,
-    ):
+    def test_submit_stores_credit_reference(self):
+        # pylint: disable=protected-access
         """
-        Test copy_credit_dict returns proper error_percent
+        Checks submit stores a reference to the matched credit dict
+        The credit dict and feedback message are rebuilt from it.
         """
-        credit_dict = {
-            'error_percent': error_percent,
-        }
-        test_result = self.xblock.copy_credit_dict(credit_dict)
-        self.assertIsNotNone(test_result.get('error_percent'))
-        self.assertEqual(error_percent_result, test_result['error_percent'])
+        self.xblock.student_answer = '9'
+        self.submit_answer('9')
+        self.xblock.save()
+        data = self.xblock._deprecated_per_instance_field_data._data
+        self.assertNotIn('credit_dict', data)
+        self.assertEqual(1, data['credit_index'])
+        self.assertEqual(
+            self.xblock.get_grading_table().fingerprint,
+            data['credit_version'],
+        )
+        self.assertAlmostEqual(10.0, data['student_error'])
+        xblock = self.make_an_xblock(**data)
+        self.assertDictEqual(self.xblock.credit_dict, xblock.credit_dict)
+        self.assertNotIn('feedback_message', data)
+        self.assertEqual(
+            self.xblock.feedback_message,
+            xblock.feedback_message,
+        )
+        xblock = self.make_an_xblock(**dict(data, credit_list=[{}]))
+        self.assertDictEqual({}, xblock.credit_dict)
 
     @ddt.data(
-        # error_absolute, error_absolute_result, error_percent_result
-        (10, 10, None),
-        (None, None, 0),
+        # student_answer, credit_list, result
+        ('10', [{'error_percent': '10'}], {'score': 1.0}),
+        ('10', [], {'score': 1.0}),
+        ('5', [], {}),
     )
     @ddt.unpack
-    def test_copy_credit_err_absolute(
-            self,
-            error_absolute,
-            error_absolute_result,
-            error_percent_result,
-    ):
+    def test_get_credit_dict(self, student_answer, credit_list, result):
         """
-        Test copy_credit_dict returns proper error_absolute
+        Checks the credit dict rebuilt for exact and unmatched answers
         """
-        credit_dict = {
-            'error_absolute': error_absolute,
-        }
-        test_result = self.xblock.copy_credit_dict(credit_dict)
-        if error_absolute:
+        self.xblock.credit_list = credit_list
+        self.submit_answer(student_answer)
+        test_result = self.xblock.get_credit_dict()
+        self.assertDictContainsSubset(result, test_result)
+        self.assertEqual(bool(result), bool(test_result))
+
+    def test_claim_attempt_concurrent(self):
+        """
+        Checks concurrent submissions cannot both use the last attempt
+        """
+        self.xblock.max_attempts = 2
+        self.xblock.count_attempts = 1
+        self.xblock.scope_ids.user_id = 7
+        concurrent_xblock = self.make_an_xblock(
+            count_attempts=1,
+            max_attempts=2,
+        )
+        concurrent_xblock.scope_ids = self.xblock.scope_ids
+        self.assertTrue(self.xblock.claim_attempt())
+        self.assertFalse(concurrent_xblock.claim_attempt())
+        self.assertEqual(2, self.xblock.count_attempts)
+        self.assertEqual(1, concurrent_xblock.count_attempts)
+
+    def test_claim_attempt_conflict_retried(self):
+        """
+        Checks a conflicting claim is retried with the counter's count
+        """
+        self.xblock.scope_ids.user_id = 7
+        concurrent_xblock = self.make_an_xblock()
+        concurrent_xblock.scope_ids = self.xblock.scope_ids
+        self.assertTrue(self.xblock.claim_attempt())
+        self.assertTrue(concurrent_xblock.claim_attempt())
+        self.assertEqual(1, self.xblock.count_attempts)
+        self.assertEqual(2, concurrent_xblock.count_attempts)
+
+    def test_claim_attempt_after_reset(self):
+        """
+        Checks a learner whose state was reset can claim attempts again
+        """
+        self.xblock.max_attempts = 2
+        self.xblock.scope_ids.user_id = 7
+        with patch('adaptivenumericinput.cache.time.time', return_value=100):
+            self.assertTrue(self.xblock.claim_attempt())
+            self.assertTrue(self.xblock.claim_attempt())
+            self.assertFalse(self.xblock.claim_attempt())
+        reset_xblock = self.make_an_xblock(max_attempts=2)
+        reset_xblock.scope_ids = self.xblock.scope_ids
+        with patch('adaptivenumericinput.cache.time.time', return_value=111):
+            self.assertTrue(reset_xblock.claim_attempt())
+        self.assertEqual(1, reset_xblock.count_attempts)
+
+    def test_claim_attempt_not_saved(self):
+        """
+        Checks an attempt claimed by a submission that failed before
+        saving is given back
+        """
+        self.xblock.max_attempts = 2
+        self.xblock.count_attempts = 1
+        self.xblock.scope_ids.user_id = 7
+        with patch('adaptivenumericinput.cache.time.time', return_value=100):
+            self.assertTrue(self.xblock.claim_attempt())
+        retry_xblock = self.make_an_xblock(count_attempts=1, max_attempts=2)
+        retry_xblock.scope_ids = self.xblock.scope_ids
+        with patch('adaptivenumericinput.cache.time.time', return_value=111):
+            self.assertTrue(retry_xblock.claim_attempt())
+        self.assertEqual(2, retry_xblock.count_attempts)
+
+    def test_local_attempt_counter(self):
+        """
+        Checks compare and set on the local attempt counter
+        """
+        counter = LocalAttemptCounter(maxsize=1)
+        self.assertEqual((True, 1), counter.compare_and_set('a', 0, 1))
+        self.assertEqual((False, 1), counter.compare_and_set('a', 0, 1))
+        self.assertEqual((True, 2), counter.compare_and_set('a', 1, 2))
+        self.assertEqual((True, 1), counter.compare_and_set('b', 0, 1))
+        # 'a' was evicted and starts from the caller's count again
+        self.assertEqual((True, 1), counter.compare_and_set('a', 0, 1))
+
+    def test_get_attempt_counter(self):
+        """
+        Checks attempt counters are created once per class path
+        """
+        path = 'adaptivenumericinput.attempts.LocalAttemptCounter'
+        counter = get_attempt_counter(path)
+        self.assertIsInstance(counter, LocalAttemptCounter)
+        self.assertIs(counter, get_attempt_counter(path))
+        self.assertIsNot(counter, get_attempt_counter())
+
+    def test_submit_rate_limited(self):
+        # pylint: disable=protected-access
+        """
+        Checks submissions over the rate limit are refused unread
+        """
+        self.set_xblock_settings(SUBMIT_RATE=0.1, SUBMIT_BURST=2)
+        self.submit_answer('9')
+        self.submit_answer('8')
+        self.xblock.save()
+        test_result = self.submit_answer('7').json_body
+        self.assertEqual('rate_limited', test_result['status'])
+        self.assertEqual(2, self.xblock.count_attempts)
+        self.assertEqual('8', self.xblock.student_answer)
+        self.assertEqual([], self.xblock._get_fields_to_save())
+
+    def test_local_rate_limiter(self):
+        """
+        Checks token buckets are refilled at the given rate
+        """
+        rate_limiter = LocalRateLimiter()
+        with patch('adaptivenumericinput.ratelimit.time') as clock:
+            clock.time.return_value = 100.0
+            self.assertTrue(rate_limiter.allow('a', 0.5, 2))
+            self.assertTrue(rate_limiter.allow('a', 0.5, 2))
+            self.assertFalse(rate_limiter.allow('a', 0.5, 2))
+            self.assertTrue(rate_limiter.allow('b', 0.5, 2))
+            clock.time.return_value = 101.0
+            self.assertFalse(rate_limiter.allow('a', 0.5, 2))
+            clock.time.return_value = 102.0
+            self.assertTrue(rate_limiter.allow('a', 0.5, 2))
+            self.assertFalse(rate_limiter.allow('a', 0.5, 2))
+            # Buckets are never fuller than the burst
+            clock.time.return_value = 200.0
+            self.assertTrue(rate_limiter.allow('a', 0.5, 2))
+            self.assertTrue(rate_limiter.allow('a', 0.5, 2))
+            self.assertFalse(rate_limiter.allow('a', 0.5, 2))
+
+    def test_get_rate_limiter(self):
+        """
+        Checks rate limiters are created once per class path
+        """
+        path = 'adaptivenumericinput.ratelimit.LocalRateLimiter'
+        rate_limiter = get_rate_limiter(path)
+        self.assertIsInstance(rate_limiter, LocalRateLimiter)
+        self.assertIs(rate_limiter, get_rate_limiter(path))
+
+    def test_handler_metrics_disabled(self):
+        # pylint: disable=protected-access
+        """
+        Checks handlers are not timed unless HANDLER_METRICS is enabled
+        """
+        self.submit_answer('9')
+        self.assertEqual({}, get_handler_metrics().snapshot())
+        self.assertEqual([], get_metrics_exporter().dump())
+        self.assertNotEqual([], self.xblock._get_fields_to_save())
+
+    def test_handler_metrics(self):
+        # pylint: disable=protected-access
+        """
+        Checks each stage of a timed submit is counted and exported
+        """
+        self.set_xblock_settings(HANDLER_METRICS=True)
+        self.submit_answer('9')
+        stages = [
+            'parse', 'answer', 'grade', 'feedback', 'score', 'publish',
+            'respond', 'save', 'total',
+        ]
+        snapshot = get_handler_metrics().snapshot()
+        self.assertEqual(
+            sorted(('submit', stage) for stage in stages),
+            sorted(snapshot),
+        )
+        self.assertEqual(1, snapshot[('submit', 'total')].count)
+        calls = get_metrics_exporter().dump()
+        self.assertEqual(1, len(calls))
+        self.assertEqual('submit', calls[0][0])
+        self.assertEqual(stages, [stage for stage, _ in calls[0][1]])
+        # Fields are written by the timed save
+        self.assertEqual([], self.xblock._get_fields_to_save())
+        self.assertEqual(1, self.xblock.count_attempts)
+
+    def test_histogram(self):
+        """
+        Checks histograms count durations into buckets and merge
+        """
+        histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+        self.assertIsNone(histogram.percentile(50))
+        for seconds in (0.0005, 0.002, 0.003, 0.05, 2.0):
+            histogram.record(seconds)
+        self.assertEqual([1, 2, 1, 1], histogram.counts)
+        self.assertEqual(0.001, histogram.percentile(0))
+        self.assertEqual(0.01, histogram.percentile(50))
+        self.assertEqual(0.1, histogram.percentile(80))
+        self.assertEqual(2.0, histogram.percentile(99))
+        other = Histogram(buckets=(0.001, 0.01, 0.1))
+        other.record(0.0001)
+        histogram.merge(other)
+        self.assertEqual([2, 2, 1, 1], histogram.counts)
+        self.assertEqual(6, histogram.count)
+        self.assertAlmostEqual(2.0556, histogram.sum)
+        self.assertEqual(2.0, histogram.as_dict()['max'])
+
+    def test_handler_metrics_threads(self):
+        """
+        Checks durations recorded by other threads are kept and merged
+        """
+        metrics = HandlerMetrics()
+        metrics.record('submit', 'total', 0.002)
+        thread = threading.Thread(
+            target=metrics.record,
+            args=('submit', 'total', 0.02),
+        )
+        thread.start()
+        thread.join()
+        for _ in range(2):
+            snapshot = metrics.snapshot()
+            self.assertEqual(2, snapshot[('submit', 'total')].count)
+            self.assertAlmostEqual(0.022, snapshot[('submit', 'total')].sum)
+        metrics.clear()
+        self.assertEqual({}, metrics.snapshot())
+
+    def test_handler_metrics_thread_per_request(self):
+        """
+        Checks finished threads are dropped without taking a snapshot
+        """
+        metrics = HandlerMetrics()
+        for _ in range(20):
+            thread = threading.Thread(
+                target=metrics.record,
+                args=('submit', 'total', 0.001),
+            )
+            thread.start()
+            thread.join()
+        # pylint: disable=protected-access
+        self.assertLessEqual(len(metrics._threads), 1)
+        self.assertEqual(20, metrics.snapshot()[('submit', 'total')].count)
+
+    def test_metrics_exporters(self):
+        """
+        Checks the log and statsd exporters send each stage duration
+        """
+        stages = [('grade', 0.0015), ('total', 0.002)]
+        with patch('adaptivenumericinput.metrics.log') as log:
+            LogExporter().export('submit', stages)
+        self.assertEqual(
+            'handler=submit grade=0.001500 total=0.002000',
+            log.info.call_args[0][0] % log.info.call_args[0][1:],
+        )
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.settimeout(5)
+        exporter = StatsdExporter()
+        exporter.port = listener.getsockname()[1]
+        exporter.export('submit', stages)
+        self.assertEqual(
+            'adaptivenumericinput.submit.grade:1.500|ms\n'
+            'adaptivenumericinput.submit.total:2.000|ms',
+            listener.recv(1024).decode('utf8'),
+        )
+
+    def test_get_metrics_exporter(self):
+        """
+        Checks metrics exporters are created once per class path
+        """
+        path = 'adaptivenumericinput.metrics.LogExporter'
+        exporter = get_metrics_exporter(path)
+        self.assertIsInstance(exporter, LogExporter)
+        self.assertIs(exporter, get_metrics_exporter(path))
+        self.assertIsInstance(get_metrics_exporter(), MemoryExporter)
+
+    def post_diagnostics(self):
+        """
+        Helper that posts to the diagnostics handler
+        """
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = '{}'
+        return self.xblock.diagnostics(request)
+
+    def test_diagnostics_staff_only(self):
+        # pylint: disable=no-member
+        """
+        Checks diagnostics are refused to learners
+        """
+        self.xblock.runtime.user_is_staff = False
+        response = self.post_diagnostics()
+        self.assertEqual(403, response.status_code)
+        self.assertNotIn('handlers', response.json_body)
+        user_service = Mock()
+        user_service.get_current_user.return_value.opt_attrs = {
+            'edx-platform.user_is_staff': True,
+        }
+        self.xblock.runtime.service = Mock(return_value=user_service)
+        self.assertTrue(self.xblock.is_staff())
+
+    def test_diagnostics(self):
+        # pylint: disable=no-member
+        """
+        Checks diagnostics report latencies, caches and the credit_list
+        """
+        self.xblock.runtime.user_is_staff = True
+        self.set_xblock_settings(HANDLER_METRICS=True)
+        self.xblock.credit_list = [
+            {'error_percent': '10', 'score': '0.5'},
+            {'answer': '100', 'error_absolute': '1', 'feedback': 'x10'},
+        ]
+        self.submit_answer('9')
+        response = self.post_diagnostics()
+        self.assertEqual(200, response.status_code)
+        result = response.json_body
+        self.assertTrue(result['handler_metrics'])
+        self.assertEqual(
+            ['count', 'max', 'mean', 'p50', 'p95', 'p99'],
+            sorted(result['handlers']['submit']['total']),
+        )
+        self.assertEqual(1, result['handlers']['submit']['total']['count'])
+        self.assertEqual(
+            ['feedback_templates', 'grading_tables', 'render', 'templates'],
+            sorted(result['caches']),
+        )
+        self.assertIsNone(result['caches']['render'])
+        self.assertIn('hits', result['caches']['grading_tables'])
+        self.assertEqual(
+            {
+                'credit_dicts': 2,
+                'common_mistakes': 1,
+                'boundaries': 4,
+                'regions': 9,
+                'feedback_templates': 2,
+            },
+            result['credit_list'],
+        )
+
+    def test_feedback_message_uses_graded_answer(self):
+        # pylint: disable=protected-access
+        """
+        Checks the feedback message is rendered from the graded answer,
+        not a draft saved after it
+        """
+        self.xblock.credit_list = [
+            {'error_percent': '10', 'feedback': 'You said %%STUDENT_ANSWER%%'},
+        ]
+        self.submit_answer('9')
+        self.assertEqual(u'You said 9', self.xblock.feedback_message)
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'student_answer': '9.5'})
+        self.xblock.save_response(request)
+        self.xblock.save()
+        data = self.xblock._deprecated_per_instance_field_data._data
+        xblock = self.make_an_xblock(**dict(
+            data,
+            credit_list=self.xblock.credit_list,
+        ))
+        self.assertEqual('9.5', xblock.student_answer)
+        self.assertEqual(u'You said 9.0', xblock.feedback_message)
+
+    def test_tracing_disabled(self):
+        """
+        Checks no spans are recorded unless TRACING is enabled
+        """
+        self.submit_answer('9')
+        self.assertEqual([], get_span_sink().dump())
+        self.assertIsNone(get_tracer().get_active_span())
+
+    def test_submit_spans(self):
+        """
+        Checks each stage of a traced submit is a child of its span
+        """
+        self.set_xblock_settings(TRACING=True)
+        self.submit_answer('9')
+        spans = dict(
+            (span['name'], span) for span in get_span_sink().dump()
+        )
+        self.assertEqual(
+            [
+                'claim_attempt', 'get_best_match_credit_dict',
+                'get_feedback_message', 'get_submit_result', 'parse',
+                'set_score', 'submit',
+            ],
+            sorted(spans),
+        )
+        root = spans.pop('submit')
+        self.assertIsNone(root['parent_id'])
+        self.assertEqual('success', root['attributes']['status'])
+        for span in spans.values():
+            self.assertEqual(root['span_id'], span['parent_id'])
+            self.assertEqual(root['trace_id'], span['trace_id'])
+            self.assertLessEqual(root['start'], span['start'])
+        self.assertEqual(
+            {
+                'credit_index': 1,
+                'credit_list_length': 10,
+                'matched': True,
+            },
+            spans['get_best_match_credit_dict']['attributes'],
+        )
+        self.assertEqual(
+            {'score': 0.9},
+            spans['set_score']['attributes'],
+        )
+        self.assertIsNone(get_tracer().get_active_span())
+
+    def test_submit_all_spans(self):
+        """
+        Checks the answers of a traced submit_all are spans of their own
+        """
+        self.set_xblock_settings(SUBMIT_ALL=True, TRACING=True)
+        self.xblock.scope_ids.usage_id = u'block-a'
+        self.xblock.runtime.get_block = Mock(side_effect=KeyError)
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'answers': [
+            {'usage_id': u'block-a', 'student_answer': '10'},
+            {'usage_id': u'block-b', 'student_answer': '9'},
+        ]})
+        self.xblock.submit_all(request)
+        spans = get_span_sink().dump()
+        root = spans[-1]
+        self.assertEqual('submit_all', root['name'])
+        self.assertEqual({'answers': 2}, root['attributes'])
+        answer_spans = [
+            span for span in spans
+            if span['parent_id'] == root['span_id']
+        ]
+        self.assertEqual(
+            [
+                {'status': 'success', 'usage_id': u'block-a'},
+                {'status': 'error', 'usage_id': u'block-b'},
+            ],
+            [span['attributes'] for span in answer_spans],
+        )
+        self.assertIn(
+            answer_spans[0]['span_id'],
+            [span['parent_id'] for span in spans],
+        )
+
+    def test_tracer(self):
+        """
+        Checks spans nest, record errors and are left when they fail
+        """
+        tracer = Tracer()
+        sink = MemorySink(maxlen=2)
+        with tracer.start_span('outer', sink=sink, size=3) as outer:
+            with self.assertRaises(ValueError):
+                with tracer.start_span('inner'):
+                    tracer.start_span('unfinished').__enter__()
+                    raise ValueError()
+            self.assertIs(outer, tracer.get_active_span())
+            outer.set_attribute('done', True)
+        self.assertIsNone(tracer.get_active_span())
+        inner, outer = sink.dump()
+        self.assertEqual({'error': 'ValueError'}, inner['attributes'])
+        self.assertEqual(outer['span_id'], inner['parent_id'])
+        self.assertEqual({'done': True, 'size': 3}, outer['attributes'])
+        self.assertGreaterEqual(outer['duration'], inner['duration'])
+        with tracer.start_span('next', sink=sink):
+            pass
+        self.assertEqual(
+            ['outer', 'next'],
+            [span['name'] for span in sink.dump()],
+        )
+
+    def test_json_file_sink(self):
+        """
+        Checks JsonFileSink appends each span as a JSON line
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        sink = JsonFileSink()
+        sink.path = os.path.join(directory, 'spans.jsonl')
+        self.addCleanup(os.remove, sink.path)
+        tracer = Tracer()
+        with tracer.start_span('submit', sink=sink):
+            with tracer.start_span('parse', numeric=True):
+                pass
+        with open(sink.path) as spans_file:
+            spans = [json.loads(line) for line in spans_file]
+        self.assertEqual(['parse', 'submit'], [
+            span['name'] for span in spans
+        ])
+        self.assertEqual({'numeric': True}, spans[0]['attributes'])
+
+    def test_get_span_sink(self):
+        """
+        Checks span sinks are created once per class path
+        """
+        path = 'adaptivenumericinput.tracing.JsonFileSink'
+        sink = get_span_sink(path)
+        self.assertIsInstance(sink, JsonFileSink)
+        self.assertIs(sink, get_span_sink(path))
+        self.assertIsInstance(get_span_sink(), MemorySink)
+
+    def test_profiling_disabled(self):
+        """
+        Checks handlers are not profiled unless they are sampled
+        """
+        self.xblock.runtime.user_is_staff = False
+        request = TestRequest()
+        request.headers = {'X-AdaptiveNumericInput-Profile': '1'}
+        self.assertFalse(self.xblock.is_profiled(request))
+        self.submit_answer('9')
+        self.assertEqual({}, get_profile_sink().dump())
+
+    def test_profile_sampled(self):
+        """
+        Checks sampled handler calls are profiled per usage id
+        """
+        self.xblock.scope_ids.usage_id = u'block-a'
+        self.set_xblock_settings(PROFILE_SAMPLE_RATE=1)
+        self.submit_answer('9')
+        self.submit_answer('8')
+        profiles = get_profile_sink().dump()
+        self.assertEqual([u'block-a'], list(profiles))
+        self.assertEqual(2, profiles[u'block-a']['requests'])
+        request = TestRequest()
+        self.set_xblock_settings(
+            PROFILE_SAMPLE_RATE=1,
+            PROFILE_USAGE_IDS=[u'block-b'],
+        )
+        self.assertFalse(self.xblock.is_profiled(request))
+        self.set_xblock_settings(PROFILE_SAMPLE_RATE=0.01)
+        with patch('adaptivenumericinput.adaptivenumericinput.random') as rng:
+            rng.random.return_value = 0.5
+            self.assertFalse(self.xblock.is_profiled(request))
+            rng.random.return_value = 0.005
+            self.assertTrue(self.xblock.is_profiled(request))
+
+    def test_profile_header(self):
+        """
+        Checks course staff can profile a handler call with a header
+        """
+        self.xblock.runtime.user_is_staff = True
+        request = TestRequest()
+        self.assertFalse(self.xblock.is_profiled(request))
+        request.headers = {'X-AdaptiveNumericInput-Profile': '1'}
+        self.assertTrue(self.xblock.is_profiled(request))
+
+    def test_sampling_profiler(self):
+        """
+        Checks the sampling profiler counts the stacks of its thread
+        """
+        def busy():
+            """
+            Helper that keeps the thread busy for a while
+            """
+            end = time.time() + 0.1
+            while time.time() < end:
+                pass
+
+        with SamplingProfiler(interval=0.001) as profiler:
+            busy()
+        self.assertTrue(profiler.stacks)
+        self.assertTrue(any(
+            stack.endswith(';busy (tests.py:{line})'.format(
+                line=busy.__code__.co_firstlineno,
+            ))
+            for stack in profiler.stacks
+        ))
+        self.assertEqual(
+            'a;b 2\na;c 1\n',
+            format_collapsed({'a;c': 1, 'a;b': 2}),
+        )
+
+    def test_profile_sinks(self):
+        """
+        Checks profiles are merged in memory or appended to files
+        """
+        sink = MemoryProfileSink(maxsize=1)
+        sink.record(u'block-a', {'a;b': 2})
+        sink.record(u'block-a', {'a;b': 1, 'a': 1})
+        sink.record(u'block-b', {'a': 1})
+        self.assertEqual(
+            {u'block-a': {'requests': 2, 'collapsed': 'a 1\na;b 3\n'}},
+            sink.dump(),
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(rmtree, directory)
+        sink = CollapsedStackFileSink()
+        sink.directory = os.path.join(directory, 'profiles')
+        sink.record(u'block-v1:a+b+c@problem/1', {'a;b': 2})
+        sink.record(u'block-v1:a+b+c@problem/1', {'a': 1})
+        sink.record(u'block-v1:a+b+c@problem/2', {})
+        self.assertEqual(
+            ['block-v1_a+b+c@problem_1.collapsed'],
+            os.listdir(sink.directory),
+        )
+        with open(sink.get_path(u'block-v1:a+b+c@problem/1')) as profile:
+            self.assertEqual('a;b 2\na 1\n', profile.read())
+
+    def test_submit_replay(self):
+        # pylint: disable=protected-access
+        """
+        Checks a repeated submission token is not graded again
+        """
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({
+            'student_answer': '9',
+            'submission_token': 'token-1',
+        })
+        result = self.xblock.submit(request).json_body
+        self.xblock.save()
+        replay_result = self.xblock.submit(request).json_body
+        self.assertDictEqual(result, replay_result)
+        self.assertEqual(1, self.xblock.count_attempts)
+        self.assertEqual(1, self.xblock.runtime.publish.call_count)
+        self.assertEqual([], self.xblock._get_fields_to_save())
+        request.body = json.dumps({
+            'student_answer': '9',
+            'submission_token': 'token-2',
+        })
+        self.xblock.submit(request)
+        self.assertEqual(2, self.xblock.count_attempts)
+        self.assertEqual('token-2', self.xblock.submission_token)
+
+    def test_submit_replay_changed_answer(self):
+        """
+        Checks a repeated submission token with a new answer is graded
+        """
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({
+            'student_answer': '5',
+            'submission_token': 'token-1',
+        })
+        self.xblock.submit(request)
+        self.assertEqual(0.5, self.xblock.score)
+        request.body = json.dumps({
+            'student_answer': '10',
+            'submission_token': 'token-1',
+        })
+        result = self.xblock.submit(request).json_body
+        self.assertEqual(2, self.xblock.count_attempts)
+        self.assertEqual('10', self.xblock.student_answer)
+        self.assertEqual(1.0, self.xblock.score)
+        self.assertEqual(
+            u'Answer is within 0.0 percent.',
+            result['feedback_message'],
+        )
+
+    def test_submit_unchanged_state_not_saved(self):
+        # pylint: disable=protected-access
+        """
+        Checks resubmitting after max attempts leaves no fields to save
+        """
+        self.xblock = self.make_an_xblock(
+            count_attempts=1,
+            max_attempts=1,
+            student_answer='9',
+            student_answer_float=9.0,
+        )
+        self.submit_answer('9')
+        self.assertEqual([], self.xblock._get_fields_to_save())
+        self.submit_answer('8')
+        self.assertEqual([], self.xblock._get_fields_to_save())
+
+    def test_submit_after_max_attempts_not_saved(self):
+        """
+        Checks an answer submitted with no attempts left is not saved, so
+        regrading scores the graded answer
+        """
+        self.xblock.max_attempts = 1
+        self.submit_answer('1')
+        self.assertEqual(0.1, self.xblock.score)
+        self.submit_answer('10')
+        self.assertEqual('1', self.xblock.student_answer)
+        self.assertEqual(1.0, self.xblock.student_answer_float)
+        self.assertEqual(0.1, self.xblock.score)
+
+    def test_submit_saves_changed_state(self):
+        # pylint: disable=protected-access
+        """
+        Checks a graded resubmission only saves the fields that changed
+        """
+        self.submit_answer('9')
+        self.xblock.save()
+        self.submit_answer('9')
+        self.assertEqual(
+            ['count_attempts'],
+            self.xblock._get_fields_to_save(),
+        )
+
+    def test_save_response_unchanged(self):
+        # pylint: disable=protected-access
+        """
+        Checks saving an unchanged draft leaves no fields to save
+        """
+        self.xblock = self.make_an_xblock(student_answer='9')
+        request = TestRequest()
+        request.method = 'POST'
+        request.body = json.dumps({'student_answer': '9'})
+        self.xblock.save_response(request)
+        self.assertEqual([], self.xblock._get_fields_to_save())
+
+    @ddt.file_data('./test_data/validate_field_data.json')
+    def test_validate_field_data(self, **test_dict):
+        """
+        Checks classmethod validate_field_data
+        tests the instuctor values set in edit
+        """
+        test_data = TestData()
+        test_data.weight = test_dict['weight']
+        test_data.max_attempts = test_dict['max_attempts']
+        validation = set()
+        self.xblock.validate_field_data(validation, test_data)
+        validation_list = list(validation)
+        # Only one validation error should be in set
+        self.assertEquals(1, len(validation_list))
+        self.assertEquals(
+            test_dict['result'],
+            validation_list[0].text,
+        )
+
+    # Credit Dict
+    def test_copy_credit_no_answer(self):
+        """
+        Test copy_credit_dict returns answer with no answer given
+        """
+        self.xblock.instructor_answer = 10
+        credit_dict = {}
+        test_result = self.xblock.copy_credit_dict(credit_dict)
+        self.assertIsNotNone(test_result.get('answer'))
+        self.assertEqual(self.xblock.instructor_answer, test_result['answer'])
+
+    @ddt.data(
+        # instructor_answer, answer, answer_result
+        (5, None, 5),
+        (5, 'asdf', 5),
+        (5, 8, 8),
+    )
+    @ddt.unpack
+    def test_copy_credit_answer(
+            self,
+            instructor_answer,
+            answer,
+            answer_result,
+    ):
+        """
+        Test copy_credit_dict returns proper answer
+        """
+        self.xblock.instructor_answer = instructor_answer
+        credit_dict = {'answer': answer}
+        test_result = self.xblock.copy_credit_dict(credit_dict)
+        self.assertIsNotNone(test_result.get('answer'))
+        self.assertEqual(answer_result, test_result['answer'])
+
+    def test_copy_credit_no_err_percent(self):
+        """
+        Test copy_credit_dict returns error_percent with no error_percent given
+        """
+        credit_dict = {}
+        test_result = self.xblock.copy_credit_dict(credit_dict)
+        self.assertIsNotNone(test_result.get('error_percent'))
+        self.assertEqual(0, test_result['error_percent'])
+
+    @ddt.data(
+        # error_percent, error_percent_result,
+        (10, 10),
+        (None, 0),
+    )
+    @ddt.unpack
+    def test_copy_credit_err_percent(
+            self,
+            error_percent,
+            error_percent_result,
+    ):
+        """
+        Test copy_credit_dict returns proper error_percent
+        """
+        credit_dict = {
+            'error_percent': error_percent,
+        }
+        test_result = self.xblock.copy_credit_dict(credit_dict)
+        self.assertIsNotNone(test_result.get('error_percent'))
+        self.assertEqual(error_percent_result, test_result['error_percent'])
+
+    @ddt.data(
+        # error_absolute, error_absolute_result, error_percent_result
+        (10, 10, None),
+        (None, None, 0),
+    )
+    @ddt.unpack
+    def test_copy_credit_err_absolute(
+            self,
+            error_absolute,
+            error_absolute_result,
+            error_percent_result,
+    ):
+        """
+        Test copy_credit_dict returns proper error_absolute
+        """
+        credit_dict = {
+            'error_absolute': error_absolute,
+        }
+        test_result = self.xblock.copy_credit_dict(credit_dict)
+        if error_absolute:
             self.assertIsNotNone(test_result.get('error_absolute'))
         else:
             self.assertIsNotNone(test_result.get('error_percent'))
@@ -907,11 +2216,10 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
 
     def test_get_best_credit_empty(self):
         """
-        Test get_best_match_credit_dict returns none for empty high_score_list
+        Test get_best_match_credit_dict returns none when nothing matches
         """
-        self.xblock.get_credit_dicts_score_list = MagicMock(
-            return_value=[],
-        )
+        self.xblock.credit_list = [{'error_percent': '10'}]
+        self.xblock.student_answer_float = 5.0
         test_result = self.xblock.get_best_match_credit_dict()
         self.assertFalse(test_result)
 
@@ -930,9 +2238,7 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         """
         self.xblock.instructor_answer = 10.0
         self.xblock.student_answer_float = 10.0
-        self.xblock.get_credit_dicts_score_list = MagicMock(
-            return_value=score_list,
-        )
+        self.xblock.credit_list = score_list
         test_result = self.xblock.get_best_match_credit_dict()
         self.assertTrue(test_result.get('score'))
         self.assertEqual(test_result['score'], 1.0)
@@ -988,26 +2294,179 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         """
         Test get_best_match_credit_dict returns best dict in list
         """
-        def get_score_dict(*args):
-            """
-            Helper function to build mock dict list
-            """
-            score_dict = {
-                'error_percent': args[0],
-                'error_absolute': args[1],
-                'score':  args[2],
+        self.xblock.credit_list = [
+            {
+                'error_percent': error_percent,
+                'error_absolute': error_absolute,
+                'score': score,
             }
-            return score_dict
-        score_dict_list = []
-        for score_args in score_args_list:
-            score_dict_list.append(get_score_dict(*score_args))
-        self.xblock.get_credit_dicts_score_list = MagicMock(
-            return_value=score_dict_list,
-        )
+            for error_percent, error_absolute, score in score_args_list
+        ]
         self.xblock.student_answer_float = 9.0
         self.xblock.instructor_answer = 10.0
         test_result = self.xblock.get_best_match_credit_dict()
-        self.assertDictEqual(result_dict, test_result)
+        self.assertDictContainsSubset(result_dict, test_result)
+
+    @ddt.data(
+        # student_answer_float, result index
+        (10.0, 0),
+        (9.95, 1),
+        (-10.0, 2),
+        (3.0, 3),
+        (13.0, 3),
+        (2.0, None),
+        (-12.0, None),
+    )
+    @ddt.unpack
+    def test_grading_table_best_match(self, student_answer_float, result):
+        """
+        Test GradingTable best_match resolves overlapping intervals
+        """
+        table = GradingTable(
+            [
+                {'error_percent': '0', 'score': '1'},
+                {'error_absolute': '0.1', 'score': '0.9'},
+                {'answer': '-10', 'error_percent': '10', 'score': '0.5'},
+                {'error_absolute': '7', 'score': '0.2'},
+            ],
+            10.0,
+        )
+        match = table.best_match(student_answer_float)
+        if result is None:
+            self.assertIsNone(match)
+        else:
+            self.assertEqual(result, match[0])
+
+    def test_grading_table_matches_score_list(self):
+        """
+        Test GradingTable best_match agrees with scoring every credit dict
+        """
+        random = Random(7)
+        credit_list = []
+        for _ in range(200):
+            credit_dict = {
+                'answer': str(random.choice([10, -10, 0, 2.5, 1e6])),
+                'score': str(random.choice([0, 0.2, 0.5, 0.9, 1])),
+            }
+            if random.random() < 0.6:
+                credit_dict['error_percent'] = str(random.randint(0, 50))
+            if random.random() < 0.6:
+                credit_dict['error_absolute'] = str(random.randint(0, 5))
+            credit_list.append(credit_dict)
+        self.xblock.credit_list = credit_list
+        table = self.xblock.get_grading_table()
+        answers = [
+            random.uniform(-20, 20) for _ in range(500)
+        ] + [10.0, 10.5, 15.0, 0.0, -5.0, 1e6, 1.1e6]
+        for student_answer_float in answers:
+            self.xblock.student_answer_float = student_answer_float
+            score_list = self.xblock.get_credit_dicts_score_list()
+            score_list.sort(key=lambda x: x['error_absolute'])
+            score_list.sort(key=lambda x: x['error_percent'])
+            match = table.best_match(student_answer_float)
+            if not score_list:
+                self.assertIsNone(match)
+                continue
+            best_credit_dict = score_list[0]
+            self.assertEqual(
+                (
+                    best_credit_dict['credit_score'],
+                    best_credit_dict['student_error'],
+                ),
+                match[1:],
+            )
+            self.assertEqual(
+                table.credit_dicts[match[0]]['error_percent'],
+                score_list[0]['error_percent'],
+            )
+            self.assertEqual(
+                table.credit_dicts[match[0]]['error_absolute'],
+                score_list[0]['error_absolute'],
+            )
+
+    def assert_grade_many_matches_submit(self, answers, result):
+        """
+        Helper that checks grade_many results against single submissions
+        """
+        scores, indexes, student_errors = result
+        self.assertEqual(len(answers), len(scores))
+        table = self.xblock.get_grading_table()
+        for position, answer in enumerate(answers):
+            self.xblock.student_answer_float = answer
+            self.xblock.credit_dict = self.xblock.get_best_match_credit_dict()
+            self.xblock.set_score()
+            self.assertEqual(self.xblock.score, scores[position])
+            match = table.best_match(answer)
+            if match is None:
+                self.assertEqual(-1, indexes[position])
+                self.assertNotEqual(student_errors[position],
+                                    student_errors[position])
+            else:
+                self.assertEqual(match[0], indexes[position])
+                self.assertEqual(match[2], student_errors[position])
+
+    def grade_many_answers(self):
+        """
+        Helper that builds a credit list and answers for grade_many
+        """
+        random = Random(11)
+        self.xblock.instructor_answer = 10.0
+        self.xblock.credit_list = [
+            {'error_percent': '0', 'score': '1'},
+            {'error_percent': '10', 'score': '0.666'},
+            {'answer': '-10', 'error_absolute': '1', 'score': '0.3'},
+            {'answer': '0', 'error_percent': '5', 'error_absolute': '0.5'},
+            {'error_absolute': '1.0000004', 'score': '0.7'},
+        ]
+        return [random.uniform(-15, 15) for _ in range(300)] + [
+            10.0, 11.0, 11.0000000001, 11.0000003, 0.0, -9.0, float('nan'),
+        ]
+
+    def test_grade_many(self):
+        """
+        Test grade_many agrees with grading answers one at a time
+        """
+        answers = self.grade_many_answers()
+        result = self.xblock.grade_many(answers)
+        self.assert_grade_many_matches_submit(answers, result)
+
+    def test_grade_many_without_numpy(self):
+        """
+        Test grade_many falls back to array.array without NumPy
+        """
+        answers = self.grade_many_answers()
+        with patch(
+            'adaptivenumericinput.grading._import_numpy',
+            return_value=None,
+        ):
+            result = self.xblock.grade_many(array('d', answers))
+        self.assertIsInstance(result[0], array)
+        self.assert_grade_many_matches_submit(answers, result)
+
+    def test_grade_many_empty_credit_list(self):
+        """
+        Test grade_many only gives credit for the exact answer
+        """
+        self.xblock.credit_list = []
+        self.xblock.instructor_answer = 10.0
+        scores, indexes, _ = self.xblock.grade_many([10.0, 9.0])
+        self.assertEqual([1.0, 0.0], list(scores))
+        self.assertEqual([-1, -1], list(indexes))
+
+    def test_grading_table_rounding_margin(self):
+        """
+        Test GradingTable best_match honors errors rounded to 6 decimals
+        """
+        table = GradingTable(
+            [
+                {'error_percent': '10', 'score': '1'},
+                {'error_absolute': '1.0000004', 'score': '0.9'},
+            ],
+            10.0,
+        )
+        self.assertEqual(0, table.best_match(11.0000000001)[0])
+        self.assertEqual(1, table.best_match(11.0000003)[0])
+        self.assertIsNone(table.best_match(11.00001))
 
     @ddt.data(
         # the_answer, err%, err abs, score, score result, err result(%,abs)
@@ -1078,23 +2537,8 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         """
         Test get_credit_dicts_score_list returns best credit dicts
         """
-        def mock_copy_credit_dict(*args):
-            """
-            Helper to mock credit dicts
-            """
-            # pylint: disable=unused-argument
-            return {
-                'answer': 99,
-                'error_percent': 99,
-                'error_absolute': 99,
-                'score': 99,
-            }
-
         # Values in list are mocked, this is only needed to iterate
-        self.xblock.credit_list = score_error_tuples
-        self.xblock.copy_credit_dict = MagicMock(
-            side_effect=mock_copy_credit_dict,
-        )
+        self.xblock.credit_list = [{} for _ in score_error_tuples]
         self.xblock.get_credit_dict_score_and_error = MagicMock(
             side_effect=score_error_tuples,
         )
@@ -1105,10 +2549,164 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
             del credit_dict['answer']
             del credit_dict['error_percent']
             del credit_dict['error_absolute']
+            del credit_dict['feedback']
             del credit_dict['score']
+            del credit_dict['student_answer']
         result_score_error_list.sort(key=lambda x: x['student_error'])
         self.assertListEqual(result_list, result_score_error_list)
 
+    def test_get_credit_score_list_table_unchanged(self):
+        """
+        Test get_credit_dicts_score_list does not modify the shared table
+        """
+        self.xblock.credit_list = [{'error_percent': '10', 'score': '0.5'}]
+        self.xblock.student_answer = '9.5'
+        self.xblock.student_answer_float = 9.5
+        table = self.xblock.get_grading_table()
+        score_list = self.xblock.get_credit_dicts_score_list()
+        score_list[0]['score'] = 1.0
+        self.assertEqual(1, len(score_list))
+        self.assertEqual(0.5, table.credit_dicts[0]['score'])
+        self.assertNotIn('credit_score', table.credit_dicts[0])
+
+    def test_get_grading_table_cached(self):
+        """
+        Test get_grading_table is shared by blocks with the same settings
+        """
+        credit_list = [{'error_percent': '10', 'score': '0.5'}]
+        other_xblock = AdaptiveNumericInputTestCase.make_an_xblock(
+            credit_list=[dict(credit_list[0])],
+        )
+        self.xblock.credit_list = credit_list
+        table = self.xblock.get_grading_table()
+        self.assertIs(table, other_xblock.get_grading_table())
+        other_xblock.instructor_answer = 5
+        self.assertIsNot(table, other_xblock.get_grading_table())
+
+    def test_get_grading_table_fingerprinted_once(self):
+        """
+        Test get_grading_table only fingerprints a new credit_list
+        """
+        patcher = patch.object(
+            adaptivenumericinput,
+            'get_grading_table',
+            wraps=adaptivenumericinput.get_grading_table,
+        )
+        with patcher as get_grading_table:
+            table = self.xblock.get_grading_table()
+            self.assertIs(table, self.xblock.get_grading_table())
+            self.assertEqual(1, get_grading_table.call_count)
+            self.xblock.credit_list = [{'error_percent': '1'}]
+            self.assertNotEqual(
+                table.fingerprint,
+                self.xblock.get_grading_table().fingerprint,
+            )
+            self.xblock.feedback_default = 'Close'
+            self.xblock.get_grading_table()
+            self.assertEqual(3, get_grading_table.call_count)
+        self.assertEqual(
+            grading_table_fingerprint([{'b': '1', 'a': '2'}], 10.0),
+            grading_table_fingerprint([{'a': '2', 'b': '1'}], 10.0),
+        )
+
+    def test_get_grading_table_changed_in_place(self):
+        """
+        Test get_grading_table rebuilds a credit_list changed in place
+        """
+        self.xblock.credit_list = [{'error_percent': '10', 'score': '0.5'}]
+        self.assertEqual(1, len(self.xblock.get_grading_table().credit_dicts))
+        self.xblock.credit_list.append({'error_percent': '20'})
+        self.assertEqual(2, len(self.xblock.get_grading_table().credit_dicts))
+        self.xblock.credit_list[0]['score'] = '1'
+        self.assertEqual(
+            1.0,
+            self.xblock.get_grading_table().grade(9.5)[0],
+        )
+
+    def test_submit_non_string_feedback(self):
+        """
+        Test a credit dict with non string feedback does not break others
+        """
+        self.xblock.credit_list = [
+            {'answer': '100', 'error_percent': '1', 'feedback': 5},
+            {'error_percent': '10', 'score': '0.5'},
+        ]
+        result = self.submit_answer('9.5').json_body
+        self.assertEqual(
+            u'Answer is within 10.0 percent.',
+            result['feedback_message'],
+        )
+        result = self.submit_answer('100').json_body
+        self.assertEqual(u'5', result['feedback_message'])
+
+    def test_grading_table_normalized(self):
+        """
+        Test GradingTable normalizes every credit dict once
+        """
+        table = GradingTable(
+            [
+                {'answer': '5', 'error_absolute': '1', 'score': '2'},
+                {'feedback': 'Exact'},
+            ],
+            10.0,
+        )
+        self.assertEqual(
+            (
+                {
+                    'answer': 5.0,
+                    'error_percent': None,
+                    'error_absolute': 1.0,
+                    'feedback': None,
+                    'score': 1.0,
+                },
+                {
+                    'answer': 10.0,
+                    'error_percent': 0,
+                    'error_absolute': None,
+                    'feedback': 'Exact',
+                    'score': 1.0,
+                },
+            ),
+            table.credit_dicts,
+        )
+
+    def test_lru_cache_ttl(self):
+        """
+        Test LRUCache items expire after ttl seconds
+        """
+        cache = LRUCache(maxsize=2, ttl=10)
+        with patch('adaptivenumericinput.cache.time.time', return_value=100):
+            cache.set('a', 1)
+        with patch('adaptivenumericinput.cache.time.time', return_value=109):
+            self.assertEqual(1, cache.get('a'))
+        with patch('adaptivenumericinput.cache.time.time', return_value=110):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, len(cache))
+
+    def test_lru_cache_evicts(self):
+        """
+        Test LRUCache evicts the least recently used item
+        """
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(
+            {
+                'size': 2,
+                'maxsize': 2,
+                'hits': 3,
+                'misses': 1,
+                'evictions': 1,
+            },
+            cache.get_stats(),
+        )
+
     def test_workbench_scenarios(self):
         """
         Checks workbench scenarios for a default scenario
@@ -1118,3 +2716,435 @@ class AdaptiveNumericInputTestCase(unittest.TestCase):
         test_result = self.xblock.workbench_scenarios()
         self.assertEquals(result_title, test_result[0][0])
         self.assertIn(basic_scenario, test_result[0][1])
+
+
+class RegradeTestCase(unittest.TestCase):
+    """
+    Tests for regrading stored student answers
+    """
+    blocks = {
+        'block-1': {
+            'credit_list': [{'error_percent': '10', 'score': '0.5'}],
+            'instructor_answer': 10.0,
+        },
+    }
+
+    @classmethod
+    def make_lines(cls, rows):
+        """
+        Helper that exports (course_id, key, student_id, state) as JSON lines
+        """
+        return [
+            json.dumps({
+                'course_id': course_id,
+                'module_state_key': module_state_key,
+                'student_id': student_id,
+                'state': json.dumps(state),
+            }) + '\n'
+            for course_id, module_state_key, student_id, state in rows
+        ]
+
+    def test_regrade(self):
+        """
+        Test regrade scores stored answers and skips unusable rows
+        """
+        lines = self.make_lines([
+            ('course', 'block-1', 1, {
+                'student_answer': '9.5', 'count_attempts': 1, 'score': 0.0,
+            }),
+            ('course', 'block-1', 2, {
+                'student_answer': '10', 'count_attempts': 2, 'score': 1.0,
+            }),
+            ('course', 'block-1', 3, {
+                'student_answer': 'abc', 'count_attempts': 1,
+            }),
+            ('course', 'block-1', 4, {'student_answer': '10'}),
+            ('course', 'block-2', 5, {
+                'student_answer': '10', 'count_attempts': 1,
+            }),
+            ('other', 'block-1', 6, {
+                'student_answer': '10', 'count_attempts': 1,
+            }),
+        ])
+        results = list(regrade(
+            lines,
+            self.blocks,
+            course_id='course',
+            processes=1,
+        ))
+        self.assertEqual(
+            [
+                {
+                    'credit_index': 0,
+                    'feedback_message': 'Answer is within 10.0 percent.',
+                    'module_state_key': 'block-1',
+                    'old_score': 0.0,
+                    'score': 0.5,
+                    'student_error': 5.0,
+                    'student_id': 1,
+                },
+                {
+                    'credit_index': 0,
+                    'feedback_message': 'Answer is within 10.0 percent.',
+                    'module_state_key': 'block-1',
+                    'old_score': 1.0,
+                    'score': 1.0,
+                    'student_error': 0.0,
+                    'student_id': 2,
+                },
+            ],
+            results,
+        )
+
+    def test_regrade_process_pool(self):
+        """
+        Test regrade keeps input order across worker processes
+        """
+        lines = self.make_lines([
+            ('course', 'block-1', student_id, {
+                'student_answer': str(8 + student_id % 5 * 0.5),
+                'count_attempts': 1,
+            })
+            for student_id in range(50)
+        ])
+        results = list(regrade(
+            iter(lines),
+            self.blocks,
+            processes=2,
+            batch_size=7,
+        ))
+        self.assertEqual(
+            range(50),
+            [result['student_id'] for result in results],
+        )
+        self.assertEqual(
+            list(regrade(lines, self.blocks, processes=1)),
+            results,
+        )
+
+    def test_regrade_packed_state(self):
+        """
+        Test regrade unpacks state saved with COMPACT_USER_STATE
+        """
+        lines = self.make_lines([
+            ('course', 'block-1', 1, {
+                'packed_state': {
+                    'student_answer': '9.5', 'count_attempts': 1,
+                    'score': 0.0,
+                },
+            }),
+        ])
+        results = list(regrade(lines, self.blocks, processes=1))
+        self.assertEqual(1, len(results))
+        self.assertEqual(0.5, results[0]['score'])
+        self.assertEqual(0.0, results[0]['old_score'])
+
+    def test_regrade_saved_draft(self):
+        """
+        Test regrade grades the submitted answer, not a later saved draft
+        """
+        lines = self.make_lines([
+            ('course', 'block-1', 1, {
+                'student_answer': '10', 'student_answer_float': 9.5,
+                'count_attempts': 1, 'score': 0.5,
+            }),
+            ('course', 'block-1', 2, {
+                'student_answer': '10', 'student_answer_float': None,
+                'count_attempts': 1, 'score': 0.0,
+            }),
+        ])
+        results = list(regrade(lines, self.blocks, processes=1))
+        self.assertEqual([1], [result['student_id'] for result in results])
+        self.assertEqual(0.5, results[0]['score'])
+        self.assertEqual(5.0, results[0]['student_error'])
+
+    def test_read_blocks(self):
+        """
+        Test read_blocks keys block settings by usage id
+        """
+        lines = [
+            json.dumps(dict(self.blocks['block-1'], usage_id='block-1')),
+            '\n',
+        ]
+        blocks = read_blocks(lines)
+        self.assertEqual(FEEDBACK_DEFAULT, blocks['block-1'].pop(
+            'feedback_default'
+        ))
+        self.assertEqual(self.blocks, blocks)
+
+
+class DistributionTestCase(unittest.TestCase):
+    """
+    Tests for streaming answer distributions
+    """
+    blocks = {
+        'block-1': {
+            'credit_list': [
+                {'error_percent': '10', 'score': '0.5'},
+                {'answer': '100', 'error_percent': '1', 'score': '0'},
+            ],
+            'instructor_answer': 10.0,
+        },
+    }
+
+    def test_answer_sketch(self):
+        """
+        Test AnswerSketch quantiles are within its relative accuracy
+        """
+        answers = [float(answer) for answer in range(-200, 801)]
+        sketch = AnswerSketch()
+        self.assertIsNone(sketch.quantile(0.5))
+        for answer in answers:
+            sketch.add(answer)
+        self.assertEqual(1001, sketch.count)
+        self.assertEqual(1, sketch.zero)
+        self.assertEqual((-200.0, 800.0), (sketch.min, sketch.max))
+        for quantile in (0.0, 0.01, 0.1, 0.25, 0.5, 0.9, 0.99, 1.0):
+            expected = answers[int(quantile * (len(answers) - 1))]
+            self.assertLessEqual(
+                abs(sketch.quantile(quantile) - expected),
+                0.01 * abs(expected) + 1e-9,
+            )
+        histogram = sketch.get_histogram()
+        self.assertEqual(1001, sum(count for _, _, count in histogram))
+        self.assertEqual((0.0, 0.0, 1), histogram[
+            [low for low, _, _ in histogram].index(0.0)
+        ])
+        for low, high, _ in histogram:
+            self.assertLessEqual(low, high)
+        halves = AnswerSketch(), AnswerSketch()
+        for index, answer in enumerate(answers):
+            halves[index % 2].add(answer)
+        halves[0].merge(halves[1])
+        self.assertEqual(sketch.get_histogram(), halves[0].get_histogram())
+        self.assertEqual(sketch.quantile(0.5), halves[0].quantile(0.5))
+
+    def test_answer_sketch_bounded(self):
+        """
+        Test AnswerSketch merges its smallest buckets to bound memory
+        """
+        sketch = AnswerSketch(max_buckets=10)
+        for exponent in range(-50, 50):
+            sketch.add(10.0 ** exponent)
+        self.assertEqual(10, len(sketch.positive))
+        self.assertEqual(100, sketch.count)
+        self.assertAlmostEqual(1e49, sketch.quantile(1.0), delta=1e47)
+
+    def test_frequent_answers(self):
+        """
+        Test FrequentAnswers keeps the answers given most often
+        """
+        frequent = FrequentAnswers(capacity=2)
+        other = FrequentAnswers(capacity=2)
+        for index in range(1000):
+            frequent.add(1.0)
+            frequent.add(float(index))
+            if index % 3 == 0:
+                other.add(2.5)
+        self.assertLessEqual(len(frequent.counts), 4)
+        self.assertEqual(1.0, frequent.top(1)[0][0])
+        self.assertLessEqual(1000 - 1000 // 3, frequent.top(1)[0][1])
+        frequent.merge(other)
+        self.assertEqual(
+            [1.0, 2.5],
+            [answer for answer, _ in frequent.top(2)],
+        )
+        self.assertEqual(2334, frequent.count)
+
+    def test_aggregate_states(self):
+        """
+        Test aggregate_states counts each learner's submitted answer
+        """
+        rows = [
+            ('block-1', {'count_attempts': 1, 'student_answer': '9'}),
+            ('block-1', {'count_attempts': 1, 'student_answer_float': 10.0}),
+            ('block-1', {'count_attempts': 2, 'student_answer': '100'}),
+            ('block-1', {'packed_state': {
+                'count_attempts': 1, 'student_answer_float': 100.0,
+            }}),
+            ('block-1', {'count_attempts': 1, 'student_answer': '42'}),
+            ('block-1', {'count_attempts': 1, 'student_answer': 'abc'}),
+            ('block-1', {'count_attempts': 1, 'student_answer': 'inf'}),
+            ('block-1', {'student_answer': '5'}),
+            ('block-2', {'count_attempts': 1, 'student_answer': '5'}),
+        ]
+        distributions = aggregate_states(iter(rows), self.blocks)
+        self.assertEqual(['block-1'], list(distributions))
+        result = distributions['block-1'].as_dict(top=2)
+        self.assertEqual(7, result['learners'])
+        self.assertEqual(2, result['non_numeric'])
+        self.assertEqual((9.0, 100.0), (result['min'], result['max']))
+        self.assertAlmostEqual(42.0, result['quantiles']['0.5'], delta=0.5)
+        self.assertEqual(
+            [
+                {
+                    'answer': 100.0,
+                    'count': 2,
+                    'score': 0.0,
+                    'credit_index': 1,
+                },
+                {
+                    'answer': 9.0,
+                    'count': 1,
+                    'score': 0.5,
+                    'credit_index': 0,
+                },
+            ],
+            result['top_wrong_answers'],
+        )
+        json.dumps(result)
+        distribution = AnswerDistribution(
+            distributions['block-1'].table,
+        )
+        distribution.add_answer(42.0)
+        distribution.merge(distributions['block-1'])
+        self.assertEqual(8, distribution.learners)
+        self.assertEqual(
+            [(42.0, 2), (100.0, 2)],
+            distribution.wrong_answers.top(2),
+        )
+
+    def test_add_state_counts_graded_answer(self):
+        """
+        Test add_state counts the graded answer rather than a saved draft
+        """
+        distribution = AnswerDistribution(
+            get_block_grading_table(self.blocks['block-1']),
+        )
+        distribution.add_state({
+            'count_attempts': 1,
+            'student_answer': '5',
+            'student_answer_float': 100.0,
+        })
+        self.assertEqual(1, distribution.learners)
+        self.assertEqual([(100.0, 1)], distribution.wrong_answers.top(1))
+
+    def test_read_states(self):
+        """
+        Test read_states yields the state of exported StudentModule rows
+        """
+        lines = RegradeTestCase.make_lines([
+            ('course', 'block-1', 1, {'student_answer': '9'}),
+            ('other', 'block-1', 2, {'student_answer': '8'}),
+        ]) + ['\n']
+        self.assertEqual(
+            [('block-1', {'student_answer': '9'})],
+            list(read_states(lines, course_id='course')),
+        )
+        self.assertEqual(2, len(list(read_states(lines))))
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    """
+    Tests for the grading benchmarks
+    """
+    def test_credit_list_tolerances(self):
+        """
+        Test benchmarked credit lists grade with each size and tolerance
+        """
+        # pylint: disable=protected-access
+        for size in (1, 10, 101):
+            for tolerance in TOLERANCES:
+                credit_list = adaptivenumericinput._synthetic_credit_list(
+                    10.0,
+                    size,
+                    tolerance,
+                )
+                self.assertEqual(size, len(credit_list))
+                self.assertEqual(
+                    size,
+                    len(GradingTable(credit_list, 10.0).credit_dicts),
+                )
+                self.assertTrue(all(
+                    'error_' + tolerance in credit_dict
+                    for credit_dict in credit_list
+                ))
+
+    def test_make_answers(self):
+        """
+        Test make_answers draws numeric answers repeatably
+        """
+        answers = make_answers(20, seed=3)
+        self.assertEqual(answers, make_answers(20, seed=3))
+        self.assertEqual(20, len(answers))
+        self.assertTrue(all(float(answer) for answer in answers))
+
+    def test_run_benchmark(self):
+        """
+        Test run_benchmark measures every operation, size and tolerance
+        """
+        results = run_benchmark(sizes=(1, 10), iterations=3)
+        self.assertEqual(3, results['iterations'])
+        self.assertEqual(
+            len(OPERATIONS) * 2 * len(TOLERANCES),
+            len(results['results']),
+        )
+        for result in results['results']:
+            self.assertEqual(3, result['iterations'])
+            self.assertLessEqual(result['p50_us'], result['p99_us'])
+        json.dumps(results)
+
+    def test_compare_results(self):
+        """
+        Test compare_results returns results slower than the baseline
+        """
+        def results(*p50_us):
+            """
+            Helper that returns results with the given medians
+            """
+            return {'results': [
+                {
+                    'operation': 'submit',
+                    'size': size,
+                    'tolerance': 'percent',
+                    'p50_us': p50,
+                }
+                for size, p50 in zip((1, 10, 100), p50_us)
+            ]}
+        baseline = results(100.0, 100.0, 0.0)
+        regressions = compare_results(
+            results(120.0, 150.0, 10.0),
+            baseline,
+        )
+        self.assertEqual([10], [result['size'] for result in regressions])
+        self.assertEqual(100.0, regressions[0]['baseline_p50_us'])
+        self.assertEqual(1.5, regressions[0]['ratio'])
+        self.assertEqual(
+            2,
+            len(compare_results(results(120.0, 150.0), baseline, 0.1)),
+        )
+        self.assertEqual([], compare_results(results(), baseline))
+
+
+class ImportTestCase(unittest.TestCase):
+    """
+    Guards the import cost of the grading core
+    """
+    def test_grading_import(self):
+        """
+        Test grading modules import without XBlock, Django or pkg_resources
+        and faster than the XBlock itself
+        """
+        code = (
+            'import json, sys, time\n'
+            'start = time.time()\n'
+            'import adaptivenumericinput.grading\n'
+            'import adaptivenumericinput.regrade\n'
+            'import adaptivenumericinput.distribution\n'
+            'import adaptivenumericinput.storage\n'
+            'grading_seconds = time.time() - start\n'
+            'loaded = [name for name in (\n'
+            '    "django", "numpy", "pkg_resources", "xblock",\n'
+            ') if name in sys.modules]\n'
+            'start = time.time()\n'
+            'from adaptivenumericinput import AdaptiveNumericInput\n'
+            'xblock_seconds = time.time() - start\n'
+            'print(json.dumps([loaded, grading_seconds, xblock_seconds]))\n'
+        )
+        output = subprocess.check_output(
+            [sys.executable, '-c', code],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        loaded, grading_seconds, xblock_seconds = json.loads(output)
+        self.assertEqual([], loaded)
+        self.assertLess(grading_seconds, xblock_seconds)
@@ -0,0 +1,213 @@
+"""
+    Tracing spans around the stages of a submission.
+    A span times one stage along with attributes describing it, spans
+    started inside another are its children and belong to its trace.
+"""
+from collections import deque
+
+import json
+import random
+import threading
+import time
+
+from .utils import get_backend
+
+
+# Finished spans kept by MemorySink
+MEMORY_SINK_SIZE = 10000
+
+_SPAN_SINKS = {}
+
+
+def _new_id():
+    return '{id:016x}'.format(id=random.getrandbits(64))
+
+
+class NullSpan(object):
+    """
+    Stands in for a span that is not recorded
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        """
+        Ignores the attribute
+        """
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    # pylint: disable=too-many-instance-attributes
+    """
+    One timed stage of a trace
+    Spans are used as context managers, a span is the parent of the
+    spans its thread enters before leaving it.  Finished spans are
+    recorded by the sink of their trace.
+    """
+    def __init__(self, tracer, name, sink, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.sink = sink
+        self.attributes = attributes
+        self.span_id = _new_id()
+        self.parent_id = None
+        self.trace_id = self.span_id
+        self.start = None
+        self.end = None
+
+    def __enter__(self):
+        parent = self.tracer.get_active_span()
+        if parent is not None:
+            self.parent_id = parent.span_id
+            self.trace_id = parent.trace_id
+            if self.sink is None:
+                self.sink = parent.sink
+        self.tracer.push(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.time()
+        self.tracer.pop(self)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        if self.sink is not None:
+            self.sink.record(self)
+        return False
+
+    def set_attribute(self, key, value):
+        """
+        Describes the span with a JSON serializable value
+        """
+        self.attributes[key] = value
+
+    def as_dict(self):
+        """
+        Returns the span as JSON serializable values
+        """
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.end - self.start,
+            'attributes': self.attributes,
+        }
+
+
+class Tracer(object):
+    """
+    Keeps the spans each thread is inside of
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def _get_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = []
+            self._local.stack = stack
+        return stack
+
+    def get_active_span(self):
+        """
+        Returns the innermost span of this thread, or None
+        """
+        stack = self._get_stack()
+        if stack:
+            return stack[-1]
+        return None
+
+    def push(self, span):
+        """
+        Makes span the innermost span of this thread
+        """
+        self._get_stack().append(span)
+
+    def pop(self, span):
+        """
+        Leaves span and any spans left open inside it
+        """
+        stack = self._get_stack()
+        while stack:
+            if stack.pop() is span:
+                break
+
+    def start_span(self, name, sink=None, **attributes):
+        """
+        Returns a span to enter, recorded by sink or by its parent's sink
+        """
+        return Span(self, name, sink, attributes)
+
+
+class MemorySink(object):
+    """
+    Keeps the most recent finished spans in a ring buffer
+    """
+    def __init__(self, maxlen=MEMORY_SINK_SIZE):
+        self._spans = deque(maxlen=maxlen)
+
+    def clear(self):
+        """
+        Removes every span
+        """
+        self._spans.clear()
+
+    def record(self, span):
+        """
+        Keeps a finished span
+        """
+        self._spans.append(span.as_dict())
+
+    def dump(self):
+        """
+        Returns the kept spans, oldest first
+        """
+        return list(self._spans)
+
+
+class JsonFileSink(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Appends finished spans to a file as JSON lines, for offline analysis
+    """
+    path = 'adaptivenumericinput_spans.jsonl'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        """
+        Writes a finished span
+        """
+        line = json.dumps(span.as_dict(), sort_keys=True) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as spans_file:
+                spans_file.write(line)
+
+
+_TRACER = Tracer()
+
+
+def get_tracer():
+    """
+    Returns the process wide tracer
+    """
+    return _TRACER
+
+
+def get_span_sink(path=None):
+    """
+    Returns the process wide span sink for a dotted class path
+    Returns a MemorySink if path is not set.  Sinks record each finished
+    span, see JsonFileSink.
+    """
+    return get_backend(_SPAN_SINKS, path, MemorySink)
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 """
-Make '_' a no-op so we can scrape strings
+Make '_' a no-op so we can scrape strings, and load configured backends
 """
+from importlib import import_module
 
 
 def _(text):
@@ -9,3 +10,20 @@ def _(text):
     :return text
     """
     return text
+
+
+def get_backend(backends, path, default_class):
+    """
+    Returns the instance kept in 'backends' for a dotted class path
+    The class at path, or default_class if path is not set, is imported
+    and instantiated without arguments on first use.
+    """
+    backend = backends.get(path)
+    if backend is None:
+        backend_class = default_class
+        if path:
+            module_name, class_name = path.rsplit('.', 1)
+            backend_class = getattr(import_module(module_name), class_name)
+        backend = backend_class()
+        backends[path] = backend
+    return backend
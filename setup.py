@@ -51,6 +51,8 @@ setup(
     license='AGPL-3.0',
     packages=[
         'adaptivenumericinput',
+        'adaptivenumericinput.management',
+        'adaptivenumericinput.management.commands',
     ],
     install_requires=[
         'django',